@@ -0,0 +1,109 @@
+import numpy as np
+import argparse, csv, itertools, os, time
+from concurrent.futures import ProcessPoolExecutor
+
+from UrnTrials import genTrialsBatch
+from UrnObserver import lookupConf
+from UrnScoring import feedbackPoints
+
+'''
+Reward slope calibration sweep for the Urn Hazard prediction task
+
+Python version of the simAdd/parSapply sweep in testReward.Rmd. Ideal (add = 0) and biased (add != 0) observers report their confidence on a set of urn blocks, and their points under the feedback rules are compared to the hard maximum (10 points for every correct block, -10 for every incorrect one) for every combination of reward slope, adjustConf bounds and bias.
+
+The block set of each replicate is generated from its own child of one SeedSequence, so results do not depend on the number of workers. Every worker scores a chunk of slopes against all replicates' blocks.
+
+Example:
+    python RewardSweep.py --slopes .01 1 .01 --adds -.5 .5 .02 --out rew_sims.csv
+'''
+
+#Inclusive range of grid values from start to stop in steps of step
+def gridRange(start,stop,step):
+    n = int(round((stop-start)/step))+1
+    return np.round(start+step*np.arange(n),6)
+
+#Generate one replicate's urn blocks and the ideal observer's final belief in the generating urn
+def simBlocks(seed,ntimes):
+    rng = np.random.default_rng(seed)
+    lengths = np.tile(np.arange(1,6),ntimes)
+    gens = rng.integers(0,2,len(lengths))
+    urns,beads = genTrialsBatch('urn',gens,lengths,rng)
+    post = lookupConf('urn',beads)[0]
+    postGen = post[np.arange(len(lengths)),lengths-1]
+    postGen = np.where(gens == 1,postGen,1-postGen)
+    return postGen
+
+#Slider reports of biased observers: confidence in the favoured item is pushed away from .5 by add
+def biasedReports(postGen,adds):
+    # Output: (len(adds), n_blocks) arrays of outcome codes (see feedbackPoints) and confidence values, and the hard maximum points of each block
+    favoured = np.maximum(postGen,1-postGen)
+    sure = np.round(favoured,2) != .5
+    fav = np.clip(favoured[None,:]+np.where(sure,adds[:,None],0),0,1)
+    signed = (fav-.5)/.5 #positive = toward the favoured item
+    conf = np.round(np.abs(signed),2)
+    favCorrect = postGen > .5
+    correct = np.where(signed >= 0,favCorrect,~favCorrect)
+    outcome = np.where(conf == 0,-1,correct.astype(int))
+    maxPoints = np.where(~sure,0,np.where(favCorrect,10,-10))
+    return outcome,conf,maxPoints
+
+#Score one chunk of slopes over every replicate, add and bound setting
+def sweepChunk(job):
+    slopes,adds,bounds,seeds,ntimes = job
+    rows = []
+    reports = []
+    for seed in seeds:
+        reports.append(biasedReports(simBlocks(seed,ntimes),adds))
+    for slp,(lo,hi) in itertools.product(slopes,bounds):
+        points = np.zeros(len(adds))
+        maxPoints = 0
+        for outcome,conf,mp in reports:
+            points += feedbackPoints(outcome,conf,slp,lo,hi).sum(axis = 1)
+            maxPoints += mp.sum()
+        for a,p in zip(adds,points):
+            rows.append((slp,a,lo,hi,p,maxPoints,p/maxPoints))
+    return rows
+
+#Run the full sweep grid across a pool of worker processes
+def runSweep(slopes,adds,bounds,ntimes = 10000,reps = 1,seed = 0,workers = None):
+    seeds = np.random.SeedSequence(seed).spawn(reps)
+    if workers is None:
+        workers = os.cpu_count() or 1
+    chunks = np.array_split(slopes,min(len(slopes),workers*4))
+    jobs = [(c,adds,bounds,seeds,ntimes) for c in chunks if len(c)]
+    rows = []
+    if workers == 1:
+        for job in jobs:
+            rows.extend(sweepChunk(job))
+    else:
+        with ProcessPoolExecutor(max_workers = workers) as pool:
+            for r in pool.map(sweepChunk,jobs):
+                rows.extend(r)
+    return rows
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description = 'Reward slope calibration sweep')
+    parser.add_argument('--slopes',type = float,nargs = 3,default = [.01,1,.01],metavar = ('START','STOP','STEP'))
+    parser.add_argument('--adds',type = float,nargs = 3,default = [-.5,.5,.02],metavar = ('START','STOP','STEP'))
+    parser.add_argument('--loBounds',type = float,nargs = '+',default = [-.5],help = 'loBound values passed to adjustConf')
+    parser.add_argument('--hiBounds',type = float,nargs = '+',default = [.5],help = 'hiBound values passed to adjustConf (paired with --loBounds)')
+    parser.add_argument('--ntimes',type = int,default = 10000,help = 'number of blocks of each length (1-5) per replicate')
+    parser.add_argument('--reps',type = int,default = 1)
+    parser.add_argument('--seed',type = int,default = 0)
+    parser.add_argument('--workers',type = int,default = None)
+    parser.add_argument('--out',type = str,default = 'rew_sims.csv')
+    args = parser.parse_args()
+
+    slopes = gridRange(*args.slopes)
+    adds = gridRange(*args.adds)
+    if len(args.loBounds) != len(args.hiBounds):
+        parser.error('--loBounds and --hiBounds must have the same number of values')
+    bounds = list(zip(args.loBounds,args.hiBounds))
+    start = time.perf_counter()
+    rows = runSweep(slopes,adds,bounds,args.ntimes,args.reps,args.seed,args.workers)
+    with open(args.out,'w',newline = '') as f:
+        w = csv.writer(f)
+        w.writerow(['Slope','Add','LoBound','HiBound','Points','MaxPoints','Reward'])
+        for r in rows:
+            w.writerow([r[0],r[1],r[2],r[3],int(r[4]),int(r[5]),'%.6f'%r[6]])
+    print('%d grid points written to %s in %.2fs'%(len(rows),args.out,time.perf_counter()-start))
@@ -0,0 +1,164 @@
+import numpy as np
+import itertools, time
+
+from UrnFit import cellLogProb, nBins
+from UrnObserver import confTable
+from UrnConfig import defaultConfig
+
+'''
+Adaptive block sequencing for the Urn Hazard prediction task
+
+AdaptiveDesign keeps a posterior over a coarse grid of the subject's model parameters: their belief (urn bias or hazard, depending on the part), report noise and slider compression (the observer model of UrnFit.py). Between blocks it picks the design with the highest expected information about those parameters:
+    - main blocks: the block length and generating item, from what is left of the session's schedule (with balanced = True every length and item is still used as often as in the fixed schedule, and each item gets half of the blocks of every length, so only the order adapts and block length is no cue to the item)
+    - practice blocks: the bead sequence itself, among the sequences the block's generating item plausibly produces (at least plausible times as likely as its most likely sequence, and not ending with the ideal observer favouring the other item), so following the evidence is never marked wrong
+After each block the posterior is updated with the subject's reports.
+
+Information is the mutual information between the parameters and the report on each trial, summed over the trials of a block. Main blocks are compared by information per bead, so longer blocks only win when their extra beads are worth as much. All of the expensive parts are precomputed when the design is created:
+    - log-probability of every report for every bead history and grid point
+    - expected number of times each bead history is seen in a block of each length and generating item
+Choosing a block is then a few small matrix products (about a millisecond, well under one frame).
+
+Bead coding: 0 = orange, 1 = blue. Item coding: 0 = orange/low, 1 = blue/high. Reports are confidence towards item 1 (-1 to 1, 0 = "Not Sure").
+'''
+
+plausible = .2 #practice sequences must be at least this fraction as likely under their item as its most likely sequence
+
+# Parameter grids of the design posterior
+adaptiveGrids = {'urnBias':np.linspace(.55,.95,8),
+                 'hazard':np.linspace(.05,.45,8),
+                 'noise':np.geomspace(.05,1.,6),
+                 'compression':np.linspace(.5,1.2,4)}
+
+#Row of the lookup table (see historyIndex in UrnObserver.py) for a bead history
+def historyRow(seq):
+    val = 0
+    for b in seq:
+        val = 2*val+int(b)
+    return 2**len(seq)-2+val
+
+#Probability of a bead sequence given its generating item under the task's generative model (genTrials)
+def sequenceProb(blkType,seq,gen,cfg):
+    if blkType == 'urn':
+        q = cfg.urnBias
+        return np.prod([q if b == gen else 1-q for b in seq])
+    h = cfg.hazards[gen]
+    p = .5 #the first urn is picked at random
+    for a,b in zip(seq[:-1],seq[1:]):
+        p *= h if a != b else 1-h
+    return p
+
+#Expected visits of every bead history in a block of each length and generating item
+def historyVisits(blkType,lengths,cfg,nHist):
+    # Output: dict of (length, item) -> (nHist,) array
+    visits = {}
+    for L in lengths:
+        for gen in (0,1):
+            v = np.zeros(nHist)
+            for seq in itertools.product((0,1),repeat = L):
+                p = sequenceProb(blkType,seq,gen,cfg)
+                for t in range(1,L+1):
+                    v[historyRow(seq[:t])] += p
+            visits[(L,gen)] = v
+    return visits
+
+#Expected-information block sequencing for one part of the task
+class AdaptiveDesign:
+    def __init__(self,blkType,cfg = defaultConfig,schedule = None,balanced = True,grids = adaptiveGrids,rng = None):
+        self.blkType = blkType
+        self.rng = np.random.default_rng(np.random.randint(2**31)) if rng is None else rng
+        self.cfg = cfg
+        self.balanced = balanced
+        self.maxLen = max(cfg.blockLengths+cfg.instrBlocks)
+        self.posterior = confTable(blkType,cfg,self.maxLen).posterior
+        nHist = 2**(self.maxLen+1)-2
+        beliefs = grids['urnBias'] if blkType == 'urn' else grids['hazard']
+        self.params = [np.asarray(g) for g in np.meshgrid(beliefs,grids['noise'],grids['compression'],indexing = 'ij')]
+        cells = np.arange(nHist*nBins)
+        logP = cellLogProb(blkType,cells,beliefs,grids['noise'],grids['compression'],cfg.slope,self.maxLen)
+        self.logP = logP.reshape(-1,nHist,nBins) #(grid points, histories, reports)
+        p = np.exp(self.logP)
+        self.p = p
+        self.condEntropy = -(p*self.logP).sum(axis = 2) #(grid points, histories)
+        self.logPost = np.full(self.logP.shape[0],-np.log(self.logP.shape[0]))
+        self.visits = historyVisits(blkType,sorted(set(cfg.blockLengths)),cfg,nHist)
+        # What is left of the schedule
+        if schedule is None:
+            lengths = list(cfg.blockLengths)*cfg.niter
+            items = [0,1]*int(len(lengths)/2)
+        else:
+            lengths,items = list(schedule[0]),list(schedule[1])
+        self.lengthsLeft = dict((L,lengths.count(L)) for L in set(lengths))
+        self.itemsLeft = {0:items.count(0),1:items.count(1)}
+        # Each item gets half of the blocks of every length, so block length does not give the item away
+        self.pairsLeft = dict(((L,g),(n+1)//2) for L,n in self.lengthsLeft.items() for g in (0,1))
+        self.nLeft = len(lengths)
+        self.times = []
+
+    #Expected information about the parameters from one report after each bead history
+    def historyInfo(self):
+        w = np.exp(self.logPost-self.logPost.max())
+        w /= w.sum()
+        mix = np.einsum('g,ghr->hr',w,self.p)
+        mixEntropy = -(mix*np.log(np.maximum(mix,1e-300))).sum(axis = 1)
+        return mixEntropy-w @ self.condEntropy
+
+    #Pick the next main block: (length, generating item) with the most information per bead (ties broken at random)
+    def next(self):
+        start = time.perf_counter()
+        info = self.historyInfo()
+        options,utils = [],[]
+        for (L,gen),v in self.visits.items():
+            if self.balanced and (self.lengthsLeft.get(L,0) == 0 or self.itemsLeft[gen] == 0 or self.pairsLeft[(L,gen)] == 0):
+                continue
+            options.append((L,gen))
+            utils.append(v @ info/L)
+        if not options:
+            # Odd number of blocks of a length: its spare block takes whichever item is left
+            options = [(L,gen) for (L,gen) in self.visits if self.lengthsLeft.get(L,0) > 0 and self.itemsLeft[gen] > 0]
+            utils = [self.visits[o] @ info/o[0] for o in options]
+        utils = np.array(utils)
+        best = np.flatnonzero(utils >= utils.max()-1e-9*abs(utils.max()))
+        L,gen = options[best[self.rng.integers(len(best))]]
+        if self.balanced:
+            self.lengthsLeft[L] -= 1
+            self.itemsLeft[gen] -= 1
+            self.pairsLeft[(L,gen)] = max(self.pairsLeft[(L,gen)]-1,0)
+        self.nLeft -= 1
+        self.times.append(time.perf_counter()-start)
+        return L,gen
+
+    #Most informative bead sequence of length L that generating item gen plausibly produces (practice blocks, ties broken at random)
+    def calibration(self,L,gen):
+        start = time.perf_counter()
+        info = self.historyInfo()
+        seqs = list(itertools.product((0,1),repeat = L))
+        probs = np.array([sequenceProb(self.blkType,seq,gen,self.cfg) for seq in seqs])
+        options,utils = [],[]
+        for seq,p in zip(seqs,probs):
+            post = self.posterior[historyRow(seq)]
+            if p < plausible*probs.max() or (post if gen == 1 else 1-post) < .5:
+                continue
+            options.append(seq)
+            utils.append(sum(info[historyRow(seq[:t])] for t in range(1,L+1)))
+        utils = np.array(utils)
+        best = np.flatnonzero(utils >= utils.max()-1e-9*abs(utils.max()))
+        self.times.append(time.perf_counter()-start)
+        return list(options[best[self.rng.integers(len(best))]])
+
+    #Update the posterior with one block: beads seen and the report after each bead
+    def update(self,beads,reports):
+        for t in range(len(reports)):
+            h = historyRow(beads[:t+1])
+            r = int(round((reports[t]+1)*100))
+            self.logPost += self.logP[:,h,r]
+        self.logPost -= np.logaddexp.reduce(self.logPost)
+
+    #Posterior mean of each parameter (belief, noise, compression)
+    def estimate(self):
+        w = np.exp(self.logPost)
+        return tuple(float(w @ g.ravel()) for g in self.params)
+
+    def report(self):
+        belief,noise,comp = self.estimate()
+        times = np.array(self.times) if self.times else np.zeros(1)
+        return 'Adaptive design (%s): belief %.2f, noise %.2f, compression %.2f - %d choices, max %.2f ms'%(self.blkType,belief,noise,comp,len(self.times),1000*times.max())
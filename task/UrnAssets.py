@@ -0,0 +1,53 @@
+import os, sys, time
+
+'''
+Image assets for the Urn Hazard prediction task
+
+Every image the task shows is decoded once at startup and resized to the pixel size it is drawn at on this display (a fraction of the screen height from pl.getDisplayInformation). The ImageStims then upload small textures that need no scaling, and nothing is read from disk once the task is running.
+
+Images are found next to this file (img/), not in the current working directory.
+
+Decoding uses PIL (installed with PsychoPy). Without PIL, the file names are passed to ImageStim as before.
+
+Time decoding for a display height with:
+    python UrnAssets.py 1080
+'''
+
+imgDir = os.path.join(os.path.dirname(os.path.abspath(__file__)),'img')
+
+# Image name: (file, (width, height) as a fraction of the screen height)
+imageSpecs = {'orangeUrn':('OrangeUrn.png',(.1,.12)),
+              'blueUrn':('BlueUrn.png',(.1,.12)),
+              'orangeFullUrn':('OrangeFullUrn.png',(.1,.12)),
+              'blueFullUrn':('BlueFullUrn.png',(.1,.12)),
+              'low':('LowPerson.png',(.11,.12)),
+              'high':('HighPerson.png',(.11,.12))}
+
+#Size in pixels an image is drawn at for a screen height of sy
+def imageSize(name,sy):
+    w,h = imageSpecs[name][1]
+    return (sy*w,sy*h)
+
+#Decode one image and resize it to size (pixels)
+def decodeImage(fname,size):
+    try:
+        from PIL import Image
+    except ImportError:
+        return fname
+    im = Image.open(fname)
+    im = im.convert('RGBA')
+    return im.resize((max(1,int(round(size[0]))),max(1,int(round(size[1])))),Image.LANCZOS)
+
+#Decode every image for a screen height of sy
+def loadImages(sy,imgDir = imgDir,specs = imageSpecs):
+    # Output: dict of image name -> decoded image (PIL Image, or the file name without PIL), ready for visual.ImageStim
+    images = {}
+    for name,(fname,frac) in specs.items():
+        images[name] = decodeImage(os.path.join(imgDir,fname),imageSize(name,sy))
+    return images
+
+if __name__ == '__main__':
+    sy = int(sys.argv[1]) if len(sys.argv) > 1 else 1080
+    start = time.perf_counter()
+    images = loadImages(sy)
+    print('Decoded %d images for a %d pixel high display in %.3fs'%(len(images),sy,time.perf_counter()-start))
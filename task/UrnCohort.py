@@ -0,0 +1,202 @@
+import numpy as np
+import hashlib, json, os, sys, time
+
+import UrnStore
+
+'''
+Incremental cohort loader for Urn Hazard prediction task data
+
+Keeps one merged, memory-mapped copy of every session CSV under a data folder, in <data>/.cohort:
+    - one raw binary file per column (<column>.bin), rows appended in file order
+    - manifest.json with the dtype of every column, the categories of the categorical columns, and the mtime, size, hash and row range of every source CSV
+
+loadCohort only parses session files that are new since the last call and appends them. If a file already in the cohort changed or was removed, the cohort is rebuilt. Files that cannot be parsed (e.g. a truncated row) are skipped with a message and left out of the cohort until they can be read. Codes of categorical columns never change when new sessions are appended (new categories are added at the end).
+
+Known quirks of the CSVs are normalised on the way in:
+    - SideChoisen is renamed SideChosen
+    - Reward rows (Bead == NA) are flagged in IsReward
+    - Centre clicks (Prediction/SideChoisen == None) are flagged in NoResponse, with SideChosen and Prediction set to -1
+
+Usage:
+    cohort = loadCohort('data')
+    conf = cohort['Confidence'][cohort['IsReward'] == 0]
+    subjects = UrnCohort.decode(cohort,'SubjectID')
+'''
+
+cacheName = '.cohort'
+manifestVersion = 1
+
+#Hash of a file's contents
+def fileHash(fname):
+    h = hashlib.sha1()
+    with open(fname,'rb') as f:
+        for chunk in iter(lambda: f.read(1 << 20),b''):
+            h.update(chunk)
+    return h.hexdigest()
+
+#Session CSVs under dataDir, relative to it, in a fixed order
+def sessionFiles(dataDir):
+    fnames = []
+    for root,dirs,files in os.walk(dataDir):
+        dirs[:] = sorted(d for d in dirs if d != cacheName)
+        for f in sorted(files):
+            if f.endswith('.csv'):
+                fnames.append(os.path.relpath(os.path.join(root,f),dataDir))
+    return fnames
+
+#Parse one session CSV into normalised typed columns
+def readSession(fname):
+    cols = UrnStore.readCsv(fname)
+    cols['SideChosen'] = cols.pop('SideChoisen')
+    n = len(cols['BlockType'])
+    cols['IsReward'] = (cols['Bead'] == -1).astype(np.int8)
+    cols['NoResponse'] = (cols['Prediction'] == -1).astype(np.int8)
+    cols['SideChosen'][cols['NoResponse'] == 1] = -1
+    return cols,n
+
+#Empty manifest for a new cohort
+def newManifest():
+    return {'version':manifestVersion,'nrows':0,'columns':{},'categories':{},'files':{}}
+
+#Read the manifest (or start a new one if there is none or it is out of date)
+def readManifest(cacheDir):
+    mname = os.path.join(cacheDir,'manifest.json')
+    if os.path.exists(mname):
+        with open(mname) as f:
+            manifest = json.load(f)
+        if manifest.get('version') == manifestVersion:
+            return manifest
+    return newManifest()
+
+#Write the manifest atomically - it is only written after the column files, so it never points past their end
+def writeManifest(cacheDir,manifest):
+    mname = os.path.join(cacheDir,'manifest.json')
+    with open(mname+'.tmp','w') as f:
+        json.dump(manifest,f)
+    os.replace(mname+'.tmp',mname)
+
+#Append one parsed session to the column files
+def appendSession(cacheDir,manifest,rel,cols,n):
+    for name,arr in cols.items():
+        if name.endswith('_categories'):
+            continue
+        if name+'_categories' in cols and name not in UrnStore.fixedCats:
+            # Map the session's categories onto the cohort's growing list
+            cats = manifest['categories'].setdefault(name,[])
+            lookup = dict((c,i) for i,c in enumerate(cats))
+            remap = []
+            for c in cols[name+'_categories']:
+                if c not in lookup:
+                    lookup[c] = len(cats)
+                    cats.append(str(c))
+                remap.append(lookup[c])
+            arr = np.array(remap+[-1],dtype = np.int32)[arr].astype(np.int16)
+        elif name+'_categories' in cols:
+            manifest['categories'][name] = list(UrnStore.fixedCats[name])
+        dtype = manifest['columns'].setdefault(name,arr.dtype.str)
+        arr = arr.astype(dtype)
+        with open(os.path.join(cacheDir,name+'.bin'),'ab') as f:
+            f.write(arr.tobytes())
+    cats = manifest['categories'].setdefault('File',[])
+    cats.append(rel)
+    fileCodes = np.full(n,len(cats)-1,dtype = np.int16)
+    manifest['columns'].setdefault('File',fileCodes.dtype.str)
+    with open(os.path.join(cacheDir,'File.bin'),'ab') as f:
+        f.write(fileCodes.tobytes())
+
+#Cut the column files back to the rows recorded in the manifest (drops a partly written append)
+def truncateColumns(cacheDir,manifest):
+    for name,dtype in manifest['columns'].items():
+        fname = os.path.join(cacheDir,name+'.bin')
+        if os.path.exists(fname):
+            with open(fname,'r+b') as f:
+                f.truncate(manifest['nrows']*np.dtype(dtype).itemsize)
+
+#Remove every column file and start again
+def clearCache(cacheDir):
+    for f in os.listdir(cacheDir):
+        if f.endswith('.bin') or f == 'manifest.json':
+            os.remove(os.path.join(cacheDir,f))
+    return newManifest()
+
+#Bring the cached cohort up to date with the session files in dataDir
+def updateCohort(dataDir,verbose = False):
+    cacheDir = os.path.join(dataDir,cacheName)
+    os.makedirs(cacheDir,exist_ok = True)
+    manifest = readManifest(cacheDir)
+    fnames = sessionFiles(dataDir)
+
+    # Check files already in the cohort (hash only when mtime or size changed)
+    rebuild = set(manifest['files']) - set(fnames)
+    for rel,info in manifest['files'].items():
+        if rel in rebuild:
+            continue
+        st = os.stat(os.path.join(dataDir,rel))
+        if st.st_mtime != info['mtime'] or st.st_size != info['size']:
+            if fileHash(os.path.join(dataDir,rel)) != info['hash']:
+                rebuild.add(rel)
+            else:
+                info['mtime'],info['size'] = st.st_mtime,st.st_size
+    if rebuild:
+        if verbose:
+            print('Rebuilding cohort (%d changed or removed files)'%len(rebuild))
+        keep,cleared = set(),False
+    else:
+        truncateColumns(cacheDir,manifest)
+        keep,cleared = set(manifest['files']),True
+
+    # Each file is parsed before anything is cleared or appended, so an unreadable file is skipped (and tried again next time) without touching the cohort
+    added,skipped = 0,[]
+    for rel in fnames:
+        if rel in keep:
+            continue
+        fname = os.path.join(dataDir,rel)
+        try:
+            st = os.stat(fname)
+            cols,n = readSession(fname)
+        except (OSError,ValueError,IndexError,KeyError) as e:
+            skipped.append(rel)
+            print('Skipping unreadable session file %s (%s: %s)'%(fname,type(e).__name__,e))
+            continue
+        if not cleared:
+            manifest,cleared = clearCache(cacheDir),True
+        appendSession(cacheDir,manifest,rel,cols,n)
+        manifest['files'][rel] = {'mtime':st.st_mtime,'size':st.st_size,'hash':fileHash(fname),
+                                  'start':manifest['nrows'],'nrows':n}
+        manifest['nrows'] += n
+        added += 1
+    if not cleared:
+        manifest = clearCache(cacheDir)
+    writeManifest(cacheDir,manifest)
+    if verbose:
+        print('%d new session files, %d skipped, %d rows in cohort'%(added,len(skipped),manifest['nrows']))
+    return cacheDir,manifest
+
+#Load the merged cohort as memory-mapped columns, parsing only new or changed session files
+def loadCohort(dataDir,update = True,verbose = False):
+    # Output: dict of read-only column arrays, plus '<column>_categories' arrays for categorical columns
+    if update:
+        cacheDir,manifest = updateCohort(dataDir,verbose)
+    else:
+        cacheDir = os.path.join(dataDir,cacheName)
+        manifest = readManifest(cacheDir)
+    n = manifest['nrows']
+    cohort = {}
+    for name,dtype in manifest['columns'].items():
+        if n == 0:
+            cohort[name] = np.zeros(0,dtype = dtype)
+        else:
+            cohort[name] = np.memmap(os.path.join(cacheDir,name+'.bin'),dtype = dtype,mode = 'r',shape = (n,))
+    for name,cats in manifest['categories'].items():
+        cohort[name+'_categories'] = np.array(cats,dtype = str)
+    return cohort
+
+#Decode a categorical column back to strings ('NA' where the code is -1)
+def decode(cohort,name):
+    return UrnStore.decode(cohort,name)
+
+if __name__ == '__main__':
+    dataDir = sys.argv[1] if len(sys.argv) > 1 else 'data'
+    start = time.perf_counter()
+    cohort = loadCohort(dataDir,verbose = True)
+    print('Loaded in %.3fs'%(time.perf_counter()-start))
@@ -0,0 +1,99 @@
+import json, random, sys
+from collections import namedtuple
+
+'''
+Session configuration for the Urn Hazard prediction task
+
+SessionConfig holds every setting of a session that used to be a module global in UrnTask.py. It is an immutable namedtuple: make variants with cfg._replace(...) or makeConfig(**changes). UrnTask.py passes it explicitly to trialBlockRun, genTrials, feedback and the instruction screens, so several configurations can run in one process (see runHeadless(config = ...) in UrnHeadless.py).
+
+Fields:
+    - niter: number of times each block length is repeated (must be even)
+    - blockLengths: block lengths (number of beads) in the trial blocks
+    - instrBlocks, instrIDs: block lengths and generating items (0 = orange/low, 1 = blue/high) of the practice blocks
+    - urnBias: probability of drawing the frequent bead from an urn
+    - hazards: switch probabilities of the low and high switcher
+    - slope: slope of the reward function (adjustConf in UrnScoring.py)
+    - startScore: points at the start of each part
+    - ub, endow: points above endow that earn the full $10 cash bonus (ub) and the points that earn nothing (endow)
+    - mult, posMult: stimulus size and left/right position as fractions of the screen
+    - displaySize: (width, height) in pixels, or None to ask the display (see UrnStartup.py)
+
+Layout fields (mult, posMult, displaySize) are used when UrnTask.py builds its stimuli at load time. The rest are read for every session.
+
+Load from a JSON file with any subset of the fields, e.g. {"niter": 4, "hazards": [0.1, 0.9]}:
+    cfg = loadConfig('short.json')
+Check a config file with:
+    python UrnConfig.py short.json
+'''
+
+SessionConfig = namedtuple('SessionConfig',['niter','blockLengths','instrBlocks','instrIDs','urnBias','hazards',
+                                            'slope','startScore','ub','endow','mult','posMult','displaySize'])
+
+# Type of every field (used to check and convert values loaded from files)
+fieldTypes = {'niter':int,'blockLengths':(int,),'instrBlocks':(int,),'instrIDs':(int,),'urnBias':float,'hazards':(float,),
+              'slope':float,'startScore':int,'ub':float,'endow':float,'mult':float,'posMult':float,'displaySize':(int,)}
+
+defaultConfig = SessionConfig(niter = 10,blockLengths = (1,2,3,4,5),instrBlocks = (4,),instrIDs = (1,),urnBias = .8,hazards = (.2,.8),
+                              slope = .08,startScore = 100,ub = 660.,endow = 200.,mult = .02,posMult = .3,displaySize = None)
+
+#Convert one field value to its type
+def convertField(name,val):
+    kind = fieldTypes[name]
+    if val is None and name == 'displaySize':
+        return None
+    if isinstance(kind,tuple):
+        return tuple(kind[0](v) for v in val)
+    return kind(val)
+
+#Check a config for values the task cannot run with
+def checkConfig(cfg):
+    if cfg.niter % 2 != 0:
+        raise ValueError('niter must be even (got %d)'%cfg.niter)
+    if len(cfg.instrBlocks) != len(cfg.instrIDs):
+        raise ValueError('instrBlocks and instrIDs must be the same length')
+    if len(cfg.hazards) != 2:
+        raise ValueError('hazards must be (low, high)')
+    for name,vals in [('urnBias',(cfg.urnBias,)),('hazards',cfg.hazards)]:
+        if any(v < 0 or v > 1 for v in vals):
+            raise ValueError('%s must be probabilities'%name)
+    if any(n < 1 for n in cfg.blockLengths+cfg.instrBlocks):
+        raise ValueError('block lengths must be at least 1')
+    return cfg
+
+#Config with some fields changed from base
+def makeConfig(base = defaultConfig,**changes):
+    unknown = set(changes)-set(SessionConfig._fields)
+    if unknown:
+        raise ValueError('unknown config fields: %s'%', '.join(sorted(unknown)))
+    changes = dict((k,convertField(k,v)) for k,v in changes.items())
+    return checkConfig(base._replace(**changes))
+
+#Load a config from a JSON file (fields not in the file keep their default)
+def loadConfig(fname,base = defaultConfig):
+    with open(fname) as f:
+        return makeConfig(base,**json.load(f))
+
+#Save a config as JSON
+def saveConfig(cfg,fname):
+    with open(fname,'w') as f:
+        json.dump(cfg._asdict(),f,indent = 1)
+
+#Switch probability of the 'low' or 'high' person
+def hazardRate(cfg,person):
+    return cfg.hazards[['low','high'].index(person)]
+
+#Shuffled block lengths and generating items of the trial blocks
+def makeSchedule(cfg,rng = random):
+    # Output:
+    #     - trialBlocks: length of each block
+    #     - trialIDs: generating item of each block (0 = orange/low, 1 = blue/high)
+    trialBlocks = list(cfg.blockLengths)*cfg.niter
+    rng.shuffle(trialBlocks)
+    trialIDs = [0,1]*int(len(trialBlocks)/2)
+    rng.shuffle(trialIDs)
+    return trialBlocks,trialIDs
+
+if __name__ == '__main__':
+    cfg = loadConfig(sys.argv[1]) if len(sys.argv) > 1 else defaultConfig
+    for name,val in cfg._asdict().items():
+        print('%s: %s'%(name,val))
@@ -0,0 +1,126 @@
+import os, sys, threading, queue, atexit
+
+'''
+Data writing for the Urn Hazard prediction task
+
+DataWriter takes data rows from the task loop through a queue and writes them to the CSV from a background thread, in batches, so the thread drawing frames never waits on disk I/O.
+
+Every row is also appended to a sidecar journal (<csv name>.journal) as soon as the writer thread receives it. If the task process dies before the CSV is complete, the journal can rebuild it:
+    python UrnData.py recover data/SUBJ_1_CoinTask_<date>.csv.journal
+The journal is removed when the writer is closed normally. It is written by the writer thread as rows arrive, but only synced to disk at each flush() (the task flushes at every block boundary), so a power cut can lose the rows of the current block. A process crash loses nothing that reached the writer thread.
+
+CSV batches are written all or nothing: if a write fails, the file is cut back to where the batch started and the batch is tried again with the next one, so no row is ever written twice.
+'''
+
+#Background CSV writer with an append-only journal
+class DataWriter:
+    def __init__(self,fname,header,batchSize = 50,journal = True):
+        self.fname = fname
+        self.batchSize = batchSize
+        self.closed = False
+        self.dfd = os.open(fname,os.O_WRONLY|os.O_CREAT|os.O_TRUNC,0o644)
+        self.size = 0
+        self.jname = fname+'.journal' if journal else None
+        self.jfd = None
+        if journal:
+            self.jfd = os.open(self.jname,os.O_WRONLY|os.O_CREAT|os.O_APPEND|os.O_TRUNC,0o644)
+        self.rows = queue.Queue()
+        self.error = None
+        self.thread = threading.Thread(target = self.run,name = 'DataWriter',daemon = True)
+        self.thread.start()
+        self.write(",".join(header)+'\n')
+        atexit.register(self.close)
+
+    #Queue one line of text to be written (lines should end with a newline)
+    def write(self,line):
+        if self.closed:
+            raise ValueError('write to closed DataWriter')
+        self.rows.put(line)
+
+    #Queue one data row
+    def writeRow(self,dat_vec):
+        self.write(",".join(map(str,dat_vec))+'\n')
+
+    #Write out everything queued so far - wait = False only requests the flush and returns immediately
+    def flush(self,wait = True):
+        if self.closed:
+            return
+        done = threading.Event()
+        self.rows.put(done)
+        if wait:
+            done.wait()
+            self.raiseError()
+
+    #Flush, stop the writer thread and close the files
+    def close(self):
+        if self.closed:
+            return
+        self.rows.put(None)
+        self.thread.join()
+        self.closed = True
+        os.close(self.dfd)
+        if self.jfd is not None:
+            os.close(self.jfd)
+            if self.error is None:
+                os.remove(self.jname)
+        self.raiseError()
+
+    def raiseError(self):
+        if self.error is not None:
+            err,self.error = self.error,None
+            raise err
+
+    #Write a batch to the CSV, or nothing if the write fails
+    def writeBatch(self,batch):
+        data = ''.join(batch).encode()
+        try:
+            done = 0
+            while done < len(data):
+                done += os.write(self.dfd,data[done:])
+        except Exception:
+            os.ftruncate(self.dfd,self.size)
+            os.lseek(self.dfd,self.size,os.SEEK_SET)
+            raise
+        self.size += len(data)
+
+    #Writer thread: journal each row immediately, write the CSV in batches, sync the journal at each flush
+    def run(self):
+        batch = []
+        while True:
+            item = self.rows.get()
+            try:
+                if isinstance(item,str):
+                    batch.append(item)
+                    if self.jfd is not None:
+                        os.write(self.jfd,item.encode())
+                    if len(batch) < self.batchSize:
+                        continue
+                if batch:
+                    self.writeBatch(batch)
+                    batch = []
+                if isinstance(item,threading.Event) and self.jfd is not None:
+                    os.fsync(self.jfd)
+            except Exception as e:
+                self.error = e
+            if isinstance(item,threading.Event):
+                item.set()
+            elif item is None:
+                return
+
+#Rebuild a CSV from its journal (a partly written last row is dropped)
+def recoverCsv(jname,fname = None):
+    if fname is None:
+        fname = jname[:-len('.journal')] if jname.endswith('.journal') else jname+'.csv'
+    with open(jname) as j:
+        text = j.read()
+    if not text.endswith('\n'):
+        text = text[:text.rfind('\n')+1]
+    with open(fname,'w') as f:
+        f.write(text)
+    return fname
+
+if __name__ == '__main__':
+    if len(sys.argv) == 3 and sys.argv[1] == 'recover':
+        print('Recovered %s'%recoverCsv(sys.argv[2]))
+    else:
+        print('usage: python UrnData.py recover <file.csv.journal>')
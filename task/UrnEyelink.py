@@ -0,0 +1,404 @@
+import numpy as np
+import argparse, queue, re, sys, threading, time
+
+'''
+EyeLink recording for the Urn Hazard prediction task
+
+EyeRecorder connects to the tracker, records for the whole session and sends event messages from the trial loop (trialBlockRun, urnDraw, predict and feedback in UrnTask.py). The task loop never talks to the tracker itself. Every tracker call, including the messages, runs on one background thread ('EyeSamples'), since pylink is not thread safe:
+    - message(text, t) only puts the message on a queue; the sample thread sends it with the EyeLink time offset ('<ms> text'), so its time on the tracker is the flip time t even if it goes out a few ms later
+    - the sample thread pulls every link sample and pushes it into a SampleRing
+    - a second thread ('EyeWriter') drains the ring to <data file>.eye every writeInterval seconds
+SampleRing is a single-producer ring buffer that never locks: the producer never waits for a reader, and a reader that falls behind by more than the ring capacity loses the oldest samples (counted in the report) instead of holding up the sample thread. latest() gives the main thread the newest sample without blocking.
+
+Messages (tracker time is in the EDF, and in <data file>.eyemsg as '<tracker ms>\\t<message>'):
+    - BLOCK_START <block type> <block> <generating item> <main/practice>, BLOCK_END <block type> <block>
+    - TRIALID <block type> <block> <trial> <main/practice> ... TRIAL_RESULT 0 around every trial (block and trial as TrialBlock and TrialNumber in the data file)
+    - DRAW_ONSET <bead>: onset of the "Drawing bead..." screen
+    - RESPONSE_ONSET, RESPONSE <prediction> <confidence>: response screen onset and click
+    - RESPONSE_TIMEOUT: end of the response window without a click (scanner mode), instead of RESPONSE
+    - FEEDBACK <correct> <points>: feedback screen onset
+
+pylink is optional. MockTracker stands in for it with the same subset of the pylink.EyeLink interface and synthetic samples (pupil drift and noise, blinks, and a pupil response to chosen messages), so the recording can be tested without hardware:
+    python UrnEyelink.py --mock 10
+Summarise a recorded session with:
+    python UrnEyelink.py data/SUBJ_CoinTask_<date>.csv.eye
+Calibrate and validate from the Host PC before the session starts.
+Message times come from the task clock (core.getTime), so in UrnHeadless.py sessions, where that clock is simulated, they are not meaningful.
+'''
+
+magic = b'URNEYE01'
+sampleDtype = np.dtype([('time','<f8'),('gx','<f4'),('gy','<f4'),('pupil','<f4')]) #tracker time (ms), gaze (pixels), pupil area
+missingData = -32768. #pylink.MISSING_DATA
+sampleType = 200 #pylink.SAMPLE_TYPE
+leftEye,rightEye = 0,1
+
+###########################
+## LOCK-FREE RING BUFFER ##
+###########################
+
+#Single-producer ring buffer of samples
+class SampleRing:
+    # Counters only grow: head is the number of samples written, reserved the number being written.
+    # The producer moves reserved before writing slots and head after, and readers drop whatever
+    # reserved says may have been overwritten while they copied.
+    def __init__(self,capacity = 2**16,dtype = sampleDtype):
+        self.capacity = capacity
+        self.buf = np.zeros(capacity,dtype = dtype)
+        self.head = 0
+        self.reserved = 0
+
+    #Add samples (producer thread only)
+    def push(self,samples):
+        n = len(samples)
+        if n == 0:
+            return
+        h = self.head
+        if n > self.capacity:
+            h += n-self.capacity
+            samples = samples[n-self.capacity:]
+            n = self.capacity
+        self.reserved = h+n
+        self.buf[np.arange(h,h+n) % self.capacity] = samples
+        self.head = h+n
+
+    #Samples written since counter since
+    def read(self,since):
+        # Output: samples (copy), counter to pass to the next read, number of samples lost since the last read
+        head = self.head
+        start = max(since,head-self.capacity)
+        out = self.buf[np.arange(start,head) % self.capacity]
+        valid = max(start,self.reserved-self.capacity)
+        return out[valid-start:],head,valid-since
+
+    #Newest sample, or None before the first one
+    def latest(self):
+        h = self.head
+        if h == 0:
+            return None
+        s = self.buf[(h-1) % self.capacity].copy()
+        return s if self.reserved-self.capacity < h else None
+
+##################
+## MOCK TRACKER ##
+##################
+
+#Sample of MockTracker (the pylink sample methods the recorder uses)
+class MockSample:
+    def __init__(self,t,gaze,pupil,eye = rightEye):
+        self.t = t
+        self.eye = MockEye(gaze,pupil)
+        self.side = eye
+    def getTime(self):
+        return self.t
+    def isRightSample(self):
+        return self.side == rightEye
+    def isLeftSample(self):
+        return self.side == leftEye
+    def getRightEye(self):
+        return self.eye
+    def getLeftEye(self):
+        return self.eye
+
+class MockEye:
+    def __init__(self,gaze,pupil):
+        self.gaze = gaze
+        self.pupil = pupil
+    def getGaze(self):
+        return self.gaze
+    def getPupilSize(self):
+        return self.pupil
+
+#Stand-in for pylink.EyeLink producing synthetic samples in real time
+class MockTracker:
+    # Arguments:
+    #     - rate: sampling rate (Hz)
+    #     - blinkRate: blinks per second, blinkDur: blink duration (s)
+    #     - evoked: message prefix -> pupil response amplitude (area units, peaks about a second after the message)
+    def __init__(self,rate = 500,blinkRate = .25,blinkDur = .15,evoked = {'DRAW_ONSET':60.,'RESPONSE_ONSET':40.},seed = None):
+        self.rate = rate
+        self.blinkRate = blinkRate
+        self.blinkDur = blinkDur
+        self.evoked = evoked
+        self.rng = np.random.default_rng(seed)
+        self.t0 = time.perf_counter()
+        self.recording = False
+        self.connected = True
+        self.nextSample = None
+        self.blinkEnd = -np.inf
+        self.drift = 0.
+        self.responses = [] #(tracker ms, amplitude)
+        self.messages = [] #(tracker ms, text)
+        self.commands = []
+        self.current = None
+
+    def trackerTime(self):
+        return 1000*(time.perf_counter()-self.t0)
+
+    def isConnected(self):
+        return self.connected
+    def openDataFile(self,fname):
+        self.edf = fname
+    def sendCommand(self,cmd):
+        self.commands.append(cmd)
+    def setOfflineMode(self):
+        self.recording = False
+    def startRecording(self,*args):
+        self.recording = True
+        self.nextSample = self.trackerTime()
+        return 0
+    def stopRecording(self):
+        self.recording = False
+    def closeDataFile(self):
+        pass
+    def receiveDataFile(self,src,dest):
+        return 0
+    def close(self):
+        self.connected = False
+    def eyeAvailable(self):
+        return rightEye
+
+    #Message with an optional leading time offset (ms), as on the tracker
+    def sendMessage(self,text):
+        t = self.trackerTime()
+        m = re.match(r'(-?\d+) (.*)',text)
+        if m:
+            t -= int(m.group(1))
+            text = m.group(2)
+        self.messages.append((t,text))
+        for prefix,amp in self.evoked.items():
+            if text.startswith(prefix):
+                self.responses.append((t,amp))
+        return 0
+
+    #Pupil area at tracker time t (ms)
+    def pupilArea(self,t):
+        self.drift += .5*self.rng.standard_normal()
+        area = 1000.+self.drift+5*self.rng.standard_normal()
+        self.responses = [r for r in self.responses if t-r[0] < 4000] #responses are over after 4s
+        for onset,amp in self.responses:
+            s = (t-onset)/1000.
+            if 0 < s < 4:
+                area += amp*(s/.93)**10.1*np.exp(-10.1*(s/.93-1)) #pupil response function (Hoeks & Levelt 1993)
+        return area
+
+    #Type of the next item in the link queue (sampleType, or 0 if there is nothing new)
+    def getNextData(self):
+        if not self.recording or self.trackerTime() < self.nextSample:
+            return 0
+        t = self.nextSample
+        self.nextSample += 1000./self.rate
+        if t >= self.blinkEnd+1000*self.blinkDur and self.rng.random() < self.blinkRate/self.rate:
+            self.blinkEnd = t+1000*self.blinkDur
+        if t < self.blinkEnd:
+            self.current = MockSample(t,(missingData,missingData),0.)
+        else:
+            gaze = tuple(self.rng.normal(0,15,2))
+            self.current = MockSample(t,gaze,self.pupilArea(t))
+        return sampleType
+
+    def getFloatData(self):
+        return self.current
+
+##############
+## RECORDER ##
+##############
+
+#Connect to an EyeLink (host None = the default 100.1.1.1)
+def connectEyelink(edfName,displaySize,host = None,rate = 500):
+    import pylink
+    tracker = pylink.EyeLink(host) if host else pylink.EyeLink()
+    tracker.openDataFile(edfName)
+    tracker.setOfflineMode()
+    sx,sy = displaySize
+    tracker.sendCommand('screen_pixel_coords = 0 0 %d %d'%(sx-1,sy-1))
+    tracker.sendMessage('DISPLAY_COORDS 0 0 %d %d'%(sx-1,sy-1))
+    tracker.sendCommand('sample_rate %d'%rate)
+    tracker.sendCommand('file_sample_data = LEFT,RIGHT,GAZE,AREA,GAZERES,STATUS')
+    tracker.sendCommand('link_sample_data = LEFT,RIGHT,GAZE,AREA,STATUS')
+    tracker.sendCommand('file_event_filter = LEFT,RIGHT,FIXATION,SACCADE,BLINK,MESSAGE,BUTTON')
+    return tracker
+
+#EDF file name from the subject ID (the host only takes up to 8 letters, digits or underscores)
+def edfName(subID):
+    return ('U'+re.sub(r'[^A-Za-z0-9_]','',str(subID)))[:8]
+
+#Session recording: tracker I/O on a sample thread, samples to <base>.eye, messages to <base>.eyemsg
+class EyeRecorder:
+    def __init__(self,tracker,base,clock = time.perf_counter,edfName = None,ringSize = 2**16,writeInterval = .25):
+        self.tracker = tracker
+        self.base = base
+        self.clock = clock
+        self.edfName = edfName
+        self.ring = SampleRing(ringSize)
+        self.writeInterval = writeInterval
+        self.commands = queue.SimpleQueue()
+        self.f = open(base+'.eye','wb')
+        self.f.write(magic)
+        self.msgFile = open(base+'.eyemsg','w')
+        self.nSamples = 0
+        self.nLost = 0
+        self.nMessages = 0
+        self.maxLag = 0. #longest gap between polls of the tracker (s)
+        self.running = False
+        self.sampler = threading.Thread(target = self.sample,name = 'EyeSamples',daemon = True)
+        self.writer = threading.Thread(target = self.write,name = 'EyeWriter',daemon = True)
+
+    #Start recording and the threads
+    def start(self):
+        self.tracker.startRecording(1,1,1,1)
+        self.running = True
+        self.sampler.start()
+        self.writer.start()
+
+    #Queue a message, timed at t on the recorder's clock (now if None) - never waits on the tracker
+    def message(self,text,t = None):
+        self.commands.put((text,self.clock() if t is None else t))
+
+    #Newest sample (time, gx, gy, pupil) or None
+    def latest(self):
+        return self.ring.latest()
+
+    #Sample thread: send queued messages, pull link samples into the ring
+    def sample(self):
+        tracker = self.tracker
+        last = time.perf_counter()
+        while self.running:
+            self.sendMessages()
+            batch = []
+            while True:
+                kind = tracker.getNextData()
+                if not kind:
+                    break
+                if kind != sampleType:
+                    continue
+                s = tracker.getFloatData()
+                eye = s.getRightEye() if s.isRightSample() else s.getLeftEye()
+                gx,gy = eye.getGaze()
+                batch.append((s.getTime(),gx,gy,eye.getPupilSize()))
+            self.ring.push(np.array(batch,dtype = sampleDtype))
+            now = time.perf_counter()
+            self.maxLag = max(self.maxLag,now-last)
+            last = now
+            time.sleep(.001)
+        self.sendMessages()
+
+    def sendMessages(self):
+        while True:
+            try:
+                text,t = self.commands.get_nowait()
+            except queue.Empty:
+                return
+            offset = max(0,int(round(1000*(self.clock()-t))))
+            self.tracker.sendMessage('%d %s'%(offset,text) if offset else text)
+            self.msgFile.write('%.3f\t%s\n'%(self.tracker.trackerTime()-offset,text))
+            self.nMessages += 1
+
+    #Writer thread: drain the ring to the sample file
+    def write(self):
+        cursor = 0
+        while True:
+            stopping = not self.running
+            samples,cursor,lost = self.ring.read(cursor)
+            self.f.write(samples.tobytes())
+            self.nSamples += len(samples)
+            self.nLost += lost
+            if stopping:
+                return
+            time.sleep(self.writeInterval)
+
+    #Stop recording, write out the last samples and fetch the EDF
+    def close(self):
+        if self.f.closed:
+            return
+        if self.running:
+            self.running = False
+            self.sampler.join()
+            self.writer.join()
+        self.tracker.stopRecording()
+        self.tracker.setOfflineMode()
+        self.tracker.closeDataFile()
+        if self.edfName:
+            self.tracker.receiveDataFile(self.edfName,self.base+'.edf')
+        self.tracker.close()
+        self.f.close()
+        self.msgFile.close()
+
+    def report(self):
+        return 'Eye recording: %d samples (%d lost), %d messages, longest tracker poll gap %.1f ms'%(self.nSamples,self.nLost,self.nMessages,1000*self.maxLag)
+
+#Recorder for the task: kind 'mock' or 'eyelink' (the task has no recorder without eye tracking)
+def openRecorder(kind,base,subID,displaySize,clock = time.perf_counter,host = None):
+    if kind == 'mock':
+        return EyeRecorder(MockTracker(),base,clock)
+    if kind == 'eyelink':
+        name = edfName(subID)
+        return EyeRecorder(connectEyelink(name,displaySize,host),base,clock,edfName = name)
+    raise ValueError('unknown eye tracker %r'%kind)
+
+#Read the samples and messages of a recorded session
+def readEyeData(base):
+    # Arguments:
+    #     - base: data file name (or the .eye file)
+    # Output: samples (structured array of sampleDtype) and a list of (tracker ms, message)
+    if base.endswith('.eye'):
+        base = base[:-4]
+    with open(base+'.eye','rb') as f:
+        data = f.read()
+    if data[:len(magic)] != magic:
+        raise ValueError('%s.eye is not an eye sample file'%base)
+    n = (len(data)-len(magic))//sampleDtype.itemsize
+    samples = np.frombuffer(data,dtype = sampleDtype,count = n,offset = len(magic))
+    return samples,readMessages(base)
+
+#Read the messages of a recorded session as a list of (tracker ms, message)
+def readMessages(base):
+    messages = []
+    with open(base+'.eyemsg') as f:
+        for line in f:
+            t,text = line.rstrip('\n').split('\t',1)
+            messages.append((float(t),text))
+    return messages
+
+#Print a summary of samples and messages
+def summary(samples,messages):
+    lines = ['%d samples, %d messages'%(len(samples),len(messages))]
+    if len(samples) > 1:
+        dt = np.diff(samples['time'])
+        missing = samples['pupil'] <= 0
+        lines.append('Duration %.1fs, median interval %.2f ms, longest gap %.2f ms'%((samples['time'][-1]-samples['time'][0])/1000,np.median(dt),dt.max()))
+        lines.append('Pupil missing in %.1f%% of samples, median area %.0f'%(100*missing.mean(),np.median(samples['pupil'][~missing]) if (~missing).any() else np.nan))
+    kinds = {}
+    for t,text in messages:
+        kinds[text.split(' ')[0]] = kinds.get(text.split(' ')[0],0)+1
+    for k in sorted(kinds):
+        lines.append('  %-16s %d'%(k,kinds[k]))
+    return '\n'.join(lines)
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description = 'Summarise or test eye recordings')
+    parser.add_argument('file',nargs = '?',default = None,help = '<data file>.eye to summarise')
+    parser.add_argument('--mock',type = float,default = 0,help = 'record this many seconds from the mock tracker')
+    parser.add_argument('--out',type = str,default = 'mock')
+    args = parser.parse_args()
+    if args.mock:
+        rec = openRecorder('mock',args.out,'MOCK',(1920,1080))
+        rec.start()
+        end = time.perf_counter()+args.mock
+        trial = 0
+        while time.perf_counter() < end:
+            trial += 1
+            rec.message('TRIALID urn 1 %d main'%trial)
+            rec.message('DRAW_ONSET orange')
+            time.sleep(1.)
+            rec.message('RESPONSE_ONSET')
+            time.sleep(1.)
+            rec.message('RESPONSE orange 0.50')
+            rec.message('TRIAL_RESULT 0')
+        rec.close()
+        print(rec.report())
+        print(summary(*readEyeData(args.out)))
+    elif args.file:
+        print(summary(*readEyeData(args.file)))
+    else:
+        parser.print_usage()
+        sys.exit(1)
@@ -0,0 +1,202 @@
+import numpy as np
+import argparse, csv, os, time
+from collections import namedtuple
+from concurrent.futures import ProcessPoolExecutor
+
+from UrnObserver import buildConfTable, historyIndex
+from UrnSimulate import deadZone
+from UrnConfig import defaultConfig, loadConfig
+
+'''
+Maximum-likelihood fitting of observer models to confidence reports
+
+Fits four parameters per subject to the slider reports logged by recDat (Prediction and Confidence columns):
+    - urnBias: subjective urn bias (urn blocks)
+    - hazard: subjective hazard of the low switcher (hazard blocks, the high switcher is 1-hazard)
+    - noise: SD of the Gaussian report noise (in units of the slider half-width)
+    - compression: scaling of the report towards the centre of the slider
+This is the observer of UrnSimulate.py without a side bias. The noise-free report is compression times the best slider position for the subject's beliefs (lookup table in UrnObserver.py). The recorded confidence is that plus noise, clipped, rounded to .01 and passed through the "Not Sure" dead zone. A small lapse rate mixes in uniform reports, so a single stray click cannot dominate the fit.
+
+Each subject's data is first reduced to sufficient statistics: counts of (block type, bead history, recorded report) cells. The log-likelihood of every cell is computed for the whole parameter grid at once, and a matrix product with the count matrix gives the log-likelihood of the whole grid for a chunk of subjects. The urn and hazard parts only share noise and compression, so the grid search is exact without evaluating the full 4D grid per part. Subject chunks run on a pool of worker processes.
+
+Example (fits every session in data/, through the cohort cache of UrnCohort.py):
+    python UrnFit.py data --out fits.csv
+Sessions run with a session config (UrnConfig.py) are fitted with the same config, so the payoff slope and block lengths match:
+    python UrnFit.py data --config long.json --out fits.csv
+Parameter recovery on simulated participants:
+    python UrnFit.py --sim 200 --model noisy
+'''
+
+FitResult = namedtuple('FitResult',['subjects','urnBias','hazard','noise','compression','logLik','nTrials'])
+
+blkTypes = ['urn','hazard']
+nBins = 201 #recorded reports -1, -.99, ..., 1
+lapse = .01 #probability of a uniformly random report
+
+# Default parameter grids
+defaultGrids = {'urnBias':np.round(np.linspace(.52,.98,24),3),
+                'hazard':np.round(np.linspace(.02,.48,24),3),
+                'noise':np.round(np.geomspace(.02,1.,16),4),
+                'compression':np.round(np.linspace(.4,1.3,10),3)}
+
+#Normal CDF (Abramowitz & Stegun 7.1.26, absolute error below 1.5e-7)
+def normCdf(x):
+    z = np.abs(x)/np.sqrt(2)
+    t = 1/(1+.3275911*z)
+    poly = t*(.254829592+t*(-.284496736+t*(1.421413741+t*(-1.453152027+t*1.061405429))))
+    erf = 1-poly*np.exp(-z*z)
+    return .5*(1+np.sign(x)*erf)
+
+#Sufficient statistics of subjects: counts of (subject, block type, history, report bin)
+def countCells(subj,blk,hist,report):
+    # Arguments (one value per trial row):
+    #     - subj: subject code, blk: 0 = urn, 1 = hazard, hist: lookup table row (historyIndex)
+    #     - report: recorded confidence towards item 1 (blue/high), -1 to 1, 0 = "Not Sure"
+    # Output: (subj, blk, cell, count) arrays, cell = hist*nBins + report bin
+    bins = np.round((np.asarray(report,dtype = float)+1)*100).astype(np.int64)
+    keys = np.stack([subj,blk,np.asarray(hist,dtype = np.int64)*nBins+bins],axis = 1)
+    cells,counts = np.unique(keys,axis = 0,return_counts = True)
+    return cells[:,0],cells[:,1],cells[:,2],counts
+
+#Sufficient statistics of a cohort loaded with UrnCohort.loadCohort
+def cohortStats(cohort):
+    # Output: subject names and the countCells arrays
+    keep = np.asarray(cohort['IsReward']) == 0
+    subj = np.asarray(cohort['SubjectID'])[keep].astype(np.int64)
+    blk = np.asarray(cohort['BlockType'])[keep].astype(np.int64)
+    tnum = np.asarray(cohort['TrialNumber'])[keep].astype(np.int64)
+    bead = np.asarray(cohort['Bead'])[keep].astype(np.int64)
+    pred = np.asarray(cohort['Prediction'])[keep]
+    conf = np.asarray(cohort['Confidence'])[keep].astype(float)
+    # Bead history up to each trial (rows of a block are consecutive, trial numbers count up from 1)
+    val = np.zeros(len(tnum),dtype = np.int64)
+    for t in range(1,tnum.max()+1 if len(tnum) else 1):
+        rows = np.where(tnum == t)[0]
+        if t == 1:
+            val[rows] = bead[rows]
+        else:
+            if np.any(tnum[rows-1] != t-1):
+                raise ValueError('trial rows are not in block order')
+            val[rows] = 2*val[rows-1]+bead[rows]
+    hist = 2**tnum-2+val
+    # Prediction categories (UrnStore.itemCats): orange, blue, low, high - blue and high are item 1
+    sign = np.where(pred < 0,0.,np.where(pred % 2 == 1,1.,-1.))
+    report = np.nan_to_num(sign*conf)
+    names = np.asarray(cohort['SubjectID_categories'])
+    return names,countCells(subj,blk,hist,report)
+
+#Sufficient statistics of simulated participants (output of UrnSimulate.simulate)
+def simStats(sims):
+    n,nparts,nb,maxLen = sims['beads'].shape
+    beads = sims['beads'].reshape(-1,maxLen)
+    hist = historyIndex(beads).reshape(sims['beads'].shape)
+    report = sims['report']
+    valid = hist >= 0
+    subj = np.broadcast_to(np.arange(n)[:,None,None,None],hist.shape)[valid]
+    blk = np.broadcast_to(np.arange(nparts)[None,:,None,None],hist.shape)[valid]
+    names = np.array(['SIM_%d'%(i+1) for i in range(n)])
+    return names,countCells(subj,blk,hist[valid],report[valid])
+
+#Log-probability of every (history, report bin) cell over a grid of beliefs, noise and compression
+def cellLogProb(blkType,cells,beliefs,noise,compression,slp = .08,maxLen = 5):
+    # Output: (n_beliefs, n_noise, n_compression, n_cells) array
+    hist,bins = cells//nBins,cells % nBins
+    v = bins/100.-1
+    best = np.zeros((len(beliefs),len(cells)))
+    for i,b in enumerate(beliefs):
+        if blkType == 'urn':
+            table = buildConfTable('urn',float(b),(.2,.8),slp,maxLen)
+        else:
+            table = buildConfTable('hazard',.8,(float(b),float(1-b)),slp,maxLen)
+        best[i] = table.slider[hist]
+    mu = compression[None,:,None]*best[:,None,:] #(beliefs, compression, cells)
+    sd = noise[None,:,None,None]
+    mu = mu[:,None,:,:]
+    # Edges of the screen region that gives each recorded value
+    lo = np.where(v == 0,-deadZone,np.where(v <= -1,-np.inf,v-.005))
+    hi = np.where(v == 0,deadZone,np.where(v >= 1,np.inf,v+.005))
+    p = normCdf((hi-mu)/sd)-normCdf((lo-mu)/sd)
+    p = (1-lapse)*np.clip(p,0,1)+lapse/nBins
+    return np.log(p)
+
+#Fit one chunk of subjects over the grids
+def fitChunk(job):
+    subj,blk,cells,counts,nsubj,grids,slp,maxLen = job
+    noise,compression = grids['noise'],grids['compression']
+    ll = {}
+    for k,blkType in enumerate(blkTypes):
+        beliefs = grids['urnBias'] if blkType == 'urn' else grids['hazard']
+        sel = blk == k
+        uniq,inv = np.unique(cells[sel],return_inverse = True)
+        C = np.zeros((len(uniq),nsubj))
+        np.add.at(C,(inv,subj[sel]),counts[sel])
+        lp = cellLogProb(blkType,uniq,beliefs,noise,compression,slp,maxLen)
+        ll[blkType] = (lp.reshape(-1,len(uniq)) @ C).reshape(len(beliefs),len(noise),len(compression),nsubj)
+    # Best belief for each part at every (noise, compression), then the best shared (noise, compression)
+    total = ll['urn'].max(axis = 0)+ll['hazard'].max(axis = 0)
+    flat = total.reshape(-1,nsubj).argmax(axis = 0)
+    iN,iC = np.unravel_index(flat,total.shape[:2])
+    s = np.arange(nsubj)
+    iU = ll['urn'][:,iN,iC,s].argmax(axis = 0)
+    iH = ll['hazard'][:,iN,iC,s].argmax(axis = 0)
+    ntrials = np.bincount(subj,weights = counts,minlength = nsubj)
+    return (grids['urnBias'][iU],grids['hazard'][iH],noise[iN],compression[iC],total[iN,iC,s],ntrials)
+
+#Fit every subject of a set of sufficient statistics
+def fitSubjects(names,stats,grids = defaultGrids,cfg = defaultConfig,workers = None,chunkSize = 50):
+    # Arguments:
+    #     - cfg: session config the data was recorded with (slope of the payoff, longest block)
+    subj,blk,cells,counts = stats
+    nsubj = len(names)
+    maxLen = max(cfg.blockLengths+cfg.instrBlocks)
+    if len(cells) and cells.max()//nBins >= 2**(maxLen+1)-2:
+        raise ValueError('data has blocks longer than %d beads, fit with the session config (--config)'%maxLen)
+    starts = list(range(0,nsubj,chunkSize))
+    jobs = []
+    for s in starts:
+        sel = (subj >= s) & (subj < s+chunkSize)
+        jobs.append((subj[sel]-s,blk[sel],cells[sel],counts[sel],min(chunkSize,nsubj-s),grids,cfg.slope,maxLen))
+    if workers is None:
+        workers = os.cpu_count() or 1
+    if workers == 1 or len(jobs) == 1:
+        results = list(map(fitChunk,jobs))
+    else:
+        with ProcessPoolExecutor(max_workers = workers) as pool:
+            results = list(pool.map(fitChunk,jobs))
+    cols = [np.concatenate(c) if results else np.zeros(0) for c in zip(*results)]
+    return FitResult(np.asarray(names),*cols)
+
+#Write fits to a CSV
+def writeFits(fit,fname):
+    with open(fname,'w',newline = '') as f:
+        w = csv.writer(f)
+        w.writerow(['SubjectID','UrnBias','Hazard','Noise','Compression','LogLik','NTrials'])
+        for row in zip(*fit):
+            w.writerow([row[0]]+['%g'%v for v in row[1:]])
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description = 'Fit observer models to confidence reports')
+    parser.add_argument('data',nargs = '?',default = 'data',help = 'data folder (see UrnCohort.py)')
+    parser.add_argument('--sim',type = int,default = 0,help = 'fit this many simulated participants instead (parameter recovery)')
+    parser.add_argument('--model',type = str,default = 'noisy',help = 'observer model of the simulated participants (see UrnSimulate.py)')
+    parser.add_argument('--config',type = str,default = None,help = 'JSON session config the data was recorded with (see UrnConfig.py)')
+    parser.add_argument('--workers',type = int,default = None)
+    parser.add_argument('--out',type = str,default = 'fits.csv')
+    args = parser.parse_args()
+
+    cfg = loadConfig(args.config) if args.config else defaultConfig
+    start = time.perf_counter()
+    if args.sim:
+        import UrnSimulate
+        sims = UrnSimulate.simulate(args.sim,UrnSimulate.models[args.model],cfg,workers = 1)
+        names,stats = simStats(sims)
+    else:
+        import UrnCohort
+        names,stats = cohortStats(UrnCohort.loadCohort(args.data))
+    fit = fitSubjects(names,stats,cfg = cfg,workers = args.workers)
+    writeFits(fit,args.out)
+    print('Fitted %d subjects in %.2fs, written to %s'%(len(names),time.perf_counter()-start,args.out))
+    if args.sim:
+        model = UrnSimulate.models[args.model]
+        print('Generating: urnBias %g, hazard %g, noise %g, compression %g'%(model.urnBias,model.hazards[0],model.noise,model.compression))
+        print('Median fit: urnBias %g, hazard %g, noise %g, compression %g'%tuple(np.median(c) for c in fit[1:5]))
@@ -0,0 +1,276 @@
+import numpy as np
+import contextlib, importlib.util, os, random, sys, time, types
+from collections import namedtuple
+
+from UrnObserver import confTable, historyIndex
+from UrnConfig import defaultConfig, loadConfig
+
+'''
+Headless backend for the Urn Hazard prediction task
+
+Runs full UrnTask.py sessions without a display, eye tracker or participant. The real trial loop (trialBlockRun -> urnDraw -> predict -> feedback -> recDat) is used unchanged. The psychopy and pylink modules are swapped for the in-memory stand-ins below while UrnTask.py is loaded:
+    - the window only counts flips and what was drawn on each frame
+    - core.wait advances a simulated clock instead of sleeping
+    - the participant dialog returns the simulated subject's info, and every key wait gets a space press
+    - the mouse answers the response screen with the slider position chosen by a synthetic-agent policy
+
+A policy is a function policy(blkType, beads, cfg) -> slider position from -1 (fully confident in orange/low) to 1 (fully confident in blue/high), where beads are the beads seen so far in the block (0 = orange, 1 = blue) and cfg is the SessionConfig the session runs with (UrnConfig.py). Positions within the centre dead zone count as "Not Sure".
+
+Example (writes data/<subID>_CoinTask_<date>.csv under the output folder):
+    python UrnHeadless.py --nsessions 10 --policy ideal --out sims
+'''
+
+taskFile = os.path.join(os.path.dirname(os.path.abspath(__file__)),'UrnTask.py')
+beadCodes = {'orange':0,'blue':1}
+
+##############
+## POLICIES ##
+##############
+
+#Ideal observer: optimal slider position from the lookup table in UrnObserver.py, for the session's generative parameters and reward slope
+def idealPolicy(blkType,beads,cfg = defaultConfig):
+    table = confTable(blkType,cfg,max(cfg.blockLengths+cfg.instrBlocks))
+    return table.slider[historyIndex(beads)[0,-1]]
+
+#Random slider positions
+def randomPolicy(rng = None):
+    if rng is None:
+        rng = np.random.default_rng()
+    def policy(blkType,beads,cfg = None):
+        return rng.uniform(-1,1)
+    return policy
+
+policies = {'ideal':idealPolicy,'random':randomPolicy}
+
+###############
+## STAND-INS ##
+###############
+
+#Simulated clock shared by the stand-ins (core.wait advances it instead of sleeping)
+class SimClock:
+    def __init__(self):
+        self.t = 0.
+    def getTime(self):
+        return self.t
+    def reset(self):
+        self.t = 0.
+    def wait(self,secs,hogCPUperiod = 0):
+        self.t += secs
+
+#Window stand-in: counts flips and keeps the stimuli drawn on the current frame
+class HeadlessWindow:
+    frameDur = 1/60.
+    def __init__(self,backend,size = (1920,1080),**kwargs):
+        self.backend = backend
+        self.size = np.array(size)
+        self.nFlips = 0
+        self.drawn = []
+    def flip(self,clearBuffer = True):
+        self.nFlips += 1
+        self.backend.clock.t += self.frameDur
+        if clearBuffer:
+            self.drawn = []
+        return self.backend.clock.t
+    def clearBuffer(self):
+        self.drawn = []
+    def close(self):
+        pass
+
+#Stimulus stand-in: stores its settings, draw() registers it on the window
+class Stim:
+    def __init__(self,win,*args,**kwargs):
+        self.win = win
+        self.args = args
+        self.__dict__.update(kwargs)
+    def draw(self,win = None):
+        self.win.drawn.append(self)
+    def __getattr__(self,name):
+        if name.startswith('set'):
+            attr = name[3].lower()+name[4:]
+            def setter(val,*args,**kwargs):
+                setattr(self,attr,val)
+            return setter
+        raise AttributeError(name)
+
+#Mouse stand-in: moves to the policy's answer and clicks clickDelay seconds after the response screen appears
+class HeadlessMouse:
+    deadZone = 20 #pixels either side of the centre that count as "Not Sure" in predict
+    clickDelay = .5 #simulated response time (s)
+    def __init__(self,backend):
+        self.backend = backend
+        self.pos = (0,0)
+        self.target = None
+        self.resetTime = 0.
+    def setVisible(self,visible):
+        pass
+    def setPos(self,pos):
+        self.pos = tuple(pos)
+    def getPos(self):
+        if self.target is not None:
+            self.pos = self.target
+        return np.array(self.pos)
+    def clickReset(self):
+        self.resetTime = self.backend.clock.t
+    def getPressed(self,getTime = False):
+        pressed,times = [0,0,0],[0.,0.,0.]
+        if self.target is not None and self.backend.clock.t-self.resetTime >= self.clickDelay:
+            self.target = None
+            pressed[0] = 1
+            times[0] = self.backend.clock.t-self.resetTime
+        if getTime:
+            return pressed,times
+        return pressed
+    #Work out where to click for the current response screen
+    def respond(self,blkType,beads,itemNames,bound):
+        slider = float(self.backend.policy(blkType,np.array(beads,dtype = np.int8),self.backend.config))
+        slider = min(max(slider,-1.),1.)
+        # Positive slider = item 1 (blue/high); the left item is itemNames[0]
+        canonical = ['orange','blue'] if blkType == 'urn' else ['low','high']
+        if itemNames[1] != canonical[1]:
+            slider = -slider
+        x = slider*bound
+        if abs(x) < self.deadZone:
+            x = 0.
+        self.target = (x,0.)
+
+#Display information stand-in for pylink
+class DisplayInfo:
+    def __init__(self,width,height):
+        self.width = width
+        self.height = height
+
+#Build the psychopy and pylink stand-in modules for one backend
+def buildModules(backend):
+    visual = types.ModuleType('psychopy.visual')
+    visual.Window = lambda *args,**kwargs: backend.newWindow(*args,**kwargs)
+    for name in ['TextStim','Rect','Circle','ImageStim','BufferImageStim','ElementArrayStim','ShapeStim','Line']:
+        setattr(visual,name,type(name,(Stim,),{}))
+
+    event = types.ModuleType('psychopy.event')
+    event.Mouse = lambda *args,**kwargs: backend.mouse
+    event.waitKeys = lambda keyList = None,**kwargs: ['space']
+    event.getKeys = lambda keyList = None,**kwargs: []
+    event.clearEvents = lambda *args,**kwargs: None
+
+    core = types.ModuleType('psychopy.core')
+    core.wait = backend.clock.wait
+    core.getTime = backend.clock.getTime
+    core.Clock = SimClock
+    core.monotonicClock = backend.clock
+    def quit():
+        raise SystemExit('core.quit() called in headless session')
+    core.quit = quit
+
+    gui = types.ModuleType('psychopy.gui')
+    class Dlg:
+        def __init__(self,title = '',**kwargs):
+            self.data = []
+        def addField(self,label,initial = '',**kwargs):
+            pass
+        def show(self):
+            self.data = list(backend.subInfo)
+            return self.data
+    gui.Dlg = Dlg
+    gui.OK = True
+    gui.CANCEL = False
+
+    psychopy = types.ModuleType('psychopy')
+    psychopy.visual,psychopy.event,psychopy.core,psychopy.gui = visual,event,core,gui
+
+    pylink = types.ModuleType('pylink')
+    pylink.getDisplayInformation = lambda: DisplayInfo(*backend.displaySize)
+
+    return {'psychopy':psychopy,'psychopy.visual':visual,'psychopy.event':event,
+            'psychopy.core':core,'psychopy.gui':gui,'pylink':pylink}
+
+#############
+## BACKEND ##
+#############
+
+HeadlessResult = namedtuple('HeadlessResult',['datafile','totalScore','nFlips','simTime','wallTime'])
+
+#Everything one headless session needs: clock, window, mouse, policy and subject info
+class HeadlessBackend:
+    def __init__(self,policy = idealPolicy,subInfo = ('SIM','1','SIM','SIM'),displaySize = (1920,1080)):
+        self.policy = policy
+        self.config = defaultConfig #session config handed to the policy (set by runHeadless)
+        self.subInfo = subInfo
+        self.displaySize = displaySize
+        self.clock = SimClock()
+        self.mouse = HeadlessMouse(self)
+        self.win = None
+
+    def newWindow(self,*args,**kwargs):
+        self.win = HeadlessWindow(self,**kwargs)
+        return self.win
+
+    #Load a fresh copy of UrnTask.py against the stand-ins
+    def loadTask(self):
+        modules = buildModules(self)
+        saved = dict((k,sys.modules.get(k)) for k in modules)
+        sys.modules.update(modules)
+        try:
+            spec = importlib.util.spec_from_file_location('UrnTask',taskFile)
+            task = importlib.util.module_from_spec(spec)
+            spec.loader.exec_module(task)
+        finally:
+            for k,v in saved.items():
+                if v is None:
+                    sys.modules.pop(k,None)
+                else:
+                    sys.modules[k] = v
+        self.wrapPredict(task)
+        return task
+
+    #Give the mouse the trial context before each response screen
+    def wrapPredict(self,task):
+        predict = task.predict
+        mouse = self.mouse
+        def headlessPredict(win,predText,cross,items,itemNames,positions,respPos,subSlider,prevBeads,trial,beadPoses,mouse_,bounds,*args,**kwargs):
+            blkType = 'urn' if 'orange' in itemNames else 'hazard'
+            beads = [beadCodes[b] for b in prevBeads[:trial]]
+            mouse.respond(blkType,beads,itemNames,abs(bounds[0]))
+            return predict(win,predText,cross,items,itemNames,positions,respPos,subSlider,prevBeads,trial,beadPoses,mouse_,bounds,*args,**kwargs)
+        task.predict = headlessPredict
+
+#Run one full session headless and return where its data went
+#config is a SessionConfig (UrnConfig.py) for the session settings - trial counts, generative parameters and reward (None = the task's own)
+def runHeadless(policy = idealPolicy,subID = 'SIM',cond = 1,seed = None,outDir = '.',displaySize = (1920,1080),quiet = True,config = None):
+    if seed is not None:
+        random.seed(seed)
+        np.random.seed(seed)
+    os.makedirs(os.path.join(outDir,'data'),exist_ok = True)
+    backend = HeadlessBackend(policy,(subID,str(cond),'SIM','SIM'),displaySize)
+    taskDir = os.path.dirname(taskFile)
+    if taskDir not in sys.path:
+        sys.path.insert(0,taskDir)
+    cwd = os.getcwd()
+    start = time.perf_counter()
+    os.chdir(outDir)
+    try:
+        # The task prints every response - keep that out of the way unless asked for
+        with open(os.devnull,'w') as devnull, contextlib.redirect_stdout(devnull if quiet else sys.stdout):
+            task = backend.loadTask()
+            backend.config = config if config is not None else task.sessionConfig
+            totalScore = task.runSession(config)
+    finally:
+        os.chdir(cwd)
+    datafile = os.path.normpath(task.datafile.fname)
+    return HeadlessResult(datafile,totalScore,backend.win.nFlips,backend.clock.t,time.perf_counter()-start)
+
+if __name__ == '__main__':
+    import argparse
+    parser = argparse.ArgumentParser(description = 'Run UrnTask sessions headless')
+    parser.add_argument('--nsessions',type = int,default = 1)
+    parser.add_argument('--policy',choices = sorted(policies),default = 'ideal')
+    parser.add_argument('--seed',type = int,default = 0)
+    parser.add_argument('--out',type = str,default = 'sims')
+    parser.add_argument('--config',type = str,default = None,help = 'JSON session config (see UrnConfig.py)')
+    args = parser.parse_args()
+    config = loadConfig(args.config) if args.config else None
+    for n in range(args.nsessions):
+        policy = policies[args.policy]
+        if args.policy == 'random':
+            policy = randomPolicy(np.random.default_rng(args.seed+n))
+        res = runHeadless(policy,subID = 'SIM_%d'%(n+1),cond = n%2+1,seed = args.seed+n,outDir = args.out,config = config)
+        print('%s: scores %s, %d flips, %.0fs simulated in %.3fs'%(res.datafile,res.totalScore,res.nFlips,res.simTime,res.wallTime))
@@ -0,0 +1,270 @@
+import numpy as np
+from functools import lru_cache
+from collections import namedtuple
+from UrnConfig import defaultConfig
+from UrnScoring import adjustConfArray
+
+'''
+Ideal observers for the Urn Hazard prediction task
+
+Python versions of stateEstimator and hazardEstimator from UrnHazardTask.Rmd. Instead of looping over one bead sequence at a time, both functions take a whole batch of sequences and update every sequence and every point of the (urn x hazard) grid at once.
+
+Bead coding follows genTrialsBatch in UrnTrials.py: 0 = orange, 1 = blue, -1 = past the end of the block. Urn index k in pspace is the probability of a blue bead from urn k, so with pspace = (.2,.8) urn 0 is the orange urn and urn 1 the blue urn. Outputs are NaN past the end of each block.
+
+Blocks only have 1-5 beads, so confTable precomputes the ideal observer for every possible bead history (62 per block type). Scoring a batch of blocks is then an array lookup with lookupConf. The table is built from the generative parameters of a session config (urnBias, hazards and slope, see UrnConfig.py) and cached on their values, so every config gets its own table.
+
+For continuous-hazard models on fine grids (e.g. 1000 hazards x 100 urn biases), logGridEstimator works in log space. It keeps only the current posterior of the grid points that have not been pruned, and returns marginals instead of the full grid for every trial.
+'''
+
+#Function to put a single sequence or a padded batch of sequences into a (n_seq, n_trials) array
+def asBeads(beads):
+    beads = np.asarray(beads)
+    if beads.ndim == 1:
+        beads = beads[None,:]
+    return beads.astype(np.int8)
+
+#Perfect accumulator state estimator - no hazard rate
+def stateEstimator(beads,pspace = (.2,.8),pprior = None):
+    # Arguments:
+    #     - beads: (n_seq, n_trials) array of observed beads (or a single sequence)
+    #     - pspace: probability of a blue bead under each urn considered
+    #     - pprior: prior over urn space - defaults to uniform
+    # Output:
+    #     - prior, posterior: (n_seq, n_trials, len(pspace)) arrays
+    beads = asBeads(beads)
+    pspace = np.asarray(pspace,dtype = float)
+    if pprior is None:
+        pprior = np.ones(len(pspace))/len(pspace)
+    nseq,ntrials = beads.shape
+    prior = np.full((nseq,ntrials,len(pspace)),np.nan)
+    posterior = np.full((nseq,ntrials,len(pspace)),np.nan)
+
+    belief = np.broadcast_to(np.asarray(pprior,dtype = float),(nseq,len(pspace))).copy()
+    for t in range(ntrials):
+        obs = beads[:,t] >= 0
+        prior[obs,t] = belief[obs]
+        lik = np.where(beads[obs,t,None] == 1,pspace,1-pspace)
+        post = belief[obs]*lik
+        post /= post.sum(axis = 1,keepdims = True)
+        posterior[obs,t] = post
+        belief[obs] = post
+    return prior,posterior
+
+#Joint urn and hazard rate estimator
+def hazardEstimator(beads,pspace = (.0001,.9999),hspace = (.2,.8)):
+    # Arguments:
+    #     - beads: (n_seq, n_trials) array of observed beads (or a single sequence)
+    #     - pspace: probability of a blue bead under each urn considered
+    #     - hspace: hazard rates considered - probability of switching to another urn between draws
+    # Output:
+    #     - prior, posterior: (n_seq, n_trials, len(pspace), len(hspace)) arrays
+    #
+    # Between draws each hazard column is updated with the switch matrix. With two urns this is the
+    # same update as in UrnHazardTask.Rmd; with more urns a switch goes to any other urn with equal probability.
+    beads = asBeads(beads)
+    pspace = np.asarray(pspace,dtype = float)
+    hspace = np.asarray(hspace,dtype = float)
+    npsp,nhsp = len(pspace),len(hspace)
+    if npsp < 2:
+        raise ValueError('hazardEstimator needs at least two urns in pspace')
+    nseq,ntrials = beads.shape
+    prior = np.full((nseq,ntrials,npsp,nhsp),np.nan)
+    posterior = np.full((nseq,ntrials,npsp,nhsp),np.nan)
+
+    belief = np.full((nseq,npsp,nhsp),1/(npsp*nhsp))
+    for t in range(ntrials):
+        obs = beads[:,t] >= 0
+        b = belief[obs]
+        if t > 0:
+            stay = b*(1-hspace)
+            switch = (b.sum(axis = 1,keepdims = True)-b)*(hspace/(npsp-1))
+            b = stay+switch
+        prior[obs,t] = b
+        lik = np.where(beads[obs,t,None] == 1,pspace,1-pspace)
+        post = b*lik[:,:,None]
+        post /= post.sum(axis = (1,2),keepdims = True)
+        posterior[obs,t] = post
+        belief[obs] = post
+    return prior,posterior
+
+#Marginal belief in each urn (sums out the hazard axis if there is one)
+def urnMarginal(dist):
+    if dist.ndim == 4:
+        return dist.sum(axis = 3)
+    return dist
+
+#Marginal belief in each hazard rate
+def hazardMarginal(dist):
+    return dist.sum(axis = 2)
+
+#Model confidence in the generating item after each bead, scaled from -1 to 1 (ModelConf in UrnHazardTask.Rmd)
+def modelConf(blkType,beads,gens,pspace = None,hspace = (.2,.8)):
+    # Arguments:
+    #     - blkType: 'urn' or 'hazard'
+    #     - beads: (n_seq, n_trials) array of observed beads
+    #     - gens: generating item for each block (0 = orange/low, 1 = blue/high)
+    # Output:
+    #     - (n_seq, n_trials) array, 1 = fully confident in the correct item, NaN past the end of each block
+    gens = np.asarray(gens,dtype = int)
+    if blkType == 'urn':
+        if pspace is None:
+            pspace = (.2,.8)
+        post = urnMarginal(stateEstimator(beads,pspace)[1])[:,:,-1]
+    elif blkType == 'hazard':
+        if pspace is None:
+            pspace = (.0001,.9999)
+        post = hazardMarginal(hazardEstimator(beads,pspace,hspace)[1])[:,:,-1]
+    else:
+        raise ValueError("blkType must be 'urn' or 'hazard', got %r"%(blkType,))
+    correct = np.where(gens[:,None] == 1,post,1-post)
+    return (correct-.5)/.5
+
+##################
+## LOOKUP TABLE ##
+##################
+
+ConfTable = namedtuple('ConfTable',['histories','posterior','slider','points'])
+
+#Index of each bead history in the lookup table (histories of length n start at row 2**n-2)
+def historyIndex(beads):
+    # Arguments:
+    #     - beads: (n_seq, n_trials) array of observed beads (or a single sequence)
+    # Output:
+    #     - (n_seq, n_trials) array of table rows for the history seen up to each trial, -1 past the end of each block
+    beads = asBeads(beads)
+    idx = np.full(beads.shape,-1,dtype = np.int64)
+    val = np.zeros(beads.shape[0],dtype = np.int64)
+    for t in range(beads.shape[1]):
+        obs = beads[:,t] >= 0
+        val = 2*val+np.maximum(beads[:,t],0)
+        idx[obs,t] = 2**(t+1)-2+val[obs]
+    return idx
+
+#Build the table of ideal observer beliefs and best responses for every bead history
+@lru_cache(maxsize = None)
+def buildConfTable(blkType,p,hazards,slp,maxLen):
+    histories = []
+    for n in range(1,maxLen+1):
+        for v in range(2**n):
+            histories.append(tuple((v >> (n-1-i)) & 1 for i in range(n)))
+    beads = -np.ones((len(histories),maxLen),dtype = np.int8)
+    for i,h in enumerate(histories):
+        beads[i,:len(h)] = h
+    last = np.array([len(h)-1 for h in histories])
+    rows = np.arange(len(histories))
+
+    # Posterior in item 1 (blue urn / high switcher) after the last bead of each history
+    if blkType == 'urn':
+        post = stateEstimator(beads,(1-p,p))[1][:,:,1]
+    elif blkType == 'hazard':
+        post = hazardMarginal(hazardEstimator(beads,(0.,1.),hazards)[1])[:,:,1]
+    else:
+        raise ValueError("blkType must be 'urn' or 'hazard', got %r"%(blkType,))
+    post = post[rows,last]
+
+    # Expected points for each slider setting (confidence is rounded to .01 in predict)
+    confs = np.round(np.arange(0,101)/100,2)
+    winPts = 10*adjustConfArray(confs/2,slp)
+    losePts = -10*confs
+    expItem1 = post[:,None]*winPts+(1-post[:,None])*losePts
+    expItem0 = (1-post[:,None])*winPts+post[:,None]*losePts
+    best1 = expItem1.argmax(axis = 1)
+    best0 = expItem0.argmax(axis = 1)
+    pick1 = expItem1[rows,best1] >= expItem0[rows,best0]
+    slider = np.where(pick1,confs[best1],-confs[best0])
+    points = np.where(pick1,expItem1[rows,best1],expItem0[rows,best0])
+    table = ConfTable(tuple(histories),post,slider,points)
+    for arr in table[1:]:
+        arr.setflags(write = False)
+    return table
+
+#Lookup table for a block type under the generative parameters of a session config
+def confTable(blkType,cfg = defaultConfig,maxLen = 5):
+    # Output: ConfTable with one row per bead history (see historyIndex)
+    #     - histories: bead history of each row (0 = orange, 1 = blue)
+    #     - posterior: ideal observer probability of item 1 (blue urn / high switcher)
+    #     - slider: optimal slider position from -1 (fully confident item 0) to 1 (fully confident item 1)
+    #     - points: expected points (before rounding) for the optimal slider position if the block ended here
+    return buildConfTable(blkType,float(cfg.urnBias),tuple(float(h) for h in cfg.hazards),float(cfg.slope),maxLen)
+
+#Ideal observer posterior, optimal slider and expected points after every bead of a batch of blocks
+def lookupConf(blkType,beads,cfg = defaultConfig):
+    idx = historyIndex(beads)
+    table = confTable(blkType,cfg,max(5,idx.shape[1]))
+    valid = idx >= 0
+    out = []
+    for arr in table[1:]:
+        out.append(np.where(valid,arr[np.maximum(idx,0)],np.nan))
+    return tuple(out)
+
+####################
+## LOG-SPACE GRID ##
+####################
+
+GridBelief = namedtuple('GridBelief',['state','bias','hazard','logEvidence','support'])
+
+#Log-space joint estimator of state, urn bias and hazard rate on a large (bias x hazard) grid
+def logGridEstimator(beads,qspace,hspace,qprior = None,hprior = None,prune = None):
+    # Arguments:
+    #     - beads: (n_seq, n_trials) array of observed beads (or a single sequence)
+    #     - qspace: urn biases considered - urn 1 gives a blue bead with probability q, urn 0 an orange one
+    #     - hspace: hazard rates considered - probability of switching urns between draws
+    #     - qprior, hprior: priors over qspace and hspace (hyperpriors of the grid) - default to uniform
+    #     - prune: drop grid points whose posterior (in both states) falls below this probability - None keeps the full grid
+    # Output: GridBelief of (n_seq, n_trials, ...) arrays, NaN past the end of each block
+    #     - state: belief in urn 0 and urn 1 (n_seq, n_trials, 2)
+    #     - bias, hazard: marginal beliefs over qspace and hspace
+    #     - logEvidence: log probability of the beads seen so far
+    #     - support: number of grid points still in the estimate
+    #
+    # Only the current log posterior of the surviving grid points is kept (2 states x support). Between
+    # draws each point is updated with the 2x2 switch matrix in log space, so nothing underflows on long
+    # sequences or fine grids. Pruned points are dropped for the rest of the sequence.
+    beads = asBeads(beads)
+    qspace = np.asarray(qspace,dtype = float)
+    hspace = np.asarray(hspace,dtype = float)
+    nq,nh = len(qspace),len(hspace)
+    nseq,ntrials = beads.shape
+    with np.errstate(divide = 'ignore'):
+        lqprior = np.log(np.ones(nq)/nq if qprior is None else np.asarray(qprior,dtype = float)/np.sum(qprior))
+        lhprior = np.log(np.ones(nh)/nh if hprior is None else np.asarray(hprior,dtype = float)/np.sum(hprior))
+        lq,lnq = np.log(qspace),np.log1p(-qspace)
+        lh,lnh = np.log(hspace),np.log1p(-hspace)
+        lprune = None if prune is None else np.log(prune)
+    out = GridBelief(np.full((nseq,ntrials,2),np.nan),np.full((nseq,ntrials,nq),np.nan),np.full((nseq,ntrials,nh),np.nan),
+                     np.full((nseq,ntrials),np.nan),np.zeros((nseq,ntrials),dtype = np.int64))
+
+    for n in range(nseq):
+        qi,hi = [a.ravel() for a in np.meshgrid(np.arange(nq),np.arange(nh),indexing = 'ij')]
+        lp0 = np.log(.5)+lqprior[qi]+lhprior[hi] #urn 0
+        lp1 = lp0.copy() #urn 1
+        stay,switch,blue1,blue0 = lnh[hi],lh[hi],lq[qi],lnq[qi]
+        logEv = 0.
+        for t in range(ntrials):
+            if beads[n,t] < 0:
+                break
+            if t > 0:
+                lp0,lp1 = np.logaddexp(stay+lp0,switch+lp1),np.logaddexp(stay+lp1,switch+lp0)
+            if beads[n,t] == 1:
+                lp0 += blue0
+                lp1 += blue1
+            else:
+                lp0 += blue1
+                lp1 += blue0
+            norm = np.logaddexp(np.logaddexp.reduce(lp0),np.logaddexp.reduce(lp1))
+            lp0 -= norm
+            lp1 -= norm
+            logEv += norm
+            p0,p1 = np.exp(lp0),np.exp(lp1)
+            out.state[n,t] = (p0.sum(),p1.sum())
+            colP = p0+p1
+            out.bias[n,t] = np.bincount(qi,weights = colP,minlength = nq)
+            out.hazard[n,t] = np.bincount(hi,weights = colP,minlength = nh)
+            out.logEvidence[n,t] = logEv
+            out.support[n,t] = len(qi)
+            if lprune is not None:
+                keep = np.maximum(lp0,lp1) >= lprune
+                if not keep.all():
+                    qi,hi,lp0,lp1 = qi[keep],hi[keep],lp0[keep],lp1[keep]
+                    stay,switch,blue1,blue0 = stay[keep],switch[keep],blue1[keep],blue0[keep]
+    return out
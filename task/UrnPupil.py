@@ -0,0 +1,389 @@
+import numpy as np
+import argparse, json, os, time
+from collections import namedtuple
+
+import UrnCohort
+from UrnEyelink import magic, sampleDtype, readMessages
+
+'''
+Streaming pupil preprocessing for the Urn Hazard prediction task
+
+Turns the eye samples recorded by UrnEyelink.py (<data file>.eye and .eyemsg) into baseline-corrected pupil epochs, without ever loading a whole session. Every stage is a generator over chunks of samples and keeps only the few samples it needs across chunk boundaries:
+    - readChunks: chunks of the memory-mapped sample file
+    - interpolateBlinks: samples without a pupil, widened by pad ms on both sides, are linearly interpolated (gaps longer than maxGap ms are left NaN)
+    - lowpass: zero-phase windowed-sinc FIR low-pass of the pupil (cutoff Hz)
+    - epochStream: pupil around each event, resampled to a step ms grid, minus the mean over the baseline window before that trial's bead onset
+Memory use is set by the chunk size and the epoch windows, not by the length of the session.
+
+Events come from the trial messages (TRIALID <block type> <block> <trial> main):
+    - bead: RESPONSE_ONSET, when the new bead first appears on screen (with the bead reminders on the response screen)
+    - click: RESPONSE, the slider click
+Practice trials are left out. Each epoch is matched to its recDat row in the session CSV by BlockType, TrialBlock and TrialNumber.
+
+updatePupil runs every session with eye data under a data folder and appends its epochs to memory-mapped files in <data>/.pupil (only new sessions are processed, as in UrnCohort.py):
+    - <kind>.bin: float32 epochs, one row per epoch
+    - <kind>.index.bin: one indexDtype record per epoch (File is a code into the File categories, Row the row in that file's CSV)
+    - manifest.json: the settings, epoch counts and the processed files
+
+Usage:
+    python UrnPupil.py data
+    pupil = loadEpochs('data','bead')
+    rows = cohortRows(pupil,'data') #rows of UrnCohort.loadCohort('data') (-1 if none)
+'''
+
+cacheName = '.pupil'
+manifestVersion = 1
+
+Event = namedtuple('Event',['time','kind','blkType','block','trial','baseTime'])
+
+cleanDtype = np.dtype([('time','<f8'),('gx','<f4'),('gy','<f4'),('pupil','<f4'),('interp','<i1')]) #interp = 1 where the pupil was interpolated or is missing
+indexDtype = np.dtype([('File','<i2'),('BlockType','<i1'),('TrialBlock','<i2'),('TrialNumber','<i1'),('Row','<i4'),('Baseline','<f4'),('Interpolated','<f4')])
+
+# Preprocessing settings (ms unless noted)
+defaultSettings = {'windows':{'bead':[-500,3000],'click':[-1000,2000]},
+                   'baseline':[-200,0],
+                   'step':2.,
+                   'pad':100.,
+                   'maxGap':1000.,
+                   'cutoff':4., #Hz
+                   'chunkSize':2**16} #samples
+
+############
+## EVENTS ##
+############
+
+#Bead onset and click events of the main trials, in time order
+def trialEvents(messages):
+    events = []
+    current = None
+    for t,text in messages:
+        words = text.split(' ')
+        if words[0] == 'TRIALID':
+            current = None
+            if len(words) > 4 and words[4] == 'main':
+                current = {'blkType':words[1],'block':int(words[2]),'trial':int(words[3]),'onset':None}
+        elif current is None:
+            continue
+        elif words[0] == 'RESPONSE_ONSET':
+            current['onset'] = t
+            events.append(Event(t,'bead',current['blkType'],current['block'],current['trial'],t))
+        elif words[0] == 'RESPONSE' and current['onset'] is not None:
+            events.append(Event(t,'click',current['blkType'],current['block'],current['trial'],current['onset']))
+    events.sort(key = lambda e: e.time)
+    return events
+
+############
+## STAGES ##
+############
+
+#Chunks of the sample file of a session
+def readChunks(fname,chunkSize = defaultSettings['chunkSize']):
+    n = (os.path.getsize(fname)-len(magic))//sampleDtype.itemsize
+    if n <= 0:
+        return
+    samples = np.memmap(fname,dtype = sampleDtype,mode = 'r',offset = len(magic),shape = (n,))
+    for start in range(0,n,chunkSize):
+        yield np.array(samples[start:start+chunkSize])
+
+#Sampling rate (Hz) from the first samples of a file
+def sampleRate(fname):
+    first = next(readChunks(fname,1000),None)
+    if first is None or len(first) < 2:
+        return np.nan
+    return 1000./np.median(np.diff(first['time']))
+
+#Start and end (exclusive) of every run of True
+def runs(mask):
+    d = np.diff(mask.astype(np.int8),prepend = 0,append = 0)
+    return np.flatnonzero(d == 1),np.flatnonzero(d == -1)
+
+#Samples without a pupil, widened by pad ms on both sides
+def blinkMask(t,pupil,pad):
+    starts,ends = runs(~(pupil > 0))
+    edges = np.zeros(len(t)+1,dtype = np.int32)
+    np.add.at(edges,np.searchsorted(t,t[starts]-pad,'left'),1)
+    np.add.at(edges,np.searchsorted(t,t[ends-1]+pad,'right'),-1)
+    return np.cumsum(edges[:-1]) > 0
+
+#Blink interpolation over a stream of sample chunks
+def interpolateBlinks(chunks,pad = defaultSettings['pad'],maxGap = defaultSettings['maxGap']):
+    # Samples within pad ms of the end of a chunk (or in a blink that is still going on) wait for the next chunk,
+    # since a blink there may not have ended yet
+    carry = np.zeros(0,dtype = sampleDtype)
+    anchor = None #(time, pupil) of the last valid sample sent on, None after a long gap
+    for chunk in chunks:
+        data = np.concatenate([carry,chunk])
+        mask = blinkMask(data['time'],data['pupil'],pad)
+        t = data['time']
+        cut = np.searchsorted(t,t[-1]-pad,'right')
+        long = False
+        if cut > 0 and mask[cut-1]:
+            s = runs(mask[:cut])[0][-1]
+            if t[cut-1]-t[s] > maxGap or anchor is None and s == 0:
+                long = True #still missing, and too long to interpolate anyway - send on as NaN
+            else:
+                cut = s
+        if cut == 0:
+            carry = data
+            continue
+        out,anchor = fillBlinks(data[:cut],mask[:cut],anchor,maxGap,openEnd = long)
+        carry = data[cut:]
+        yield out
+    if len(carry):
+        mask = blinkMask(carry['time'],carry['pupil'],pad)
+        yield fillBlinks(carry,mask,anchor,maxGap,openEnd = True)[0]
+
+#Fill the masked runs of a block of samples
+def fillBlinks(data,mask,anchor,maxGap,openEnd = False):
+    # Output: cleanDtype samples, anchor for the next block
+    out = np.zeros(len(data),dtype = cleanDtype)
+    for name in ['time','gx','gy','pupil']:
+        out[name] = data[name]
+    out['interp'] = mask
+    t,p = data['time'],out['pupil']
+    out['gx'][mask] = np.nan
+    out['gy'][mask] = np.nan
+    for s,e in zip(*runs(mask)):
+        if s == 0:
+            left = anchor
+        else:
+            left = (t[s-1],p[s-1])
+        right = (t[e],p[e]) if e < len(data) else None
+        if left is None or right is None or right[0]-left[0] > maxGap:
+            p[s:e] = np.nan
+        else:
+            p[s:e] = np.interp(t[s:e],[left[0],right[0]],[left[1],right[1]])
+    if openEnd and mask[-1]:
+        return out,None
+    return out,(t[-1],p[-1])
+
+#Windowed-sinc low-pass filter taps (odd length, unit gain)
+def lowpassTaps(cutoff,rate,ntaps = None):
+    if ntaps is None:
+        ntaps = 2*int(rate/cutoff)+1
+    n = np.arange(ntaps)-(ntaps-1)/2
+    h = np.sinc(2*cutoff/rate*n)*np.hamming(ntaps)
+    return h/h.sum()
+
+#Zero-phase low-pass of the pupil over a stream of cleaned chunks
+def lowpass(chunks,cutoff = defaultSettings['cutoff'],rate = 500.):
+    # The filter is centred on each sample, so each sample waits for the half filter length of samples after it.
+    # The ends of the recording are padded with the first and last value. NaN (long gaps) spreads over the filter length.
+    h = lowpassTaps(cutoff,rate)
+    half = (len(h)-1)//2
+    left = None #the half raw values before the pending samples
+    pending = np.zeros(0,dtype = cleanDtype)
+    for chunk in chunks:
+        pending = np.concatenate([pending,chunk])
+        if left is None:
+            left = np.full(half,pending['pupil'][0],dtype = np.float64)
+        count = len(pending)-half
+        if count <= 0:
+            continue
+        ext = np.concatenate([left,pending['pupil']])
+        out = pending[:count].copy()
+        out['pupil'] = np.convolve(ext,h,'valid')[:count]
+        left = ext[count:count+half]
+        pending = pending[count:]
+        yield out
+    if len(pending):
+        ext = np.concatenate([left,pending['pupil'],np.full(half,pending['pupil'][-1])])
+        out = pending.copy()
+        out['pupil'] = np.convolve(ext,h,'valid')
+        yield out
+
+#Baseline-corrected epochs around events from a stream of filtered chunks
+def epochStream(chunks,events,windows = defaultSettings['windows'],baseWin = defaultSettings['baseline'],step = defaultSettings['step']):
+    # Output (one per event, in order of completion): event, epoch (float32 on the step grid of its window), baseline, fraction interpolated
+    grids = dict((k,np.arange(w[0],w[1],step)) for k,w in windows.items())
+    pending = list(events)
+    buf = np.zeros(0,dtype = cleanDtype)
+    chunks = iter(chunks)
+    done = False
+    while pending:
+        chunk = next(chunks,None)
+        if chunk is None:
+            done = True
+        else:
+            buf = np.concatenate([buf,chunk])
+        end = buf['time'][-1] if len(buf) else -np.inf
+        waiting = []
+        for e in pending:
+            if done or e.time+windows[e.kind][1] <= end:
+                yield makeEpoch(buf,e,grids[e.kind],baseWin)
+            else:
+                waiting.append(e)
+        pending = waiting
+        # Drop samples no pending event needs
+        if pending and len(buf):
+            keep = min(min(e.time+windows[e.kind][0],e.baseTime+baseWin[0]) for e in pending)
+            buf = buf[np.searchsorted(buf['time'],keep,'left'):]
+
+def makeEpoch(buf,e,grid,baseWin):
+    t = buf['time']
+    inBase = (t >= e.baseTime+baseWin[0]) & (t < e.baseTime+baseWin[1])
+    base = buf['pupil'][inBase]
+    base = np.nanmean(base) if np.isfinite(base).any() else np.nan
+    vals = np.interp(e.time+grid,t,buf['pupil'],left = np.nan,right = np.nan) if len(t) else np.full(len(grid),np.nan)
+    inEpoch = (t >= e.time+grid[0]) & (t <= e.time+grid[-1])
+    interp = buf['interp'][inEpoch].mean() if inEpoch.any() else 1.
+    return e,(vals-base).astype(np.float32),base,interp
+
+#Whole pipeline for one session
+def sessionEpochs(base,settings = defaultSettings):
+    # Arguments:
+    #     - base: data file name (samples and messages in <base>.eye and <base>.eyemsg)
+    # Output: generator of epochs (see epochStream)
+    rate = sampleRate(base+'.eye')
+    events = trialEvents(readMessages(base))
+    if not events or not rate > 0:
+        return iter([])
+    chunks = readChunks(base+'.eye',settings['chunkSize'])
+    chunks = interpolateBlinks(chunks,settings['pad'],settings['maxGap'])
+    chunks = lowpass(chunks,settings['cutoff'],rate)
+    return epochStream(chunks,events,settings['windows'],settings['baseline'],settings['step'])
+
+###########
+## STORE ##
+###########
+
+#Row of every main trial in a session CSV, keyed by (block type, TrialBlock, TrialNumber)
+def trialRows(fname):
+    cols,n = UrnCohort.readSession(fname)
+    rows = {}
+    for i in np.flatnonzero(cols['IsReward'] == 0):
+        rows[(int(cols['BlockType'][i]),int(cols['TrialBlock'][i]),int(cols['TrialNumber'][i]))] = i
+    return rows
+
+def newManifest(settings):
+    return {'version':manifestVersion,'settings':settings,'counts':dict((k,0) for k in settings['windows']),'files':{},'fileNames':[]}
+
+def readManifest(cacheDir,settings):
+    mname = os.path.join(cacheDir,'manifest.json')
+    if os.path.exists(mname):
+        with open(mname) as f:
+            manifest = json.load(f)
+        if manifest.get('version') == manifestVersion and manifest['settings'] == settings:
+            return manifest
+    return clearCache(cacheDir,settings)
+
+def writeManifest(cacheDir,manifest):
+    mname = os.path.join(cacheDir,'manifest.json')
+    with open(mname+'.tmp','w') as f:
+        json.dump(manifest,f)
+    os.replace(mname+'.tmp',mname)
+
+def clearCache(cacheDir,settings):
+    for f in os.listdir(cacheDir):
+        if f.endswith('.bin') or f == 'manifest.json':
+            os.remove(os.path.join(cacheDir,f))
+    return newManifest(settings)
+
+#Cut the epoch files back to the counts in the manifest (drops a partly written session)
+def truncateEpochs(cacheDir,manifest):
+    s = manifest['settings']
+    for kind,n in manifest['counts'].items():
+        w = s['windows'][kind]
+        nt = len(np.arange(w[0],w[1],s['step']))
+        for fname,size in [(kind+'.bin',4*nt),(kind+'.index.bin',indexDtype.itemsize)]:
+            fname = os.path.join(cacheDir,fname)
+            if os.path.exists(fname):
+                with open(fname,'r+b') as f:
+                    f.truncate(n*size)
+
+#Process every session with eye data under dataDir that is not in the store yet
+def updatePupil(dataDir,settings = defaultSettings,verbose = False):
+    cacheDir = os.path.join(dataDir,cacheName)
+    os.makedirs(cacheDir,exist_ok = True)
+    settings = json.loads(json.dumps(settings)) #as it reads back from the manifest
+    manifest = readManifest(cacheDir,settings)
+    fnames = [f for f in UrnCohort.sessionFiles(dataDir) if os.path.exists(os.path.join(dataDir,f+'.eye'))]
+    changed = set(manifest['files'])-set(fnames)
+    for rel,info in manifest['files'].items():
+        if rel not in changed:
+            st = os.stat(os.path.join(dataDir,rel+'.eye'))
+            if st.st_mtime != info['mtime'] or st.st_size != info['size']:
+                changed.add(rel)
+    if changed:
+        if verbose:
+            print('Rebuilding pupil epochs (%d changed or removed files)'%len(changed))
+        manifest = clearCache(cacheDir,settings)
+    else:
+        truncateEpochs(cacheDir,manifest)
+
+    blkCodes = {'urn':0,'hazard':1}
+    added = 0
+    for rel in fnames:
+        if rel in manifest['files']:
+            continue
+        base = os.path.join(dataDir,rel)
+        st = os.stat(base+'.eye')
+        rows = trialRows(base)
+        code = len(manifest['fileNames'])
+        counts = dict((k,0) for k in settings['windows'])
+        files = dict((k,(open(os.path.join(cacheDir,k+'.bin'),'ab'),open(os.path.join(cacheDir,k+'.index.bin'),'ab'))) for k in settings['windows'])
+        try:
+            for e,vals,baseline,interp in sessionEpochs(base,settings):
+                blk = blkCodes[e.blkType]
+                rec = np.array([(code,blk,e.block,e.trial,rows.get((blk,e.block,e.trial),-1),baseline,interp)],dtype = indexDtype)
+                files[e.kind][0].write(vals.tobytes())
+                files[e.kind][1].write(rec.tobytes())
+                counts[e.kind] += 1
+        finally:
+            for f in files.values():
+                f[0].close()
+                f[1].close()
+        manifest['fileNames'].append(rel)
+        manifest['files'][rel] = {'mtime':st.st_mtime,'size':st.st_size,'counts':counts}
+        for k,n in counts.items():
+            manifest['counts'][k] += n
+        writeManifest(cacheDir,manifest)
+        added += 1
+        if verbose:
+            print('%s: %s'%(rel,', '.join('%d %s'%(n,k) for k,n in sorted(counts.items()))))
+    writeManifest(cacheDir,manifest)
+    return cacheDir,manifest
+
+#Load the epochs of one kind as memory-mapped arrays
+def loadEpochs(dataDir,kind,update = True,settings = defaultSettings):
+    # Output: dict with
+    #     - epochs: (n, n_times) float32, baseline-corrected pupil
+    #     - times: (n_times,) ms from the event
+    #     - index: (n,) indexDtype records, File_categories: session CSV of each File code
+    if update:
+        cacheDir,manifest = updatePupil(dataDir,settings)
+    else:
+        cacheDir = os.path.join(dataDir,cacheName)
+        with open(os.path.join(cacheDir,'manifest.json')) as f:
+            manifest = json.load(f)
+    s = manifest['settings']
+    w = s['windows'][kind]
+    times = np.arange(w[0],w[1],s['step'])
+    n = manifest['counts'][kind]
+    if n == 0:
+        epochs,index = np.zeros((0,len(times)),dtype = np.float32),np.zeros(0,dtype = indexDtype)
+    else:
+        epochs = np.memmap(os.path.join(cacheDir,kind+'.bin'),dtype = np.float32,mode = 'r',shape = (n,len(times)))
+        index = np.memmap(os.path.join(cacheDir,kind+'.index.bin'),dtype = indexDtype,mode = 'r',shape = (n,))
+    return {'epochs':epochs,'times':times,'index':index,'File_categories':np.array(manifest['fileNames'],dtype = str)}
+
+#Row of each epoch in the merged cohort of UrnCohort.loadCohort (-1 if it has no recDat row)
+def cohortRows(pupil,dataDir):
+    manifest = UrnCohort.readManifest(os.path.join(dataDir,UrnCohort.cacheName))
+    starts = np.array([manifest['files'][f]['start'] if f in manifest['files'] else -1 for f in pupil['File_categories']],dtype = np.int64)
+    index = pupil['index']
+    start = starts[index['File']] if len(starts) else np.zeros(0,dtype = np.int64)
+    return np.where((index['Row'] >= 0) & (start >= 0),start+index['Row'],-1)
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description = 'Preprocess pupil data into baseline-corrected epochs')
+    parser.add_argument('data',nargs = '?',default = 'data',help = 'data folder (sessions with a .eye file)')
+    args = parser.parse_args()
+    start = time.perf_counter()
+    cacheDir,manifest = updatePupil(args.data,verbose = True)
+    print('%s in %s (%.2fs)'%(', '.join('%d %s epochs'%(n,k) for k,n in sorted(manifest['counts'].items())),cacheDir,time.perf_counter()-start))
+    try:
+        import resource
+        print('Peak memory %.0f MB'%(resource.getrusage(resource.RUSAGE_SELF).ru_maxrss/1024))
+    except ImportError:
+        pass
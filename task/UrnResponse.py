@@ -0,0 +1,95 @@
+import numpy as np
+import sys
+
+'''
+Slider response logging for the Urn Hazard prediction task
+
+predict runs its response loop once per display refresh (no sleeping between frames). On each frame it samples the mouse and logs the sample with a monotonic timestamp (core.getTime). ResponseLog collects the samples of one response screen, along with the flip time when the screen appeared (onset) and the time of the click.
+
+RT is click time minus response screen onset, so the blank screen before the response screen and the waits in urnDraw are not included.
+
+TrajectoryFile appends each response to one binary file per session (<data file>.traj). Each record is a trial header followed by its samples:
+    - header: block, trial, block type (0 = urn, 1 = hazard), onset, click time, number of samples
+    - sample: time since onset (s), mouse x, mouse y, slider x (pixels), button pressed
+Read it back with readTrajectories, or print a summary with:
+    python UrnResponse.py data/SUBJ_CoinTask_<date>.csv.traj
+'''
+
+magic = b'URNTRAJ1'
+headDtype = np.dtype([('block','<i2'),('trial','<i1'),('blkType','<i1'),('onset','<f8'),('click','<f8'),('nsamples','<i4')])
+sampleDtype = np.dtype([('t','<f4'),('x','<f4'),('y','<f4'),('slider','<f4'),('pressed','<i1')])
+blkCodes = {'urn':0,'hazard':1}
+
+#Samples from one response screen
+class ResponseLog:
+    def __init__(self,onset):
+        self.onset = onset
+        self.click = np.nan
+        self.samples = []
+
+    #Log one mouse sample (t on the same clock as onset)
+    def add(self,t,x,y,slider,pressed):
+        self.samples.append((t-self.onset,x,y,slider,pressed))
+
+    #Response time from screen onset to click
+    def rt(self):
+        return self.click-self.onset
+
+    def asArray(self):
+        return np.array(self.samples,dtype = sampleDtype)
+
+#Binary trajectory file for one session
+class TrajectoryFile:
+    def __init__(self,fname):
+        self.fname = fname
+        self.f = open(fname,'wb')
+        self.f.write(magic)
+
+    #Append the trajectory of one trial
+    def write(self,block,trial,blkType,log):
+        samples = log.asArray()
+        head = np.array([(block,trial,blkCodes[blkType],log.onset,log.click,len(samples))],dtype = headDtype)
+        self.f.write(head.tobytes())
+        self.f.write(samples.tobytes())
+
+    def flush(self):
+        if not self.f.closed:
+            self.f.flush()
+
+    def close(self):
+        if not self.f.closed:
+            self.f.close()
+
+#Read a trajectory file into a list of trial records
+def readTrajectories(fname):
+    # Output: list of dicts with block, trial, blkType, onset, click, rt and samples (structured array of sampleDtype)
+    with open(fname,'rb') as f:
+        data = f.read()
+    if data[:len(magic)] != magic:
+        raise ValueError('%s is not a trajectory file'%fname)
+    trials = []
+    pos = len(magic)
+    while pos+headDtype.itemsize <= len(data):
+        head = np.frombuffer(data,dtype = headDtype,count = 1,offset = pos)[0]
+        pos += headDtype.itemsize
+        n = int(head['nsamples'])
+        if pos+n*sampleDtype.itemsize > len(data):
+            break #partly written last trial
+        samples = np.frombuffer(data,dtype = sampleDtype,count = n,offset = pos)
+        pos += n*sampleDtype.itemsize
+        trials.append({'block':int(head['block']),'trial':int(head['trial']),
+                       'blkType':['urn','hazard'][head['blkType']],
+                       'onset':float(head['onset']),'click':float(head['click']),
+                       'rt':float(head['click']-head['onset']),'samples':samples})
+    return trials
+
+if __name__ == '__main__':
+    if len(sys.argv) != 2:
+        print('usage: python UrnResponse.py <file.traj>')
+        sys.exit(1)
+    trials = readTrajectories(sys.argv[1])
+    rts = np.array([t['rt'] for t in trials])
+    nsamp = np.array([len(t['samples']) for t in trials])
+    print('%d trials, %d samples'%(len(trials),nsamp.sum()))
+    if len(trials):
+        print('RT: median %.3fs, min %.3fs, max %.3fs'%(np.nanmedian(rts),np.nanmin(rts),np.nanmax(rts)))
@@ -0,0 +1,559 @@
+import os, sys, re, json, time, socket, socketserver, threading, subprocess, tempfile, argparse, random
+
+'''
+Session runner and central data store for the Urn Hazard prediction task
+
+Runs queued sessions on a lab PC and streams their data rows to one central store, so the sessions of every rig end up in one dataset without copying files by hand.
+
+Rig side:
+    - sessions are queued with a subject ID, condition and seed (and optionally a config file, see UrnConfig.py) in data/.runner/jobs.json
+    - the runner launches UrnTask.py for each queued session in turn, with the job in the URN_RUNNER_JOB environment variable (the task then skips the participant dialog)
+    - while the session runs, its rows are read from the DataWriter journal (see UrnData.py), which gets every recDat row as soon as it is recorded, and handed to a background uploader
+    - the uploader sends the rows to the store in batches and keeps them until the store has acknowledged them. After a failed send it reconnects and retries (with a growing delay), starting from the last row the store has, so a session survives the store or the network going away for a while
+
+Store side:
+    - every session is kept as <store>/<rig>/<session csv name>, as <name>.part while it is being streamed and renamed to <name> once the runner says the session is finished
+    - a session only counts as finished when its process exits normally and UrnTask.py has saved the timing report (<data file>.timing.txt, written after the last block). Sessions that crash or are quit stay as .part in the store, so they never enter the merged dataset as complete sessions
+    - each request carries the row number of its first row. Rows the store already has are skipped, and a request that would leave a gap gets the number of the row the store expects next, so duplicates from retries never reach the files
+    - the store directory is an ordinary data archive: UrnCohort.loadCohort(store) or python UrnStore.py <store> merge it
+
+Messages are single lines of JSON over TCP. A request is {"rig", "session", "start", "lines", "final"} and the reply is {"next", "done"} (or {"error"}).
+
+Usage:
+    python UrnRunner.py store <store dir> --port 8765                         (central store)
+    python UrnRunner.py add --subject S01 --condition 1 --seed 3              (queue a session on this rig)
+    python UrnRunner.py run --store <host>:8765                               (run the queued sessions)
+    python UrnRunner.py sync --store <host>:8765                              (upload the sessions already in data/)
+    python UrnRunner.py demo --sessions 2 --flaky .2                          (everything on localhost with headless sessions, one of them stopped early, and a store that drops connections)
+'''
+
+taskDir = os.path.dirname(os.path.abspath(__file__))
+jobEnv = 'URN_RUNNER_JOB'
+queueName = '.runner'
+defaultPort = 8765
+
+##############
+## PROTOCOL ##
+##############
+
+#Names that are safe to use as a single path component
+safeName = re.compile(r'^[A-Za-z0-9_.\-]+$')
+
+#Write one message (one line of JSON)
+def sendMessage(f,msg):
+    f.write((json.dumps(msg)+'\n').encode())
+    f.flush()
+
+#Read one message (None when the connection is closed)
+def readMessage(f):
+    line = f.readline()
+    if not line:
+        return None
+    return json.loads(line)
+
+#host:port to an address tuple
+def parseAddress(text):
+    host,port = text.rsplit(':',1) if ':' in text else (text,defaultPort)
+    return (host or '127.0.0.1',int(port))
+
+###########
+## STORE ##
+###########
+
+#Session files of the central store, one folder per rig
+class SessionStore:
+    def __init__(self,storeDir):
+        self.storeDir = storeDir
+        self.lock = threading.Lock()
+        self.counts = {} #(rig, session) -> [rows stored, finished]
+        self.received = 0
+        self.duplicates = 0
+        os.makedirs(storeDir,exist_ok = True)
+
+    def paths(self,rig,name):
+        if not (safeName.match(rig) and safeName.match(name) and name.endswith('.csv')):
+            raise ValueError('bad rig or session name: %r, %r'%(rig,name))
+        fname = os.path.join(self.storeDir,rig,name)
+        return fname+'.part',fname
+
+    #Rows stored so far and whether the session is finished (read from disk the first time)
+    def count(self,rig,name):
+        key = (rig,name)
+        if key not in self.counts:
+            part,fname = self.paths(rig,name)
+            if os.path.exists(fname):
+                with open(fname,'rb') as f:
+                    self.counts[key] = [f.read().count(b'\n'),True]
+            elif os.path.exists(part):
+                # A partly written last row (store stopped during a write) is dropped
+                with open(part,'rb+') as f:
+                    data = f.read()
+                    f.truncate(data.rfind(b'\n')+1)
+                    self.counts[key] = [data[:data.rfind(b'\n')+1].count(b'\n'),False]
+            else:
+                self.counts[key] = [0,False]
+        return self.counts[key]
+
+    #Store the rows of one request
+    def append(self,rig,name,start,lines,final = False):
+        # Arguments:
+        #     - start: row number of lines[0] in the session (the header is row 0)
+        #     - lines: rows of text, each ending with a newline
+        #     - final: the runner has no rows after these
+        # Output: reply message - next row the store expects and whether the session is finished
+        if start < 0 or any(not l.endswith('\n') or '\n' in l[:-1] for l in lines):
+            raise ValueError('bad rows for %s/%s'%(rig,name))
+        part,fname = self.paths(rig,name)
+        with self.lock:
+            state = self.count(rig,name)
+            n,done = state
+            if done or start > n:
+                return {'next':n,'done':done}
+            new = lines[n-start:]
+            self.duplicates += len(lines)-len(new)
+            if new:
+                os.makedirs(os.path.dirname(part),exist_ok = True)
+                with open(part,'a') as f:
+                    f.write(''.join(new))
+                    f.flush()
+                    os.fsync(f.fileno())
+                state[0] = n = n+len(new)
+                self.received += len(new)
+            if final and start+len(lines) == n:
+                if not os.path.exists(part):
+                    os.makedirs(os.path.dirname(part),exist_ok = True)
+                    open(part,'w').close()
+                os.replace(part,fname)
+                state[1] = done = True
+            return {'next':n,'done':done}
+
+    def report(self):
+        finished = sum(done for n,done in self.counts.values())
+        return 'Store %s: %d sessions (%d finished), %d rows stored, %d duplicate rows skipped'%(self.storeDir,len(self.counts),finished,self.received,self.duplicates)
+
+#One connection to the store - any number of requests
+class StoreHandler(socketserver.StreamRequestHandler):
+    def handle(self):
+        while True:
+            try:
+                msg = readMessage(self.rfile)
+            except (OSError,ValueError):
+                return
+            if msg is None or self.server.drop():
+                return
+            try:
+                reply = self.server.store.append(str(msg['rig']),str(msg['session']),int(msg['start']),list(msg['lines']),bool(msg.get('final')))
+            except (KeyError,TypeError,ValueError) as e:
+                reply = {'error':str(e)}
+            if self.server.drop():
+                return
+            try:
+                sendMessage(self.wfile,reply)
+            except OSError:
+                return
+
+#Threaded TCP server for a SessionStore
+class StoreServer(socketserver.ThreadingTCPServer):
+    allow_reuse_address = True
+    daemon_threads = True
+
+    # flaky: fraction of requests where the connection is dropped, half before and half after the rows are stored (for testing the retries)
+    def __init__(self,store,address,flaky = 0.,seed = None):
+        self.store = store
+        self.flaky = flaky
+        self.rng = random.Random(seed)
+        self.rngLock = threading.Lock()
+        socketserver.ThreadingTCPServer.__init__(self,address,StoreHandler)
+
+    def drop(self):
+        if not self.flaky:
+            return False
+        with self.rngLock:
+            return self.rng.random() < self.flaky/2
+
+#Start a store server on a background thread
+def startStore(storeDir,host = '127.0.0.1',port = defaultPort,flaky = 0.,seed = None):
+    server = StoreServer(SessionStore(storeDir),(host,port),flaky,seed)
+    threading.Thread(target = server.serve_forever,name = 'StoreServer',daemon = True).start()
+    return server
+
+##############
+## UPLOADER ##
+##############
+
+#Background uploads of session rows to the store, with retries
+class Uploader:
+    def __init__(self,address,rig,batchSize = 200,timeout = 5.,retryDelay = .1,maxDelay = 10.):
+        if not safeName.match(rig):
+            raise ValueError('bad rig name: %r'%rig)
+        self.address = address
+        self.rig = rig
+        self.batchSize = batchSize
+        self.timeout = timeout
+        self.retryDelay = retryDelay
+        self.maxDelay = maxDelay
+        self.sessions = {} #name -> dict(lines, acked, final, done, error)
+        self.cond = threading.Condition()
+        self.closed = False
+        self.sock = None
+        self.sent = 0
+        self.retries = 0
+        self.thread = threading.Thread(target = self.run,name = 'Uploader',daemon = True)
+        self.thread.start()
+
+    #Queue more rows of a session (final = True when the session has no more rows)
+    def add(self,name,lines,final = False):
+        with self.cond:
+            s = self.sessions.setdefault(name,{'lines':[],'acked':0,'final':False,'done':False,'error':None})
+            s['lines'].extend(lines)
+            s['final'] = s['final'] or final
+            self.cond.notify_all()
+
+    #Number of rows of a session queued so far
+    def queued(self,name):
+        with self.cond:
+            return len(self.sessions[name]['lines']) if name in self.sessions else 0
+
+    def waiting(self,s):
+        return s['error'] is None and not s['done'] and (s['acked'] < len(s['lines']) or s['final'])
+
+    def pending(self):
+        return [name for name,s in self.sessions.items() if self.waiting(s)]
+
+    #Wait until the store has everything queued so far (False if it is still pending after timeout)
+    def wait(self,timeout = None):
+        end = None if timeout is None else time.monotonic()+timeout
+        with self.cond:
+            while self.pending():
+                left = None if end is None else end-time.monotonic()
+                if left is not None and left <= 0:
+                    return False
+                self.cond.wait(left)
+        return True
+
+    def close(self):
+        with self.cond:
+            self.closed = True
+            self.cond.notify_all()
+        self.thread.join()
+        self.disconnect()
+
+    def disconnect(self):
+        if self.sock is not None:
+            try:
+                self.sock.close()
+            except OSError:
+                pass
+        self.sock = None
+
+    #Send one request and return the reply (connecting first if needed)
+    def request(self,msg):
+        if self.sock is None:
+            self.sock = socket.create_connection(self.address,timeout = self.timeout)
+            self.f = self.sock.makefile('rwb')
+        sendMessage(self.f,msg)
+        reply = readMessage(self.f)
+        if reply is None:
+            raise ConnectionError('store closed the connection')
+        return reply
+
+    #Uploader thread: send the first session with unsent rows, retry after errors
+    def run(self):
+        delay = self.retryDelay
+        while True:
+            with self.cond:
+                while not self.closed and not self.pending():
+                    self.cond.wait()
+                if self.closed:
+                    return
+                name = self.pending()[0]
+                s = self.sessions[name]
+                start = s['acked']
+                lines = s['lines'][start:start+self.batchSize]
+                final = s['final'] and start+len(lines) == len(s['lines'])
+            msg = {'rig':self.rig,'session':name,'start':start,'lines':lines,'final':final}
+            try:
+                reply = self.request(msg)
+            except (OSError,ValueError):
+                self.disconnect()
+                self.retries += 1
+                with self.cond:
+                    self.cond.wait(delay)
+                delay = min(2*delay,self.maxDelay)
+                continue
+            delay = self.retryDelay
+            with self.cond:
+                if 'error' in reply:
+                    s['error'] = reply['error']
+                    print('Upload of %s failed: %s'%(name,reply['error']))
+                else:
+                    self.sent += max(0,reply['next']-s['acked'])
+                    s['acked'] = reply['next']
+                    s['done'] = reply['done']
+                self.cond.notify_all()
+
+    def report(self):
+        with self.cond:
+            done = sum(s['done'] for s in self.sessions.values())
+            failed = sum(s['error'] is not None for s in self.sessions.values())
+            return 'Uploads to %s:%d: %d sessions (%d finished, %d failed, %d pending), %d rows acknowledged, %d retries'%(self.address[0],self.address[1],len(self.sessions),done,failed,len(self.pending()),self.sent,self.retries)
+
+#############
+## SESSION ##
+#############
+
+#Follows a session CSV while it is written (journal first, then the CSV once the writer has closed)
+class SessionTail:
+    def __init__(self,fname):
+        self.fname = fname
+        self.offset = 0
+
+    #Complete rows written since the last read
+    def read(self):
+        for path in [self.fname+'.journal',self.fname]:
+            try:
+                with open(path,'rb') as f:
+                    f.seek(self.offset)
+                    data = f.read()
+                break
+            except FileNotFoundError:
+                continue
+        else:
+            return []
+        end = data.rfind(b'\n')+1
+        self.offset += end
+        return data[:end].decode().splitlines(True)
+
+#Whether a session ran to the end (UrnTask.py saves the timing report only after the last block, and the writer removes the journal when it closes)
+def sessionComplete(fname):
+    return os.path.exists(fname+'.timing.txt') and not os.path.exists(fname+'.journal')
+
+#Session CSV (or journal) that appeared in dataDir since before
+def newSession(dataDir,before,subID):
+    prefix = '%s_CoinTask_'%subID
+    for f in sorted(os.listdir(dataDir)):
+        if f in before or not f.startswith(prefix):
+            continue
+        if f.endswith('.csv'):
+            return os.path.join(dataDir,f)
+        if f.endswith('.csv.journal'):
+            return os.path.join(dataDir,f[:-len('.journal')])
+    return None
+
+###########
+## QUEUE ##
+###########
+
+#Queue of sessions to run on this rig, kept in a JSON file
+class JobQueue:
+    def __init__(self,fname):
+        self.fname = fname
+        self.jobs = []
+        if os.path.exists(fname):
+            with open(fname) as f:
+                self.jobs = json.load(f)
+        # Sessions that were running when the runner stopped are not started again
+        for job in self.jobs:
+            if job['status'] == 'running':
+                job['status'] = 'interrupted'
+
+    def save(self):
+        os.makedirs(os.path.dirname(self.fname) or '.',exist_ok = True)
+        tmp = self.fname+'.tmp'
+        with open(tmp,'w') as f:
+            json.dump(self.jobs,f,indent = 1)
+        os.replace(tmp,self.fname)
+
+    #Queue one session (mode 'task' runs UrnTask.py, 'headless' runs it through UrnHeadless.py)
+    def add(self,subject,condition,seed = None,config = None,mode = 'task',age = 'NA',sex = 'NA'):
+        if not safeName.match(str(subject)):
+            raise ValueError('subject ID must be letters, digits, _ . or -: %r'%(subject,))
+        if int(condition) not in (1,2):
+            raise ValueError('condition must be 1 or 2')
+        if mode not in ('task','headless'):
+            raise ValueError("mode must be 'task' or 'headless'")
+        job = {'id':len(self.jobs)+1,'subject':str(subject),'condition':int(condition),'seed':seed,'config':os.path.abspath(config) if config else None,
+               'mode':mode,'age':age,'sex':sex,'status':'queued','datafile':None,'returncode':None}
+        self.jobs.append(job)
+        self.save()
+        return job
+
+    def queued(self):
+        return [job for job in self.jobs if job['status'] == 'queued']
+
+    def update(self,job,**changes):
+        job.update(changes)
+        self.save()
+
+#Queue file of a rig
+def queueFile(workDir):
+    return os.path.join(workDir,'data',queueName,'jobs.json')
+
+#Run one queued session and stream its rows to the uploader as they are recorded
+def runJob(job,workDir,uploader,poll = .2,killAfter = None):
+    # Arguments:
+    #     - killAfter: stop the session this many seconds after its data file appears (None = let it finish, used by demo to cut a session short)
+    # Output: return code of the session process, its data file (None if it never started one) and whether it ran to the end
+    workDir = os.path.abspath(workDir)
+    dataDir = os.path.join(workDir,'data')
+    logDir = os.path.join(dataDir,queueName)
+    os.makedirs(logDir,exist_ok = True)
+    before = set(os.listdir(dataDir))
+    if job['mode'] == 'task':
+        cmd = [sys.executable,os.path.join(taskDir,'UrnTask.py')]
+    else:
+        cmd = [sys.executable,os.path.join(taskDir,'UrnHeadless.py'),'--out',workDir,'--seed',str(job['seed'] or 0)]
+    env = dict(os.environ)
+    env[jobEnv] = json.dumps(job)
+    tail,name = None,None
+    with open(os.path.join(logDir,'job_%d.log'%job['id']),'w') as log:
+        proc = subprocess.Popen(cmd,cwd = workDir,env = env,stdout = log,stderr = subprocess.STDOUT)
+        while True:
+            if tail is None:
+                fname = newSession(dataDir,before,job['subject'])
+                if fname is not None:
+                    tail,name,found = SessionTail(fname),os.path.basename(fname),time.monotonic()
+            if killAfter is not None and tail is not None and time.monotonic()-found >= killAfter and proc.poll() is None:
+                proc.kill()
+                proc.wait()
+            finished = proc.poll() is not None
+            complete = finished and proc.returncode == 0 and tail is not None and sessionComplete(tail.fname)
+            if tail is not None:
+                lines = tail.read()
+                if lines or complete:
+                    uploader.add(name,lines,final = complete)
+            if finished:
+                break
+            time.sleep(poll)
+    return proc.returncode,(tail.fname if tail else None),complete
+
+#Run every queued session, then wait for the uploads
+def runQueue(queue,workDir,uploader,uploadTimeout = 60.,verbose = True):
+    for job in queue.queued():
+        queue.update(job,status = 'running',started = time.asctime())
+        if verbose:
+            print('Session %d: subject %s, condition %d, seed %s (%s)'%(job['id'],job['subject'],job['condition'],job['seed'],job['mode']))
+        rc,fname,complete = runJob(job,workDir,uploader)
+        status = 'done' if complete else 'failed'
+        queue.update(job,status = status,returncode = rc,datafile = os.path.relpath(fname,workDir) if fname else None,finished = time.asctime())
+        if verbose:
+            print('Session %d %s: %s'%(job['id'],status,fname))
+    ok = uploader.wait(uploadTimeout)
+    if verbose:
+        print(uploader.report())
+    return ok
+
+#Upload the sessions already in dataDir (safe to repeat - the store skips rows it has)
+def syncData(dataDir,uploader):
+    # Only complete sessions are marked finished. The rest (cut short, or still running) are uploaded as far as they go and stay .part in the store
+    n = 0
+    for f in sorted(os.listdir(dataDir)):
+        fname = os.path.join(dataDir,f)
+        if f.endswith('.csv'):
+            lines = SessionTail(fname).read()
+            uploader.add(f,lines[uploader.queued(f):],final = sessionComplete(fname))
+            n += 1
+    return n
+
+##########
+## DEMO ##
+##########
+
+#Headless sessions through a local store that drops connections, checked against the rig's own CSVs
+def demo(nSessions = 2,flaky = .2,seed = 0,outDir = None):
+    outDir = outDir or tempfile.mkdtemp(prefix = 'urnrunner_')
+    workDir,storeDir = os.path.join(outDir,'rig'),os.path.join(outDir,'store')
+    os.makedirs(os.path.join(workDir,'data'),exist_ok = True)
+    server = startStore(storeDir,'127.0.0.1',0,flaky = flaky,seed = seed)
+    print('Store on %s:%d, rig folder %s'%(server.server_address[0],server.server_address[1],workDir))
+    queue = JobQueue(queueFile(workDir))
+    for n in range(nSessions):
+        queue.add('DEMO_%d'%(n+1),n%2+1,seed+n,mode = 'headless')
+    uploader = Uploader(server.server_address,'demo',batchSize = 20)
+    runQueue(queue,workDir,uploader)
+    # One more session, stopped shortly after it has started - it must stay unfinished in the store
+    cut = queue.add('DEMO_CUT',1,seed+nSessions,mode = 'headless')
+    rc,cutFile,complete = runJob(cut,workDir,uploader,poll = .01,killAfter = .1)
+    queue.update(cut,status = 'done' if complete else 'failed',returncode = rc,datafile = os.path.relpath(cutFile,workDir) if cutFile else None)
+    # A second pass over the files must not add anything or finish the cut session
+    syncData(os.path.join(workDir,'data'),uploader)
+    uploader.wait(60.)
+    uploader.close()
+    print(server.store.report())
+    server.shutdown()
+    server.server_close()
+    ok = True
+    for job in queue.jobs[:-1]:
+        local = os.path.join(workDir,job['datafile'])
+        stored = os.path.join(storeDir,'demo',os.path.basename(local))
+        with open(local,'rb') as a:
+            same = os.path.exists(stored) and open(stored,'rb').read() == a.read()
+        ok = ok and same
+        print('%s: %s'%(os.path.basename(local),'identical in the store' if same else 'MISSING OR DIFFERENT in the store'))
+    stored = os.path.join(storeDir,'demo',os.path.basename(cutFile)) if cutFile else None
+    unfinished = stored is not None and not complete and os.path.exists(stored+'.part') and not os.path.exists(stored)
+    if unfinished:
+        with open(stored+'.part') as f:
+            unfinished = f.read() == ''.join(SessionTail(cutFile).read())
+    ok = ok and unfinished
+    print('%s (stopped, exit code %s): %s'%(os.path.basename(cutFile) if cutFile else cut['subject'],rc,'kept unfinished in the store, rows identical' if unfinished else 'WRONGLY FINISHED, MISSING OR DIFFERENT in the store'))
+    return ok
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description = 'Run queued UrnTask sessions and collect their data in a central store')
+    sub = parser.add_subparsers(dest = 'command',required = True)
+    p = sub.add_parser('store',help = 'run the central store')
+    p.add_argument('dir',type = str)
+    p.add_argument('--host',type = str,default = '127.0.0.1',help = 'address to listen on (0.0.0.0 for the lab network)')
+    p.add_argument('--port',type = int,default = defaultPort)
+    p = sub.add_parser('add',help = 'queue a session')
+    p.add_argument('--subject',type = str,required = True)
+    p.add_argument('--condition',type = int,required = True)
+    p.add_argument('--seed',type = int,default = None)
+    p.add_argument('--config',type = str,default = None,help = 'JSON session config (see UrnConfig.py)')
+    p.add_argument('--headless',action = 'store_true',help = 'simulated participant (see UrnHeadless.py)')
+    rigParsers = [p,sub.add_parser('list',help = 'show the queue')]
+    for name,text in [('run','run the queued sessions'),('sync','upload the finished CSVs in data/')]:
+        p = sub.add_parser(name,help = text)
+        p.add_argument('--store',type = str,default = '127.0.0.1:%d'%defaultPort,help = 'host:port of the store')
+        p.add_argument('--rig',type = str,default = socket.gethostname().split('.')[0])
+        rigParsers.append(p)
+    for p in rigParsers:
+        p.add_argument('--work',type = str,default = taskDir,help = 'folder whose data/ the sessions write to')
+    p = sub.add_parser('demo',help = 'test everything on localhost')
+    p.add_argument('--sessions',type = int,default = 2)
+    p.add_argument('--flaky',type = float,default = .2)
+    p.add_argument('--seed',type = int,default = 0)
+    p.add_argument('--out',type = str,default = None)
+    args = parser.parse_args()
+
+    if args.command == 'store':
+        server = startStore(args.dir,args.host,args.port)
+        print('Store %s listening on %s:%d (Ctrl-C to stop)'%(args.dir,args.host,args.port))
+        try:
+            while True:
+                time.sleep(60)
+                print(server.store.report())
+        except KeyboardInterrupt:
+            server.shutdown()
+            print(server.store.report())
+    elif args.command == 'add':
+        job = JobQueue(queueFile(args.work)).add(args.subject,args.condition,args.seed,args.config,'headless' if args.headless else 'task')
+        print('Queued session %d: subject %s, condition %d'%(job['id'],job['subject'],job['condition']))
+    elif args.command == 'list':
+        for job in JobQueue(queueFile(args.work)).jobs:
+            print('%3d  %-12s cond %d  seed %-6s %-8s %-11s %s'%(job['id'],job['subject'],job['condition'],job['seed'],job['mode'],job['status'],job['datafile'] or ''))
+    elif args.command in ('run','sync'):
+        uploader = Uploader(parseAddress(args.store),args.rig)
+        if args.command == 'run':
+            ok = runQueue(JobQueue(queueFile(args.work)),args.work,uploader)
+        else:
+            print('%d sessions to upload'%syncData(os.path.join(args.work,'data'),uploader))
+            ok = uploader.wait(60.)
+            print(uploader.report())
+        uploader.close()
+        if not ok:
+            print('Some rows are not in the store yet - run sync again once it is reachable')
+            sys.exit(1)
+    else:
+        sys.exit(0 if demo(args.sessions,args.flaky,args.seed,args.out) else 1)
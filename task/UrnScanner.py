@@ -0,0 +1,358 @@
+import numpy as np
+import argparse, atexit, json, queue, random, sys, threading, time
+from collections import namedtuple
+
+'''
+Scanner (trigger-synchronised) timing for the Urn Hazard prediction task
+
+In scanner mode each part of the main task is one scanner run. The run starts on the first trigger pulse and every onset of the main blocks comes from an onset schedule (ScanSchedule, in seconds from that pulse):
+    - cue: block type screen (shown for cueDur, no key press needed)
+    - beads: bead onsets (the response screen, where the new bead first appears); the "Drawing bead..." text is shown drawLead seconds before each
+    - feedback: feedback screen (shown for fbDur)
+The slider response window is capped at respWindow seconds (no click = "Not Sure"). Blank screens fill the time between events, so the jittered ITIs of the schedule are the blanks.
+trialIDs are the canonical generating items (0 = orange/low, 1 = blue/high), whichever side each item is shown on.
+
+ScanTimer.flipAt locks each onset to the pulses: the target time is the latest pulse received plus the rest of the scheduled onset within that volume, so the onsets do not drift with the scanner clock. The screen is flipped on the frame closest to the target. Every pulse and onset is logged against the trigger clock (seconds since the first pulse of the run) in <data file>.onsets.tsv:
+    run, event, block, trial, volume, scheduled, target, actual, error (ms, actual - target)
+The per-session report gives the onset errors per event type and any missed pulses. It is printed at the end of the session and saved with it in <data file>.timing.txt.
+
+Trigger sources (all give pulse times on the task clock):
+    - KeyboardTrigger: scanner keyboard emulation (a key press per volume, '5' by default)
+    - SerialTrigger: a byte per volume on a serial port (needs pyserial)
+    - SimulatedTrigger: pulses every TR computed from the task clock, with optional jitter and dropped pulses; also works on the simulated clock of UrnHeadless.py
+Send simulated pulses to a serial port (e.g. one end of a null-modem or virtual serial pair) with:
+    python UrnScanner.py --emulate COM3 --tr 2
+Make a random jittered schedule for the default session with:
+    python UrnScanner.py --schedule scan.json
+'''
+
+ScanSchedule = namedtuple('ScanSchedule',['tr','cueDur','respWindow','fbDur','trialBlocks','trialIDs','cue','beads','feedback','runDur'])
+
+drawLead = 1. #the "Drawing bead..." text (.75s) and a blank (.25s) come before each bead
+minBlank = .25 #shortest blank screen between events (s)
+
+######################
+## TRIGGER SOURCES ##
+######################
+
+#Simulated scanner: a pulse every tr seconds from arm() + delay
+class SimulatedTrigger:
+    def __init__(self,tr,clock = time.perf_counter,delay = 1.,jitter = 0.,drop = 0.,seed = None):
+        self.tr = tr
+        self.clock = clock
+        self.delay = delay
+        self.jitter = jitter
+        self.drop = drop
+        self.rng = np.random.default_rng(seed)
+        self.start = None
+        self.next = 0
+
+    def arm(self):
+        self.start = self.clock()+self.delay
+        self.next = 0
+
+    #Pulse times since the last poll
+    def poll(self):
+        if self.start is None:
+            return []
+        pulses = []
+        now = self.clock()
+        while self.start+self.next*self.tr <= now:
+            t = self.start+self.next*self.tr
+            self.next += 1
+            if self.next > 1 and self.rng.random() < self.drop:
+                continue
+            pulses.append(t+abs(self.rng.normal(0,self.jitter)) if self.jitter else t)
+        return pulses
+
+    def close(self):
+        pass
+
+#Scanner keyboard emulation (pulse times are the key event times)
+class KeyboardTrigger:
+    def __init__(self,key = '5'):
+        from psychopy import event
+        self.event = event
+        self.key = key
+
+    def arm(self):
+        self.event.getKeys(keyList = [self.key]) #drop presses from before the run
+
+    def poll(self):
+        return [t for k,t in self.event.getKeys(keyList = [self.key],timeStamped = True)]
+
+    def close(self):
+        pass
+
+#Trigger bytes on a serial port, timestamped on a reader thread
+class SerialTrigger:
+    def __init__(self,port,baud = 115200,byte = b'5',clock = time.perf_counter):
+        import serial
+        self.port = serial.Serial(port,baud,timeout = .01)
+        self.byte = byte
+        self.clock = clock
+        self.pulses = queue.SimpleQueue()
+        self.running = True
+        self.thread = threading.Thread(target = self.read,name = 'SerialTrigger',daemon = True)
+        self.thread.start()
+
+    def read(self):
+        while self.running:
+            data = self.port.read(1)
+            if data == self.byte:
+                self.pulses.put(self.clock())
+
+    def arm(self):
+        self.poll()
+
+    def poll(self):
+        pulses = []
+        while True:
+            try:
+                pulses.append(self.pulses.get_nowait())
+            except queue.Empty:
+                return pulses
+
+    def close(self):
+        self.running = False
+        self.thread.join()
+        self.port.close()
+
+##############
+## SCHEDULE ##
+##############
+
+#Onset schedule from the blank durations between events (s)
+def scheduleFromGaps(trialBlocks,trialIDs,gaps,tr = 2.,cueDur = 2.,respWindow = 3.,fbDur = 1.,leadIn = 4.,tail = 12.):
+    # gaps: one blank before each "Drawing bead..." text, one before and one after each feedback
+    # (sum(trialBlocks)+2*len(trialBlocks) in time order)
+    # leadIn: time before the first cue, tail: time after the last feedback (for the haemodynamic response)
+    gaps = iter(gaps)
+    cue,beads,feedback = [],[],[]
+    t = leadIn
+    for n in trialBlocks:
+        cue.append(round(t,3))
+        t += cueDur
+        onsets = []
+        for k in range(n):
+            t += next(gaps)+drawLead
+            onsets.append(round(t,3))
+            t += respWindow
+        beads.append(onsets)
+        t += next(gaps)
+        feedback.append(round(t,3))
+        t += fbDur
+        runDur = t+tail
+        t += next(gaps)
+    return ScanSchedule(tr,cueDur,respWindow,fbDur,list(trialBlocks),list(trialIDs),cue,beads,feedback,round(runDur,3))
+
+#Random jittered onset schedule for the main blocks of one run
+def makeScanSchedule(trialBlocks,trialIDs,tr = 2.,cueDur = 2.,respWindow = 3.,fbDur = 1.,itiMean = 1.,itiMax = 4.,leadIn = 4.,tail = 12.,rng = random):
+    # Every blank is minBlank plus an exponential jitter (mean itiMean, truncated at itiMax), rounded to ms
+    gaps = [round(minBlank+min(rng.expovariate(1/itiMean),itiMax),3) for g in range(sum(trialBlocks)+2*len(trialBlocks))]
+    return scheduleFromGaps(trialBlocks,trialIDs,gaps,tr,cueDur,respWindow,fbDur,leadIn,tail)
+
+#Check a schedule for onsets that come too soon after the previous event
+def checkScanSchedule(s):
+    if not len(s.trialBlocks) == len(s.trialIDs) == len(s.cue) == len(s.beads) == len(s.feedback):
+        raise ValueError('trialBlocks, trialIDs, cue, beads and feedback must have one entry per block')
+    end = 0.
+    for i,n in enumerate(s.trialBlocks):
+        if len(s.beads[i]) != n:
+            raise ValueError('block %d has %d bead onsets for %d beads'%(i+1,len(s.beads[i]),n))
+        checks = [('cue',s.cue[i],end)]
+        end = s.cue[i]+s.cueDur
+        for k,b in enumerate(s.beads[i]):
+            checks.append(('bead %d'%(k+1),b-drawLead,end))
+            end = b+s.respWindow
+        checks.append(('feedback',s.feedback[i],end))
+        end = s.feedback[i]+s.fbDur
+        for name,onset,prev in checks:
+            if onset < prev+minBlank-1e-9:
+                raise ValueError('block %d %s at %.3fs is less than %.2fs after the previous event (%.3fs)'%(i+1,name,onset,minBlank,prev))
+    if s.runDur < end:
+        raise ValueError('runDur %.3fs ends before the last feedback (%.3fs)'%(s.runDur,end))
+    return s
+
+#Load an onset schedule from JSON
+def loadScanSchedule(fname):
+    with open(fname) as f:
+        d = json.load(f)
+    return checkScanSchedule(ScanSchedule(**dict((k,d[k]) for k in ScanSchedule._fields)))
+
+#Save an onset schedule as JSON (extra: dict of other information to keep in the file, ignored by loadScanSchedule)
+def saveScanSchedule(s,fname,extra = None):
+    d = s._asdict()
+    if extra:
+        d.update(extra)
+    with open(fname,'w') as f:
+        json.dump(d,f,indent = 1)
+
+#Onsets of block i as used by trialBlockRun
+def blockOnsets(s,i):
+    return {'block':i+1,'cue':s.cue[i],'beads':list(s.beads[i]),'feedback':s.feedback[i],'cueDur':s.cueDur,'respWindow':s.respWindow,'fbDur':s.fbDur}
+
+###########
+## TIMER ##
+###########
+
+#Onsets locked to trigger pulses, logged against the trigger clock
+class ScanTimer:
+    # Arguments:
+    #     - trigger: trigger source, win: window (its flip gives the onset times), clock, wait: task clock and wait (core.getTime, core.wait)
+    #     - fname: onset log (<data file>.onsets.tsv)
+    #     - idle: called while waiting (e.g. to check for the quit key)
+    def __init__(self,trigger,win,clock,wait,fname,tr = 2.,idle = None):
+        self.trigger = trigger
+        self.win = win
+        self.clock = clock
+        self.sleep = wait
+        self.tr = tr
+        self.idle = idle
+        self.frameDur = getattr(win,'monitorFramePeriod',None) or 1/60.
+        self.run = None
+        self.pulses = []
+        self.volumes = []
+        self.runs = [] #(run, pulse times, onset rows) of finished runs
+        self.rows = []
+        self.f = open(fname,'w')
+        self.f.write('run\tevent\tblock\ttrial\tvolume\tscheduled\ttarget\tactual\terror\n')
+        atexit.register(self.close)
+
+    def poll(self):
+        new = self.trigger.poll()
+        if self.run is not None:
+            for t in new:
+                # Volume number from the time since the first pulse, so a missed pulse does not shift the rest
+                vol = int(round((t-self.pulses[0])/self.tr)) if self.pulses else 0
+                self.pulses.append(t)
+                self.volumes.append(vol)
+                self.write('pulse',0,0,vol,np.nan,np.nan,t-self.pulses[0],np.nan)
+
+    def write(self,event,block,trial,volume,scheduled,target,actual,error):
+        self.f.write('%s\t%s\t%d\t%d\t%d\t%.4f\t%.4f\t%.4f\t%.2f\n'%(self.run,event,block,trial,volume,scheduled,target,actual,error))
+
+    def wait(self,secs):
+        end = self.clock()+secs
+        while self.clock() < end:
+            self.poll()
+            if self.idle is not None:
+                self.idle()
+            self.sleep(max(0,min(.002,end-self.clock())))
+
+    #Wait for the first pulse of a run (the screen to show while waiting should already be on)
+    def startRun(self,name,tr = None):
+        if tr is not None:
+            self.tr = tr
+        self.run = name
+        self.pulses = []
+        self.volumes = []
+        self.rows = []
+        self.trigger.arm()
+        while not self.pulses:
+            self.poll()
+            if self.idle is not None:
+                self.idle()
+            if not self.pulses:
+                self.sleep(.001)
+        return self.pulses[0]
+
+    #Target time of an onset (s from the first pulse) on the task clock, from the latest pulse received up to its volume
+    def target(self,onset):
+        k = np.searchsorted(self.volumes,int(onset/self.tr),'right')-1
+        vol = self.volumes[k]
+        return self.pulses[k]+onset-vol*self.tr,vol
+
+    #Flip the drawn screen on the frame closest to the scheduled onset
+    def flipAt(self,event,onset,block = 0,trial = 0):
+        while True:
+            self.poll()
+            target,vol = self.target(onset)
+            left = target-self.frameDur/2-self.clock()
+            if left <= 0:
+                break
+            if self.idle is not None:
+                self.idle()
+            self.sleep(min(left,.002))
+        t = self.win.flip()
+        t0 = self.pulses[0]
+        err = 1000*(t-target)
+        self.rows.append((event,err))
+        self.write(event,block,trial,vol,onset,target-t0,t-t0,err)
+        return t
+
+    #Wait out the rest of the run (runDur s from the first pulse)
+    def endRun(self,runDur):
+        left = self.pulses[0]+runDur-self.clock()
+        if left > 0:
+            self.wait(left)
+        self.poll()
+        self.runs.append((self.run,list(self.pulses),list(self.rows)))
+        self.run = None
+        self.f.flush()
+
+    def close(self):
+        if not self.f.closed:
+            self.f.close()
+            self.trigger.close()
+
+    def report(self):
+        return scanReport(self.runs,self.tr,self.frameDur)
+
+#Onset error and pulse summary of the finished runs
+def scanReport(runs,tr,frameDur):
+    lines = ['Scanner timing (onset error = flip - target, ms):']
+    for name,pulses,rows in runs:
+        p = np.diff(pulses)
+        missed = int(np.sum(np.round(p/tr)-1)) if len(p) else 0
+        lines.append('  run %s: %d pulses, median TR %.4fs, %d missed'%(name,len(pulses),np.median(p) if len(p) else np.nan,missed))
+        for event in sorted(set(r[0] for r in rows)):
+            err = np.array([r[1] for r in rows if r[0] == event])
+            lines.append('    %-10s n=%4d  mean %6.2f  sd %5.2f  max |err| %6.2f  within a frame %5.1f%%'%(event,len(err),err.mean(),err.std(),np.abs(err).max(),100*np.mean(np.abs(err) <= 1000*frameDur)))
+    return '\n'.join(lines)
+
+#Scanner timer for the task: source None (no scanner mode), 'keyboard', 'serial' or 'simulated'
+def openScanTimer(source,win,clock,wait,fname,tr = 2.,port = None,idle = None):
+    if source is None:
+        return None
+    if source == 'keyboard':
+        trigger = KeyboardTrigger()
+    elif source == 'serial':
+        trigger = SerialTrigger(port,clock = clock)
+    elif source == 'simulated':
+        trigger = SimulatedTrigger(tr,clock)
+    else:
+        raise ValueError('unknown trigger source %r'%source)
+    return ScanTimer(trigger,win,clock,wait,fname,tr,idle)
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description = 'Scanner schedules and simulated trigger pulses')
+    parser.add_argument('--schedule',type = str,default = None,help = 'write a random jittered onset schedule to this JSON file')
+    parser.add_argument('--config',type = str,default = None,help = 'JSON session config (see UrnConfig.py)')
+    parser.add_argument('--seed',type = int,default = None)
+    parser.add_argument('--emulate',type = str,default = None,help = 'send a trigger byte every TR to this serial port')
+    parser.add_argument('--tr',type = float,default = 2.)
+    args = parser.parse_args()
+    if args.schedule:
+        from UrnConfig import defaultConfig, loadConfig, makeSchedule
+        cfg = loadConfig(args.config) if args.config else defaultConfig
+        rng = random.Random(args.seed)
+        s = checkScanSchedule(makeScanSchedule(*makeSchedule(cfg,rng),tr = args.tr,rng = rng))
+        saveScanSchedule(s,args.schedule)
+        print('%d blocks, run length %.1fs (%d volumes), written to %s'%(len(s.trialBlocks),s.runDur,int(np.ceil(s.runDur/s.tr)),args.schedule))
+    elif args.emulate:
+        import serial
+        port = serial.Serial(args.emulate,115200)
+        start = time.perf_counter()
+        n = 0
+        print('Sending a pulse every %gs to %s (Ctrl-C to stop)'%(args.tr,args.emulate))
+        try:
+            while True:
+                time.sleep(max(0,start+n*args.tr-time.perf_counter()))
+                port.write(b'5')
+                n += 1
+        except KeyboardInterrupt:
+            port.close()
+    else:
+        parser.print_usage()
+        sys.exit(1)
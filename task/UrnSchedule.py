@@ -0,0 +1,239 @@
+import numpy as np
+import argparse, math, os, time
+from concurrent.futures import ProcessPoolExecutor
+
+from UrnObserver import buildConfTable, historyIndex
+from UrnConfig import defaultConfig, loadConfig, checkConfig
+from UrnScanner import scheduleFromGaps, checkScanSchedule, saveScanSchedule, minBlank, drawLead
+
+'''
+fMRI design optimisation of the scanner onset schedule for the Urn Hazard prediction task
+
+Searches for the scanner schedule (UrnScanner.py) whose bead-onset uncertainty regressors can be estimated best. The search is over three things:
+    - the order of the blocks (every block length still niter times, as in makeSchedule)
+    - the generating item of each block (trialIDs, still half 0 and half 1)
+    - the jittered blanks between events (each between minBlank and minBlank+itiMax s, with their total fixed so every schedule has the same run length)
+
+Both parts run the same schedule, one scanner run each. The regressor of interest in each run is the ideal observer's uncertainty after each bead (1-|2p-1|, p = posterior of item 1, from the lookup tables of UrnObserver.py). It is mean-centred and used as a parametric modulator of the bead onsets. Its efficiency is 1/var of its estimate:
+    - the model has HRF-convolved cue, "Drawing bead..." text, bead onset and feedback regressors, an intercept and a DCT high-pass (128 s), all sampled at every volume
+    - bead sequences are only drawn during the session, so efficiency is averaged over nReal bead realisations
+    - the realisations use common random numbers (fixed uniforms per block), so candidates are compared on the same draws
+The score of a schedule is the harmonic mean of the urn-run and hazard-run efficiencies, so neither run is traded away for the other.
+
+Search: a genetic algorithm on several islands. Each island evolves its own population:
+    - parents are picked by tournament
+    - a child takes its block order and items from one parent, and a random mix of both parents' blanks
+    - it is then mutated by swapping blocks, swapping the items of two blocks, or moving time between blanks
+    - the best of parents and children survive
+Islands run in parallel worker processes for a number of generations. The best schedule of each island then migrates to the next island, and this repeats for the set number of rounds. Every island has its own seed, so the result does not depend on the number of workers.
+
+Example (writes a schedule the task loads with scanScheduleFile in UrnTask.py):
+    python UrnSchedule.py --out scan.json --generations 200 --islands 8
+'''
+
+nReal = 16 #bead realisations per efficiency
+hpCutoff = 128. #high-pass cutoff (s)
+
+# Search settings
+defaultSearch = {'population':32,'generations':120,'islands':4,'rounds':4,'tournament':3,'mutations':3,'gapStep':.5}
+
+#Canonical (SPM) double-gamma HRF
+def hrf(t):
+    t = np.maximum(t,0)
+    h = t**5*np.exp(-t)/math.gamma(6)-t**15*np.exp(-t)/(6*math.gamma(16))
+    return np.where((t > 0) & (t < 32),h,0.)
+
+#Intercept and DCT high-pass regressors for nvol volumes
+def driftBasis(nvol,tr,cutoff = hpCutoff):
+    k = int(2*nvol*tr/cutoff)+1
+    n = np.arange(nvol)
+    basis = [np.ones(nvol)]
+    for j in range(1,k):
+        basis.append(np.cos(np.pi*j*(2*n+1)/(2*nvol)))
+    return np.stack(basis,axis = 1)
+
+#Gaps between minBlank and maxGap that add up to total (closest shift of gaps, clipped)
+def projectGaps(gaps,total,lo,hi):
+    a,b = lo-gaps.max(),hi-gaps.min()
+    for i in range(60):
+        mid = (a+b)/2
+        if np.clip(gaps+mid,lo,hi).sum() < total:
+            a = mid
+        else:
+            b = mid
+    return np.clip(gaps+(a+b)/2,lo,hi)
+
+#Ideal observer uncertainty after every bead of every block, for one assignment of items
+def uncertainty(blkType,lengths,ids,uniforms,cfg,table):
+    # Arguments:
+    #     - lengths, ids: block length and generating item of each block (in block identity order)
+    #     - uniforms: (nReal, n_blocks, maxLen) fixed uniforms that decide the beads
+    # Output: (nReal, n_blocks, maxLen), NaN past the end of each block
+    nr,nb,maxLen = uniforms.shape
+    ids = np.asarray(ids)
+    if blkType == 'urn':
+        beads = np.where(uniforms < cfg.urnBias,ids[None,:,None],1-ids[None,:,None])
+    else:
+        h = np.asarray(cfg.hazards)[ids]
+        switches = (uniforms[:,:,1:] < h[None,:,None]).astype(np.int64)
+        first = (uniforms[:,:,:1] < .5).astype(np.int64)
+        beads = (first+np.concatenate([np.zeros((nr,nb,1),dtype = np.int64),np.cumsum(switches,axis = 2)],axis = 2)) & 1
+    rows = historyIndex(beads.reshape(nr*nb,maxLen)).reshape(beads.shape)
+    u = 1-np.abs(2*table.posterior[rows]-1)
+    return np.where(np.arange(maxLen)[None,None,:] < np.asarray(lengths)[None,:,None],u,np.nan)
+
+#Everything needed to score schedules (shared by the workers)
+class DesignProblem:
+    def __init__(self,cfg = defaultConfig,tr = 2.,cueDur = 2.,respWindow = 3.,fbDur = 1.,itiMean = 1.,itiMax = 4.,leadIn = 4.,tail = 12.,seed = 0):
+        checkConfig(cfg) #niter must be even, so the items can be split evenly
+        self.cfg = cfg
+        self.timing = dict(tr = tr,cueDur = cueDur,respWindow = respWindow,fbDur = fbDur,leadIn = leadIn,tail = tail)
+        self.lengths = np.array(list(cfg.blockLengths)*cfg.niter)
+        self.nb = len(self.lengths)
+        self.ngaps = int(self.lengths.sum())+2*self.nb
+        self.lo,self.hi = minBlank,minBlank+itiMax
+        self.total = self.ngaps*(minBlank+itiMean)
+        maxLen = int(self.lengths.max())
+        self.uniforms = np.random.default_rng(seed).random((nReal,self.nb,maxLen))
+        self.tables = dict((b,buildConfTable(b,float(cfg.urnBias),tuple(float(h) for h in cfg.hazards),float(cfg.slope),maxLen)) for b in ['urn','hazard'])
+        s = self.schedule(self.random(np.random.default_rng(seed)))
+        self.nvol = int(np.ceil(s.runDur/tr))
+        self.vt = np.arange(self.nvol)*tr
+        self.drift = driftBasis(self.nvol,tr)
+
+    #Random candidate: block order, item of each block (by identity), blanks
+    def random(self,rng):
+        ids = rng.permutation(np.tile([0,1],self.nb//2))
+        gaps = projectGaps(minBlank+np.minimum(rng.exponential(self.total/self.ngaps-minBlank,self.ngaps),self.hi-minBlank),self.total,self.lo,self.hi)
+        return (rng.permutation(self.nb),ids,gaps)
+
+    def schedule(self,cand):
+        order,ids,gaps = cand
+        return scheduleFromGaps([int(n) for n in self.lengths[order]],[int(i) for i in ids[order]],[round(float(g),3) for g in gaps],**self.timing)
+
+    #Efficiency of the urn and hazard uncertainty modulators (mean over realisations)
+    def efficiency(self,cand):
+        order,ids,gaps = cand
+        s = self.schedule(cand)
+        beadOnsets = np.concatenate([np.array(b) for b in s.beads])
+        draws = beadOnsets-drawLead #"Drawing bead..." text
+        nuisance = [self.drift]
+        for onsets in [s.cue,draws,beadOnsets,s.feedback]:
+            nuisance.append(hrf(self.vt[:,None]-np.asarray(onsets)[None,:]).sum(axis = 1)[:,None])
+        q = np.linalg.qr(np.concatenate(nuisance,axis = 1))[0]
+        H = hrf(self.vt[:,None]-beadOnsets[None,:]) #(volumes, bead events)
+        lengths = self.lengths[order]
+        valid = np.arange(self.uniforms.shape[2])[None,:] < lengths[:,None]
+        effs = []
+        for blkType in ['urn','hazard']:
+            u = uncertainty(blkType,self.lengths,ids,self.uniforms,self.cfg,self.tables[blkType])[:,order] #slot order
+            mods = u[:,valid] #(nReal, bead events) in time order
+            mods = mods-mods.mean(axis = 1,keepdims = True)
+            x = H @ mods.T
+            x = x-q @ (q.T @ x)
+            effs.append(float((x**2).sum(axis = 0).mean()))
+        return effs
+
+    def score(self,cand):
+        e = self.efficiency(cand)
+        return 2/(1/e[0]+1/e[1])
+
+    #Child of two parents
+    def child(self,a,b,rng,search):
+        mix = rng.random()
+        order,ids = a[0].copy(),a[1].copy()
+        gaps = mix*a[2]+(1-mix)*b[2]
+        for m in range(rng.integers(1,search['mutations']+1)):
+            kind = rng.integers(3)
+            if kind == 0:
+                i,j = rng.choice(self.nb,2,replace = False)
+                order[i],order[j] = order[j],order[i]
+            elif kind == 1:
+                i = rng.choice(np.flatnonzero(ids == 0))
+                j = rng.choice(np.flatnonzero(ids == 1))
+                ids[i],ids[j] = 1,0
+            else:
+                k = rng.choice(self.ngaps,max(1,self.ngaps//20),replace = False)
+                gaps = gaps.copy()
+                gaps[k] += rng.normal(0,search['gapStep'],len(k))
+                gaps = projectGaps(gaps,self.total,self.lo,self.hi)
+        return (order,ids,gaps)
+
+#Evolve one island for a number of generations
+def evolveIsland(job):
+    problem,population,generations,seed,search = job
+    rng = np.random.default_rng(seed)
+    if population is None:
+        population = [problem.random(rng) for i in range(search['population'])]
+    scores = np.array([problem.score(c) for c in population])
+    for g in range(generations):
+        children = []
+        for k in range(len(population)):
+            parents = []
+            for p in range(2):
+                entrants = rng.choice(len(population),search['tournament'],replace = False)
+                parents.append(population[entrants[np.argmax(scores[entrants])]])
+            children.append(problem.child(parents[0],parents[1],rng,search))
+        childScores = np.array([problem.score(c) for c in children])
+        pool = population+children
+        allScores = np.concatenate([scores,childScores])
+        keep = np.argsort(-allScores)[:len(population)]
+        population = [pool[i] for i in keep]
+        scores = allScores[keep]
+    return population,scores
+
+#Island-model search for the most efficient schedule
+def optimise(problem,search = defaultSearch,seed = 0,workers = None,verbose = False):
+    # Output: best candidate, its score, and the score of the best random schedule of the first generation
+    islands = search['islands']
+    rounds = max(1,search['rounds'])
+    gens = [search['generations']//rounds+(r < search['generations'] % rounds) for r in range(rounds)]
+    pops = [None]*islands
+    if workers is None:
+        workers = os.cpu_count() or 1
+    pool = ProcessPoolExecutor(max_workers = workers) if workers > 1 and islands > 1 else None
+    baseline = None
+    try:
+        for r in range(rounds):
+            seeds = [np.random.SeedSequence([seed,i,r]) for i in range(islands)]
+            jobs = [(problem,pops[i],gens[r],seeds[i],search) for i in range(islands)]
+            if r == 0:
+                rng = np.random.default_rng(seed)
+                baseline = max(problem.score(problem.random(rng)) for i in range(search['population']))
+            results = list(pool.map(evolveIsland,jobs)) if pool else list(map(evolveIsland,jobs))
+            pops = [list(p) for p,s in results]
+            best = [s[0] for p,s in results]
+            # Migration: the best of each island replaces the worst of the next
+            for i in range(islands):
+                pops[(i+1) % islands][-1] = results[i][0][0]
+            if verbose:
+                print('Round %d: best score per island %s'%(r+1,', '.join('%.3f'%b for b in best)))
+    finally:
+        if pool:
+            pool.shutdown()
+    i = int(np.argmax(best))
+    return results[i][0][0],best[i],baseline
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description = 'Optimise the scanner onset schedule for design efficiency')
+    parser.add_argument('--out',type = str,default = 'scan.json')
+    parser.add_argument('--config',type = str,default = None,help = 'JSON session config (see UrnConfig.py)')
+    parser.add_argument('--tr',type = float,default = 2.)
+    parser.add_argument('--iti-mean',type = float,default = 1.,help = 'mean jitter added to each blank (s)')
+    parser.add_argument('--iti-max',type = float,default = 4.,help = 'longest jitter (s)')
+    for k,v in defaultSearch.items():
+        parser.add_argument('--'+k,type = type(v),default = v)
+    parser.add_argument('--seed',type = int,default = 0)
+    parser.add_argument('--workers',type = int,default = None)
+    args = parser.parse_args()
+
+    cfg = loadConfig(args.config) if args.config else defaultConfig
+    search = dict((k,getattr(args,k)) for k in defaultSearch)
+    start = time.perf_counter()
+    problem = DesignProblem(cfg,tr = args.tr,itiMean = args.iti_mean,itiMax = args.iti_max,seed = args.seed)
+    best,score,baseline = optimise(problem,search,args.seed,args.workers,verbose = True)
+    s = checkScanSchedule(problem.schedule(best))
+    effs = problem.efficiency(best)
+    saveScanSchedule(s,args.out,extra = {'design':{'efficiencyUrn':effs[0],'efficiencyHazard':effs[1],'score':score,'randomScore':baseline,'seed':args.seed,'search':search}})
+    print('Efficiency urn %.3f, hazard %.3f (score %.3f, best random schedule %.3f, %+.0f%%)'%(effs[0],effs[1],score,baseline,100*(score/baseline-1)))
+    print('%d blocks, run length %.1fs (%d volumes), %.1fs, written to %s'%(len(s.trialBlocks),s.runDur,problem.nvol,time.perf_counter()-start,args.out))
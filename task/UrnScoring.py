@@ -0,0 +1,64 @@
+import numpy as np
+from math import log
+from functools import lru_cache
+
+'''
+Point scoring for the Urn Hazard prediction task
+
+adjustConf converts a confidence judgement into the points a subject wins on a correct response (used by feedback in UrnTask.py).
+adjustConfArray and feedbackPoints do the same over whole arrays of confidence values, for reward calibration sweeps and simulations. They give the same points as the scalar path.
+'''
+
+#Convert confidence value into adjusted points value
+#def adjustConf(conf):
+#    intercept = -log(.05)+1
+#    normFact = intercept+log(.95)
+#    if conf <= .05:
+#        payoff = conf/.05
+#    elif conf < .95:
+#        payoff = intercept + log(conf)
+#    elif conf >= .95:
+#        payoff = intercept + log(.95)+(conf-.95)/.95
+#    return(payoff/normFact)
+
+#Normalisation constants of the logistic payoff, computed once per (slp, loBound, hiBound)
+@lru_cache(maxsize = 1024)
+def normConsts(slp,loBound,hiBound):
+    lowestVal = 1/(1+np.exp(-loBound/slp))
+    highestVal = 1/(1+np.exp(-hiBound/slp))
+    normFact = highestVal-lowestVal
+    return lowestVal,normFact
+
+def adjustConf(conf,slp,loBound=-.5,hiBound=.5):
+    lowestVal,normFact = normConsts(slp,loBound,hiBound)
+    if conf <= loBound:
+        rew = 0
+    elif conf >= hiBound:
+        rew = 1
+    else:
+        rew = ((1/(1+np.exp(-conf/slp)))-lowestVal)/normFact
+    pay = (rew*2)-1 #adjust to put on a -1,1 scale
+    return(pay)
+
+#Array version of adjustConf
+def adjustConfArray(conf,slp,loBound=-.5,hiBound=.5):
+    lowestVal,normFact = normConsts(slp,loBound,hiBound)
+    conf = np.asarray(conf,dtype = float)
+    with np.errstate(over = 'ignore'):
+        rew = ((1/(1+np.exp(-conf/slp)))-lowestVal)/normFact
+    rew = np.where(conf <= loBound,0,np.where(conf >= hiBound,1,rew))
+    return (rew*2)-1
+
+#Points given by the feedback screen for whole arrays of responses
+def feedbackPoints(outcome,conf,slp = .08,loBound = -.5,hiBound = .5):
+    # Arguments:
+    #     - outcome: 1 if the response was correct, 0 if incorrect, -1 if there was no response (click on "Not Sure")
+    #     - conf: confidence from 0 to 1 as returned by predict
+    #     - slp, loBound, hiBound: payoff parameters passed to adjustConf
+    # Output:
+    #     - rounded points, as returned by feedback (correct: logistic reward, incorrect: linear punishment, no response: 0)
+    outcome = np.asarray(outcome)
+    conf = np.asarray(conf,dtype = float)
+    points = np.where(outcome == 1,10*adjustConfArray(conf/2,slp,loBound,hiBound),
+                      np.where(outcome == 0,-10*conf,0.))
+    return np.round(points)
@@ -0,0 +1,147 @@
+import numpy as np
+import argparse, os, time
+from collections import namedtuple
+from concurrent.futures import ProcessPoolExecutor
+
+from UrnTrials import genTrialsBatch
+from UrnObserver import buildConfTable, historyIndex
+from UrnScoring import feedbackPoints
+from UrnConfig import defaultConfig, loadConfig
+
+'''
+Synthetic participant simulator for the Urn Hazard prediction task
+
+Python replacement for genSim in UrnHazardTask.Rmd, for power analyses. Each simulated participant goes through the same session structure as UrnTask.py (practice blocks excluded):
+    - one schedule of block lengths and generating items (trialBlocks, trialIDs), used for both parts
+    - condition 1 (urn part first) or 2 (hazard part first), alternating across participants
+    - the two items swap sides at random on every block
+    - points for the final report of each block, as in feedback
+
+Participants are parametric observers (ObserverModel). Each believes the urn bias and hazards are the model's own (possibly wrong) values and picks the slider position with the best expected points under those beliefs (the lookup table in UrnObserver.py). The report is then distorted on the screen: slider compression towards the centre, a rightward bias and Gaussian noise. It is rounded and passed through the "Not Sure" dead zone like predict does. A state-only observer tracks the urns but not the switching, so it always answers "Not Sure" in the hazard part.
+
+Everything is vectorised over participants. Participants are simulated in chunks of fixed size, each with its own child of one SeedSequence, spread over a pool of worker processes. Results therefore do not depend on the number of workers.
+
+Output (np.savez, axis 1 of the per-part arrays is the block type: 0 = urn, 1 = hazard):
+    - cond: (N,) condition of each participant
+    - blockLen, gen: (N, n_blocks) block lengths and generating items (0 = orange/low, 1 = blue/high)
+    - swap: (N, 2, n_blocks) True where item 1 (blue/high) was on the left
+    - beads: (N, 2, n_blocks, maxLen) beads (0 = orange, 1 = blue, -1 = past the end of the block)
+    - report: (N, 2, n_blocks, maxLen) confidence towards item 1, -1 to 1 (0 = "Not Sure", NaN past the end of the block)
+    - points: (N, 2, n_blocks) points of each block
+    - score: (N, 2) final score of each part
+
+Example:
+    python UrnSimulate.py --n 100000 --model noisy --out sims.npz
+'''
+
+ObserverModel = namedtuple('ObserverModel',['urnBias','hazards','noise','compression','bias','stateOnly'])
+
+# Observer presets (urnBias and hazards are the observer's beliefs, the other values act on screen in units of the slider half-width)
+models = {'ideal':ObserverModel(urnBias = .8,hazards = (.2,.8),noise = 0.,compression = 1.,bias = 0.,stateOnly = False),
+          'stateOnly':ObserverModel(urnBias = .8,hazards = (.2,.8),noise = 0.,compression = 1.,bias = 0.,stateOnly = True),
+          'noisy':ObserverModel(urnBias = .8,hazards = (.2,.8),noise = .15,compression = 1.,bias = 0.,stateOnly = False),
+          'biased':ObserverModel(urnBias = .8,hazards = (.2,.8),noise = 0.,compression = .7,bias = .1,stateOnly = False)}
+
+blkTypes = ['urn','hazard']
+deadZone = 20/(1920*.3) #"Not Sure" zone of predict (20 pixels) as a fraction of the slider half-width on a 1920 pixel wide display
+
+#Shuffled block lengths and generating items for n participants (same rules as makeSchedule in UrnConfig.py)
+def simSchedules(n,cfg,rng):
+    nb = len(cfg.blockLengths)*cfg.niter
+    blockLen = rng.permuted(np.tile(np.asarray(cfg.blockLengths,dtype = np.int8),(n,cfg.niter)),axis = 1)
+    gen = rng.permuted(np.tile(np.array([0,1],dtype = np.int8),(n,nb//2)),axis = 1)
+    return blockLen,gen
+
+#Screen reports of an observer after every bead
+def observerReports(blkType,beads,swap,model,cfg,rng,deadZone = deadZone):
+    # Arguments:
+    #     - beads: (n, n_blocks, maxLen) beads of one part
+    #     - swap: (n, n_blocks) True where item 1 is on the left
+    # Output:
+    #     - (n, n_blocks, maxLen) confidence towards item 1 as recorded by predict (rounded, 0 in the dead zone, NaN past the end)
+    n,nb,maxLen = beads.shape
+    idx = historyIndex(beads.reshape(-1,maxLen)).reshape(beads.shape)
+    if model.stateOnly and blkType == 'hazard':
+        best = np.zeros(beads.shape)
+    else:
+        table = buildConfTable(blkType,float(model.urnBias),tuple(float(h) for h in model.hazards),float(cfg.slope),maxLen)
+        best = table.slider[np.maximum(idx,0)]
+    # To screen position (right = positive), distort, and back
+    side = np.where(swap,-1.,1.)[:,:,None]
+    x = model.compression*best*side+model.bias
+    if model.noise > 0:
+        x = x+model.noise*rng.standard_normal(x.shape)
+    x = np.clip(x,-1,1)
+    x = np.where(np.abs(x) < deadZone,0.,np.round(x,2))
+    return np.where(idx >= 0,x*side,np.nan).astype(np.float32)
+
+#Simulate one chunk of participants
+def simChunk(job):
+    start,n,seed,model,cfg = job
+    rng = np.random.default_rng(seed)
+    blockLen,gen = simSchedules(n,cfg,rng)
+    nb = blockLen.shape[1]
+    maxLen = max(cfg.blockLengths)
+    out = {'cond':(1+(start+np.arange(n)) % 2).astype(np.int8),'blockLen':blockLen,'gen':gen,
+           'swap':np.zeros((n,2,nb),dtype = bool),'beads':np.zeros((n,2,nb,maxLen),dtype = np.int8),
+           'report':np.zeros((n,2,nb,maxLen),dtype = np.float32),'points':np.zeros((n,2,nb),dtype = np.float32)}
+    rows = np.arange(n)[:,None]
+    cols = np.arange(nb)[None,:]
+    for k,blkType in enumerate(blkTypes):
+        urns,beads = genTrialsBatch(blkType,gen.ravel(),blockLen.ravel(),rng,cfg.urnBias,cfg.hazards,maxLen)
+        beads = beads.reshape(n,nb,maxLen)
+        swap = rng.random((n,nb)) < .5
+        report = observerReports(blkType,beads,swap,model,cfg,rng)
+        final = report[rows,cols,blockLen-1]
+        outcome = np.where(final == 0,-1,((final > 0) == (gen == 1)).astype(int))
+        out['swap'][:,k] = swap
+        out['beads'][:,k] = beads
+        out['report'][:,k] = report
+        out['points'][:,k] = feedbackPoints(outcome,np.abs(final),cfg.slope)
+    out['score'] = (cfg.startScore+out['points'].sum(axis = 2)).astype(np.float32)
+    return start,out
+
+#Put the simulated chunks together into one set of arrays
+def collectChunks(n,results):
+    sims = {}
+    for start,out in results:
+        if not sims:
+            sims = dict((k,np.zeros((n,)+v.shape[1:],dtype = v.dtype)) for k,v in out.items())
+        for k,v in out.items():
+            sims[k][start:start+len(v)] = v
+    return sims
+
+#Simulate n participants across a pool of worker processes
+def simulate(n,model = models['ideal'],cfg = defaultConfig,seed = 0,workers = None,chunkSize = 2000):
+    # Output: dict of arrays (see the module description)
+    starts = list(range(0,n,chunkSize))
+    seeds = np.random.SeedSequence(seed).spawn(len(starts))
+    jobs = [(s,min(chunkSize,n-s),sd,model,cfg) for s,sd in zip(starts,seeds)]
+    if workers is None:
+        workers = os.cpu_count() or 1
+    if workers == 1 or len(jobs) == 1:
+        return collectChunks(n,map(simChunk,jobs))
+    with ProcessPoolExecutor(max_workers = workers) as pool:
+        return collectChunks(n,pool.map(simChunk,jobs))
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description = 'Simulate synthetic participants')
+    parser.add_argument('--n',type = int,default = 1000,help = 'number of participants')
+    parser.add_argument('--model',choices = sorted(models),default = 'ideal')
+    parser.add_argument('--noise',type = float,default = None,help = 'override the model noise')
+    parser.add_argument('--config',type = str,default = None,help = 'JSON session config (see UrnConfig.py)')
+    parser.add_argument('--seed',type = int,default = 0)
+    parser.add_argument('--workers',type = int,default = None)
+    parser.add_argument('--chunk',type = int,default = 2000,help = 'participants per chunk')
+    parser.add_argument('--out',type = str,default = 'sims.npz')
+    args = parser.parse_args()
+
+    cfg = loadConfig(args.config) if args.config else defaultConfig
+    model = models[args.model]
+    if args.noise is not None:
+        model = model._replace(noise = args.noise)
+    start = time.perf_counter()
+    sims = simulate(args.n,model,cfg,args.seed,args.workers,args.chunk)
+    np.savez(args.out,**sims)
+    score = sims['score']
+    print('%d participants (%s) in %.2fs, mean score urn %.1f, hazard %.1f, written to %s'%(args.n,args.model,time.perf_counter()-start,score[:,0].mean(),score[:,1].mean(),args.out))
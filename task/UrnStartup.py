@@ -0,0 +1,112 @@
+import threading, time
+
+'''
+Startup helpers for the Urn Hazard prediction task
+
+UrnTask.py only imports what the participant dialog needs (psychopy.core and psychopy.gui) before showing it. BackgroundStartup does the rest of the slow work on a background thread while the dialog is open:
+    - importing psychopy.visual and psychopy.event
+    - getting the display size (EyeLink display information, then pyglet, then a default)
+    - decoding and resizing the images (UrnAssets.py)
+The window and every stimulus that uses OpenGL are still built on the main thread once the dialog closes, since the GL context belongs to that thread.
+
+pylink is optional: the task runs without it and falls back to pyglet for the display size.
+
+StartupLog times each startup phase. UrnTask.py prints the report before the first screen and adds it to the session timing report.
+'''
+
+defaultSize = (1920,1080)
+
+#Timing of named startup phases (on any thread)
+class StartupLog:
+    def __init__(self):
+        self.t0 = time.perf_counter()
+        self.lock = threading.Lock()
+        self.open = {}
+        self.phases = [] #(name, thread, start, end) in seconds since the log was created
+
+    def begin(self,name):
+        with self.lock:
+            self.open[name] = time.perf_counter()-self.t0
+
+    def end(self,name):
+        with self.lock:
+            start = self.open.pop(name)
+            self.phases.append((name,threading.current_thread().name,start,time.perf_counter()-self.t0))
+
+    #Context manager timing one phase
+    def phase(self,name):
+        return StartupPhase(self,name)
+
+    def report(self):
+        lines = ['Startup timing:']
+        for name,thread,start,end in sorted(self.phases,key = lambda p: p[2]):
+            lines.append('  %-28s %7.3fs (%.3f-%.3f, %s)'%(name,end-start,start,end,thread))
+        if self.phases:
+            lines.append('  %-28s %7.3fs'%('total',max(p[3] for p in self.phases)))
+        return '\n'.join(lines)
+
+#Times one phase for StartupLog.phase
+class StartupPhase:
+    def __init__(self,log,name):
+        self.log = log
+        self.name = name
+    def __enter__(self):
+        self.log.begin(self.name)
+        return self
+    def __exit__(self,*exc):
+        self.log.end(self.name)
+        return False
+
+#Display size from the EyeLink display information, or pyglet if pylink is not installed
+def displaySize(default = defaultSize):
+    try:
+        import pylink
+        disp = pylink.getDisplayInformation()
+        return (disp.width,disp.height)
+    except ImportError:
+        pass
+    try:
+        import pyglet
+        display = pyglet.canvas.get_display() if hasattr(pyglet,'canvas') else pyglet.display.get_display()
+        screen = display.get_default_screen()
+        return (screen.width,screen.height)
+    except Exception:
+        return default
+
+#Non-GL startup work on a background thread (size overrides the display size when given)
+class BackgroundStartup:
+    def __init__(self,log,imgDir = None,size = None):
+        self.log = log
+        self.imgDir = imgDir
+        self.size = size
+        self.result = {}
+        self.error = None
+        self.thread = threading.Thread(target = self.run,name = 'Startup',daemon = True)
+        self.thread.start()
+
+    def run(self):
+        try:
+            with self.log.phase('import psychopy.visual'):
+                from psychopy import visual, event
+            with self.log.phase('display size'):
+                self.result['displaySize'] = tuple(self.size) if self.size else displaySize()
+            with self.log.phase('decode images'):
+                import UrnAssets
+                imgDir = self.imgDir or UrnAssets.imgDir
+                self.result['images'] = UrnAssets.loadImages(self.result['displaySize'][1],imgDir)
+        except Exception as e:
+            self.error = e
+
+    #Wait for the background work and return its results (displaySize, images)
+    def wait(self):
+        with self.log.phase('wait for background startup'):
+            self.thread.join()
+        if self.error is not None:
+            raise self.error
+        return self.result
+
+if __name__ == '__main__':
+    log = StartupLog()
+    res = BackgroundStartup(log).wait()
+    print('Display size: %dx%d'%res['displaySize'])
+    print(log.report())
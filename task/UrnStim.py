@@ -0,0 +1,134 @@
+'''
+Stimulus caching for the Urn Hazard prediction task
+
+Creating a PsychoPy TextStim lays out the text and uploads a new texture, which is slow enough to drop frames when it happens right before a timed screen. StimCache keeps every text and rect stimulus the task has created, keyed by its content and style (text, height, colour, wrap width), and hands back the same object next time. Position is not part of the key - a cached stimulus is moved to the requested position.
+
+UrnTask.py prewarms the cache at startup with the stimuli used inside the trial loop (bead draw text, feedback marks and every possible points string), so none are built during a block.
+
+Compositor builds the response screen in layers. The static background (question, items, slider lines and labels) is captured into a BufferImageStim once per layout and reused. Only the dynamic layers (slider markers, bead reminders) are drawn on top each frame. It keeps per-layer timing so slow layers can be spotted, and passes it on to a FrameProfiler (UrnTiming.py) if given one.
+
+BeadReminders draws the row of beads seen so far. One ElementArrayStim is built at startup for each bead layout (1 to 5 beads, positions from posSet), plus one for its white outlines. Each frame is two draw calls, and colours are only sent again when the bead sequence changes.
+'''
+import time
+
+#Cache of text and rect stimuli for one window
+class StimCache:
+    def __init__(self,win):
+        from psychopy import visual
+        self.visual = visual
+        self.win = win
+        self.stims = {}
+        self.hits = 0
+        self.misses = 0
+
+    #Get a cached stimulus (or build it with make() on a miss) and move it to pos
+    def get(self,key,make,pos = None):
+        stim = self.stims.get(key)
+        if stim is None:
+            self.misses += 1
+            stim = make()
+            self.stims[key] = stim
+        else:
+            self.hits += 1
+        if pos is not None:
+            stim.setPos(pos)
+        return stim
+
+    #Text stimulus
+    def text(self,text,height = 40,color = 'white',wrapWidth = None,pos = (0,0)):
+        key = ('text',text,height,color,wrapWidth)
+        make = lambda: self.visual.TextStim(self.win,text = text,height = height,color = color,wrapWidth = wrapWidth,pos = pos)
+        return self.get(key,make,pos)
+
+    #Rect stimulus
+    def rect(self,width,height,fillColor = 'white',lineWidth = 0,opacity = 1,pos = (0,0)):
+        key = ('rect',width,height,str(fillColor),lineWidth,opacity)
+        make = lambda: self.visual.Rect(self.win,width = width,height = height,fillColor = fillColor,lineWidth = lineWidth,opacity = opacity,pos = pos)
+        return self.get(key,make,pos)
+
+    #Build stimuli ahead of time - each entry is (kind, kwargs), e.g. ('text', {'text':'+','height':40})
+    def prewarm(self,specs):
+        for kind,kwargs in specs:
+            getattr(self,kind)(**kwargs)
+        self.hits = 0
+        self.misses = 0
+
+    def report(self):
+        return 'Stimulus cache: %d hits, %d misses, %d stimuli'%(self.hits,self.misses,len(self.stims))
+
+#Layered drawing with cached background captures
+class Compositor:
+    def __init__(self,win,profiler = None):
+        from psychopy import visual
+        self.visual = visual
+        self.win = win
+        self.profiler = profiler
+        self.backgrounds = {}
+        self.timing = {}
+
+    #Add one timing sample (seconds) for a layer
+    def record(self,layer,dur):
+        n,total,longest = self.timing.get(layer,(0,0.,0.))
+        self.timing[layer] = (n+1,total+dur,max(longest,dur))
+        if self.profiler is not None:
+            self.profiler.record('layer: %s'%layer,dur)
+
+    #Background capture for a layout key (drawn with drawFn and captured on the first request)
+    def background(self,key,drawFn):
+        bg = self.backgrounds.get(key)
+        if bg is None:
+            start = time.perf_counter()
+            drawFn()
+            bg = self.visual.BufferImageStim(self.win)
+            self.win.clearBuffer()
+            self.backgrounds[key] = bg
+            self.record('background capture',time.perf_counter()-start)
+        return bg
+
+    #Screen made of a cached background and dynamic layers - layers is a list of (name, draw function)
+    def compose(self,key,drawBackground,layers = []):
+        return Composite(self,self.background(key,drawBackground),layers)
+
+    def report(self):
+        lines = ['Compositor: %d cached backgrounds'%len(self.backgrounds)]
+        for layer,(n,total,longest) in sorted(self.timing.items()):
+            lines.append('  %s: %d draws, mean %.2f ms, max %.2f ms'%(layer,n,1000*total/n,1000*longest))
+        return '\n'.join(lines)
+
+#One composed screen - draw() draws every layer and times it
+class Composite:
+    def __init__(self,compositor,bg,layers):
+        self.compositor = compositor
+        self.layers = [('background',bg.draw)]+list(layers)
+
+    def draw(self):
+        for name,drawFn in self.layers:
+            start = time.perf_counter()
+            drawFn()
+            self.compositor.record(name,time.perf_counter()-start)
+
+# Bead colours in PsychoPy rgb space (-1 to 1)
+beadColors = {'orange':(1.,.294,-1.),'blue':(-1.,1.,1.),'white':(1.,1.,1.)}
+
+#Bead reminders as one element array per layout
+class BeadReminders:
+    def __init__(self,win,posSet,radius,lineWidth = 1.5):
+        from psychopy import visual
+        self.fills = []
+        self.outlines = []
+        self.shown = {} #bead sequence last coloured in for each layout
+        for poses in posSet:
+            n = len(poses)
+            self.outlines.append(visual.ElementArrayStim(win,units = 'pix',nElements = n,xys = poses,sizes = 2*radius+lineWidth,
+                                                         elementTex = None,elementMask = 'circle',colors = [beadColors['white']]*n,colorSpace = 'rgb'))
+            self.fills.append(visual.ElementArrayStim(win,units = 'pix',nElements = n,xys = poses,sizes = 2*radius,
+                                                      elementTex = None,elementMask = 'circle',colors = [beadColors['white']]*n,colorSpace = 'rgb'))
+
+    #Draw the first n beads of beadDraws (bead names, 'orange' or 'blue')
+    def draw(self,beadDraws,n):
+        seq = tuple(beadDraws[:n])
+        if self.shown.get(n) != seq:
+            self.fills[n-1].setColors([beadColors[b] for b in seq])
+            self.shown[n] = seq
+        self.outlines[n-1].draw()
+        self.fills[n-1].draw()
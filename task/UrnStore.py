@@ -0,0 +1,155 @@
+import numpy as np
+import csv, os, sys
+
+'''
+Typed columnar storage for Urn Hazard prediction task data
+
+The CSVs written by UrnTask.py store everything as text ('NA', 'None' and numbers). This module converts the dataHeader schema into typed NumPy columns and saves them as .npz files, which load without any parsing:
+    - categorical columns are int8 codes into a fixed list of categories (-1 = NA/None)
+    - Confidence, Reward and RT are float32 (NaN = NA)
+    - SideChoisen and Correct are int8 (-1 = NA/None)
+
+Converted files go in a .npz folder next to the CSVs (data/x.csv -> data/.npz/x.npz), so the data folder itself only holds the session files. Convert a whole archive of CSVs (one .npz per CSV and a merged cohort.npz in <archive>/.npz):
+    python UrnStore.py data
+'''
+
+npzDir = '.npz' #folder of the converted files, next to the CSVs
+
+# Categories of the fixed-vocabulary columns (codes are the same in every file)
+itemCats = ['orange','blue','low','high']
+fixedCats = {'BlockType':['urn','hazard'],
+             'CurrGen':itemCats,
+             'Bead':['orange','blue'],
+             'ItemLeft':itemCats,
+             'ItemRight':itemCats,
+             'Prediction':itemCats}
+
+# Column types of the dataHeader schema
+schema = {'SubjectID':'cat',
+          'Age':'cat',
+          'Sex':'cat',
+          'Condition':np.int8,
+          'BlockType':'cat',
+          'TrialBlock':np.int16,
+          'TrialNumber':np.int8,
+          'CurrGen':'cat',
+          'Bead':'cat',
+          'ItemLeft':'cat',
+          'ItemRight':'cat',
+          'SideChoisen':np.int8,
+          'Prediction':'cat',
+          'Confidence':np.float32,
+          'Correct':np.int8,
+          'Reward':np.float32,
+          'RT':np.float32}
+
+naValues = ['NA','None','']
+
+#Convert one text column into a typed array (and its categories for categorical columns)
+def typeColumn(name,vals):
+    kind = schema.get(name,'cat')
+    if kind == 'cat':
+        if name in fixedCats:
+            cats = fixedCats[name]
+        else:
+            cats = sorted(set(v for v in vals if v not in naValues))
+        lookup = dict((c,i) for i,c in enumerate(cats))
+        codes = np.array([lookup.get(v,-1) for v in vals],dtype = np.int8 if len(cats) < 128 else np.int32)
+        return codes,np.array(cats,dtype = str)
+    if np.issubdtype(kind,np.floating):
+        return np.array([float(v) if v not in naValues else np.nan for v in vals],dtype = kind),None
+    return np.array([int(float(v)) if v not in naValues else -1 for v in vals],dtype = kind),None
+
+#Convert rows of text (as written by recDat) into typed columns
+def parseRows(header,rows):
+    # Output: dict of column arrays, plus '<column>_categories' arrays for categorical columns
+    cols = {}
+    for j,name in enumerate(header):
+        vals = [r[j] for r in rows]
+        arr,cats = typeColumn(name,vals)
+        cols[name] = arr
+        if cats is not None:
+            cols[name+'_categories'] = cats
+    return cols
+
+#Read one session CSV into typed columns
+def readCsv(fname):
+    with open(fname,newline = '') as f:
+        reader = csv.reader(f)
+        header = next(reader,None)
+        rows = [r for r in reader if len(r)]
+    if header is None:
+        header = list(schema)
+    return parseRows(header,rows)
+
+#Save typed columns to .npz (uncompressed, so loading is a straight read)
+def saveColumns(fname,cols):
+    np.savez(fname,**cols)
+
+#Load typed columns saved by saveColumns
+def loadColumns(fname):
+    with np.load(fname) as f:
+        return dict((k,f[k]) for k in f.files)
+
+#Decode a categorical column back to strings ('NA' where the code is -1)
+def decode(cols,name):
+    cats = np.append(cols[name+'_categories'],'NA')
+    return cats[cols[name]]
+
+#Where the .npz version of a session CSV goes
+def npzName(fname):
+    folder,base = os.path.split(fname)
+    return os.path.join(folder,npzDir,os.path.splitext(base)[0]+'.npz')
+
+#Write the .npz version of a session CSV (in the .npz folder next to it)
+def convertCsv(fname,cols = None):
+    out = npzName(fname)
+    os.makedirs(os.path.dirname(out),exist_ok = True)
+    saveColumns(out,readCsv(fname) if cols is None else cols)
+    return out
+
+#Merge typed columns of several sessions into one set of columns (categories of free-text columns are remapped)
+def mergeColumns(colList):
+    merged = {}
+    names = [k for k in colList[0] if not k.endswith('_categories')]
+    for name in names:
+        if name+'_categories' in colList[0] and name not in fixedCats:
+            cats = sorted(set(c for cols in colList for c in cols[name+'_categories']))
+            lookup = dict((c,i) for i,c in enumerate(cats))
+            parts = []
+            for cols in colList:
+                remap = np.array([lookup[c] for c in cols[name+'_categories']]+[-1],dtype = np.int32)
+                parts.append(remap[cols[name]])
+            merged[name] = np.concatenate(parts).astype(np.int16)
+            merged[name+'_categories'] = np.array(cats,dtype = str)
+        else:
+            merged[name] = np.concatenate([cols[name] for cols in colList])
+            if name+'_categories' in colList[0]:
+                merged[name+'_categories'] = colList[0][name+'_categories']
+    return merged
+
+#Convert every session CSV under dataDir and write a merged cohort file
+def convertArchive(dataDir,cohortName = 'cohort.npz'):
+    fnames = []
+    for root,dirs,files in os.walk(dataDir):
+        dirs[:] = sorted(d for d in dirs if d != npzDir)
+        for f in sorted(files):
+            if f.endswith('.csv'):
+                fnames.append(os.path.join(root,f))
+    colList = []
+    for fname in fnames:
+        cols = readCsv(fname)
+        convertCsv(fname,cols)
+        n = len(cols['BlockType'])
+        cols['File'] = np.zeros(n,dtype = np.int8)
+        cols['File_categories'] = np.array([os.path.relpath(fname,dataDir)])
+        colList.append(cols)
+    if colList:
+        os.makedirs(os.path.join(dataDir,npzDir),exist_ok = True)
+        saveColumns(os.path.join(dataDir,npzDir,cohortName),mergeColumns(colList))
+    return fnames
+
+if __name__ == '__main__':
+    dataDir = sys.argv[1] if len(sys.argv) > 1 else 'data'
+    fnames = convertArchive(dataDir)
+    print('Converted %d session files in %s (written to %s)'%(len(fnames),dataDir,os.path.join(dataDir,npzDir)))
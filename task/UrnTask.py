@@ -1,8 +1,10 @@
-from psychopy import visual, event, core, gui
-import numpy as np
+import os, time, random, json
+from UrnStartup import StartupLog, BackgroundStartup
+startupLog = StartupLog()
+with startupLog.phase('import psychopy.core/gui'):
+    from psychopy import core, gui
 from math import log
-import os, time, random
-import pylink as pl
+from UrnConfig import defaultConfig, loadConfig, makeSchedule
 
 '''
 Alexandre Filipowicz & Derek Nuamah, July 1st, 2019
@@ -24,6 +26,26 @@ The idea is that certainty dynamics (how certainty changes with each observation
 ## SUBJECT INFO ##
 ##################
 test = False #Set test to true to skip instructions and not make the task full screen
+saveColumnar = False #Set to true to also save a typed .npz copy of the data file (in data/.npz) at the end of the session (see UrnStore.py)
+adaptive = False #Set to true to pick block lengths/items and practice bead sequences from the subject's responses (see UrnAdaptive.py)
+eyeTracker = None #Set to 'eyelink' to record eye movements and pupil size with an EyeLink (needs pylink), or 'mock' to test the recording without one (see UrnEyelink.py)
+eyeHost = None #EyeLink host address (None = the default 100.1.1.1)
+scanner = None #Set to 'keyboard', 'serial' or 'simulated' to lock the onsets of the main blocks to scanner trigger pulses (see UrnScanner.py)
+scanPort = None #Serial port of the trigger box (scanner = 'serial')
+scanScheduleFile = None #JSON onset schedule for scanner mode (None = a random jittered schedule for the session's blocks)
+configFile = None #Set to a JSON file to change the session settings (block lengths, urn bias, hazards, reward, see UrnConfig.py)
+runnerJob = os.environ.get('URN_RUNNER_JOB') #Session launched by UrnRunner.py: JSON with the subject ID, condition, seed and config (skips the dialog)
+
+if runnerJob is not None:
+    runnerJob = json.loads(runnerJob)
+    if runnerJob.get('config'):
+        configFile = runnerJob['config']
+
+# Session settings - passed explicitly to the trial functions
+sessionConfig = defaultConfig if configFile is None else loadConfig(configFile)
+
+# Import psychopy.visual, get the display size and decode the images while the dialog is open (see UrnStartup.py)
+startup = BackgroundStartup(startupLog,size = sessionConfig.displaySize)
 if test == True:
     scr = 0
     fs = False
@@ -32,6 +54,13 @@ if test == True:
     cond = 1
     age = 'TEST'
     sex = 'TEST'
+elif runnerJob is not None:
+    fs = True
+    scr = 0
+    subID = str(runnerJob['subject'])
+    cond = int(runnerJob['condition'])
+    age = str(runnerJob.get('age','NA'))
+    sex = str(runnerJob.get('sex','NA'))
 else:
     # Set full screen to true and use second monitor
     fs = True
@@ -43,7 +72,8 @@ else:
     infoBox.addField("Condition (1 or 2): ")
     infoBox.addField("Age: ")
     infoBox.addField("Sex (M,F,O): ")
-    infoBox.show()
+    with startupLog.phase('participant dialog'):
+        infoBox.show()
     if gui.OK:
         pData = infoBox.data
         subID = str(pData[0])
@@ -53,19 +83,38 @@ else:
     elif gui.CANCEL:
         core.quit()
 
+# NumPy and the task modules are imported once the dialog has closed (while it was open the background thread imported psychopy.visual)
+# The adaptive design, eye tracker and scanner modules are only imported when their mode is on
+with startupLog.phase('import task modules'):
+    import numpy as np
+    from UrnTrials import genTrials
+    from UrnScoring import adjustConf
+    from UrnData import DataWriter
+    from UrnStore import convertCsv
+    from UrnStim import StimCache, Compositor, BeadReminders
+    from UrnAssets import imageSize
+    from UrnResponse import ResponseLog, TrajectoryFile
+    from UrnTiming import FrameProfiler
+    if adaptive:
+        from UrnAdaptive import AdaptiveDesign
+    if eyeTracker is not None:
+        from UrnEyelink import openRecorder
+    if scanner is not None:
+        from UrnScanner import openScanTimer, loadScanSchedule, makeScanSchedule, blockOnsets, drawLead
+
+# Sessions launched by UrnRunner.py are seeded from the job
+if runnerJob is not None and runnerJob.get('seed') is not None:
+    random.seed(runnerJob['seed'])
+    np.random.seed(runnerJob['seed'])
+
 #####################
 ## GENERATE TRIALS ##
 #####################
 
-# Generate the trial blocks
-niter = 10  #number of times each trial block length is repeated - make sure this is an even number
-trialBlocks = [1,2,3,4,5]*niter
-random.shuffle(trialBlocks)
-
-# Randomly generate the sequence of tails/heads and low/high hazard 
+# Generate the trial blocks (each block length is repeated sessionConfig.niter times - an even number)
+# and randomly generate the sequence of tails/heads and low/high hazard 
 #0 = heads/low, 1 = tails/high
-trialIDs = [0,1]*int(len(trialBlocks)/2)
-random.shuffle(trialIDs)
+trialBlocks,trialIDs = makeSchedule(sessionConfig)
 
 ######################
 ## TASK ENVIRONMENT ##
@@ -76,13 +125,19 @@ random.shuffle(trialIDs)
 #Get path 
 path = os.getcwd()      # Get directory path
 
-# Create task window
-disp = pl.getDisplayInformation()
-sx = disp.width
-sy = disp.height
+# Create task window (display size from the EyeLink display information if pylink is installed)
+prep = startup.wait()
+from psychopy import visual, event
+sx,sy = prep['displaySize']
 #sx = 1200
 #sy = 900
-win = visual.Window(size=(sx,sy),units="pix",fullscr=fs,screen = scr)
+with startupLog.phase('window'):
+    win = visual.Window(size=(sx,sy),units="pix",fullscr=fs,screen = scr)
+startupLog.begin('stimuli')
+
+# Time every flip, per task section (see UrnTiming.py)
+frameProfiler = FrameProfiler(clock = core.getTime)
+frameProfiler.attach(win)
 
 #Get mouse
 mouse = event.Mouse()
@@ -93,8 +148,8 @@ mouse.setVisible(False)
 cross = visual.TextStim(win,text = "+",height = 40)
 
 #Multipliers for stim
-mult = .02 #multiplier to set coin/person size according to the screen
-posMult = .3 #multiploer to set position of left/right stimuli
+mult = sessionConfig.mult #multiplier to set coin/person size according to the screen
+posMult = sessionConfig.posMult #multiploer to set position of left/right stimuli
 
 
 # Positions for the options
@@ -107,18 +162,21 @@ blueBead = visual.Circle(win, radius = sy*mult,fillColor ="cyan",lineWidth = 2,p
 orangeBead = visual.Circle(win, radius = sy*mult,fillColor ="orange",lineWidth = 2,pos=(0,(sy*.13)))
 beads = [orangeBead, blueBead]
 
+# Images are decoded once and resized to their size on this display (see UrnAssets.py)
+images = prep['images']
+
 # Urns
 #Biased Urns
-orangeUrn = visual.ImageStim(win,path+'//img//OrangeUrn.png', pos = leftPos, size = (sy*.1,sy*.12))
-blueUrn = visual.ImageStim(win,path+'//img//BlueUrn.png', pos = rightPos, size = (sy*.1,sy*.12))
+orangeUrn = visual.ImageStim(win,images['orangeUrn'], pos = leftPos, size = imageSize('orangeUrn',sy))
+blueUrn = visual.ImageStim(win,images['blueUrn'], pos = rightPos, size = imageSize('blueUrn',sy))
 
 #Full Urns
-orangeFullUrn = visual.ImageStim(win,path+'//img//OrangeFullUrn.png', pos = leftPos, size = (sy*.1,sy*.12))
-blueFullUrn = visual.ImageStim(win,path+'//img//BlueFullUrn.png', pos = rightPos, size = (sy*.1,sy*.12))
+orangeFullUrn = visual.ImageStim(win,images['orangeFullUrn'], pos = leftPos, size = imageSize('orangeFullUrn',sy))
+blueFullUrn = visual.ImageStim(win,images['blueFullUrn'], pos = rightPos, size = imageSize('blueFullUrn',sy))
 
 # People
-low = visual.ImageStim(win,path+'//img/LowPerson.png', pos = leftPos, size = (sy*.11,sy*.12))
-high = visual.ImageStim(win,path+'//img/HighPerson.png', pos = rightPos, size = (sy*.11,sy*.12))
+low = visual.ImageStim(win,images['low'], pos = leftPos, size = imageSize('low',sy))
+high = visual.ImageStim(win,images['high'], pos = rightPos, size = imageSize('high',sy))
 
 #Text for URN or HAZARD phase
 urnPredText = visual.TextStim(win, text="From which container are the beads being drawn?", height = 40, wrapWidth = sx*.8,pos = (0,sy*.25))
@@ -146,8 +204,7 @@ subLine = visual.Rect(win,height = sy*.05,width = sx*lWidth,pos = (0,cfY),fillCo
 #lineBounds
 lbounds = [-sx*(posMult),sx*(posMult)]
 
-# Bead reminders
-beadRem = {}
+# Bead reminders - one element array per number of beads seen (see UrnStim.py)
 beadNames = ['bead1','bead2','bead3','bead4','bead5']
 tWidth = sx*.2
 incr = tWidth/4
@@ -163,7 +220,23 @@ for i in np.arange(len(beadNames)):
             poses.append((posX,posY))
             posX += incr
     posSet.append(poses)
-    beadRem[beadNames[i]] = visual.Circle(win, radius = sy*(mult), fillColor='white',pos = (0,0))
+beadRem = BeadReminders(win,posSet,sy*mult)
+
+# Stimulus cache - text and rect stimuli are built once and reused (see UrnStim.py)
+# Prewarm the ones used inside the trial loop so none are built during a block
+stimCache = StimCache(win)
+trialStims = [('text',{'text':'Drawing bead...','height':40}),
+              ('text',{'text':'Person drawing bead...','height':40}),
+              ('text',{'text':'X','height':100,'color':'red'}),
+              ('rect',{'width':sy*.12,'height':sy*.12,'fillColor':(0,1,0),'lineWidth':0,'opacity':.5})]
+for p,pcol in [(p,'green') for p in range(0,11)]+[(p,'red') for p in range(-10,1)]+[(0,'white')]:
+    trialStims.append(('text',{'text':'%d points'%p,'height':30,'color':pcol,'pos':(0,sy*.25)}))
+stimCache.prewarm(trialStims)
+
+# Response screen compositor - backgrounds are captured once per layout, beads and slider markers drawn on top
+compositor = Compositor(win,profiler = frameProfiler)
+startupLog.end('stimuli')
+print(startupLog.report())
 
 
 #####################
@@ -176,9 +249,6 @@ dt=date_time.replace(' ','_')    # Replace spaces with underscores where needed
 dt=dt.replace('/','_')      #Replace slashes with underscores where needed
 dt=dt.replace(':','')      #Replace slashes with underscores where needed
 
-# Initialize data file
-datafile = open(path+"//data//%s_CoinTask_%s.csv"%(subID,dt), 'w')
-
 #  Data to be collected:
 # SubjectID,Age,Sex: Subject information
 # Condition: condition number (1 - coin trials first, 2 - hazard trials first)
@@ -195,14 +265,20 @@ datafile = open(path+"//data//%s_CoinTask_%s.csv"%(subID,dt), 'w')
 # Reward: if the subject got reward on that trial, how much did they get
 # RT: response time
 dataHeader = ["SubjectID","Age","Sex","Condition","BlockType","TrialBlock","TrialNumber","CurrGen","Bead","ItemLeft","ItemRight","SideChoisen","Prediction","Confidence","Correct","Reward","RT"]
-datafile.write(",".join(dataHeader)+'\n')
-datafile.flush()
+# Initialize data file (rows are written in batches by a background thread, see UrnData.py)
+datafile = DataWriter(path+"//data//%s_CoinTask_%s.csv"%(subID,dt),dataHeader)
+# Mouse trajectory of every response screen (see UrnResponse.py)
+trajfile = TrajectoryFile(datafile.fname+'.traj')
+# Eye tracker - samples and messages handled on background threads (see UrnEyelink.py), None when eyeTracker is off
+eyeRec = None
+if eyeTracker is not None:
+    with startupLog.phase('eye tracker'):
+        eyeRec = openRecorder(eyeTracker,datafile.fname,subID,(sx,sy),clock = core.getTime,host = eyeHost)
 
 #Function to record data
 def recDat(dfile,dat_vec):
-    dat = map(str,dat_vec)
-    dfile.write(",".join(dat)+'\n')
-    dfile.flush()
+    with frameProfiler.timer('recDat'):
+        dfile.writeRow(dat_vec)
 
 
 #####################
@@ -213,83 +289,132 @@ def getKeypress(df=datafile):
     keys = event.waitKeys()
     if keys[0] in ['q','escape']:
         df.close()
+        trajfile.close()
+        if eyeRec is not None:
+            eyeRec.close()
+        core.quit()
+
+#Function to quit on q/escape without waiting for a key press
+def checkQuit():
+    if len(event.getKeys(keyList = ['q','escape'])):
+        datafile.close()
+        trajfile.close()
+        if eyeRec is not None:
+            eyeRec.close()
         core.quit()
 
+# Scanner mode - onsets of the main blocks locked to trigger pulses, logged in <data file>.onsets.tsv (see UrnScanner.py)
+scanSchedule,scanTimer = None,None
+if scanner is not None:
+    scanSchedule = loadScanSchedule(scanScheduleFile) if scanScheduleFile else None
+    scanTimer = openScanTimer(scanner,win,core.getTime,core.wait,datafile.fname+'.onsets.tsv',tr = scanSchedule.tr if scanSchedule else 2.,port = scanPort,idle = checkQuit)
+
 #Function before Trial Block to indicate whether this is a Coin Bias or Person Switching Scenario
-def trialBlockType(typeText,win):
+# In scanner mode (scan = onsets of the block) the text comes on at its scheduled onset and stays for cueDur without a key press
+@frameProfiler.section('trialBlockType')
+def trialBlockType(typeText,win,scan = None):
     win.flip()
-    core.wait(1)
-    tbt_text = visual.TextStim(win,text=typeText,height=40,wrapWidth = sx*.8)
+    waitStart = time.time()
+    tbt_text = stimCache.text(typeText,height=40,wrapWidth = sx*.8) #built during the blank screen if the score is new
+    if scan is not None:
+        tbt_text.draw()
+        scanTimer.flipAt('cue',scan['cue'],scan['block'])
+        scanTimer.wait(scan['cueDur'])
+        return
+    core.wait(max(0,1-(time.time()-waitStart)))
     tbt_text.draw()
     win.flip()
     keys = event.waitKeys(keyList = ['space','q','escape'])
     if keys[0] in ['q','escape']:
+        datafile.close()
+        trajfile.close()
+        if eyeRec is not None:
+            eyeRec.close()
         core.quit()
 
-#Function to draw beads seen up to this points
+#Function to draw beads seen up to this points (beads are laid out at beadPoses[trialNum-1], set when beadRem was built)
 def drawSeenBeads(trialNum,beadRem,beadDraws,beadPoses):
-    keyNames = ['bead1','bead2','bead3','bead4','bead5']
-    poses = beadPoses[trialNum-1]
-    for i in np.arange(trialNum):
-        b = beadRem[keyNames[i]]
-        col = beadDraws[i]
-        if beadDraws[i] == 'blue':
-            col = 'cyan'
-        b.setFillColor(col)
-        b.setPos(poses[i])
-        b.draw()
+    beadRem.draw(beadDraws,trialNum)
 
 #Function to draw confidence line
-def drawConfLines(clines,ctext_stim,ctext,items,cross,positions,prevBeads,trialNum,beadPoses,predText = False,subSlider = False):
-    # Draw options to select
-    if predText != False:
-        predText.draw()
-    for i in np.arange(len(items)):
-        items[i].setPos(positions[i])
-        items[i].draw()
-        p = positions[i]
-        
-    #Draw and buffer confidence lines
-    for cl in clines:
-        cl.draw()
-    for i in np.arange(len(ctext)):
-        ctext_stim[i].setText(ctext[i])
-        ctext_stim[i].draw()
+# The static part of the screen is captured once per layout (question shown or not, item order)
+# and the slider marker and bead reminders are drawn on top of it (see Compositor in UrnStim.py)
+def drawConfLines(clines,ctext_stim,ctext,items,cross,positions,prevBeads,trialNum,beadPoses,predText = False,subSlider = False,sliderColor = 'red'):
+    def drawBackground():
+        # Draw options to select
+        if predText != False:
+            predText.draw()
+        for i in np.arange(len(items)):
+            items[i].setPos(positions[i])
+            items[i].draw()
+
+        #Draw confidence lines
+        for cl in clines:
+            cl.draw()
+        for i in np.arange(len(ctext)):
+            ctext_stim[i].setText(ctext[i])
+            ctext_stim[i].draw()
+    key = (predText != False,tuple(ctext),tuple(tuple(p) for p in positions))
+
+    layers = []
     if subSlider != False:
-        subSlider.draw()
-    drawSeenBeads(trialNum,beadRem,prevBeads,beadPoses)
-    cline_image = visual.BufferImageStim(win)
-    return(cline_image)
+        marker = stimCache.rect(width = subSlider.width,height = subSlider.height,fillColor = sliderColor,pos = tuple(subSlider.pos))
+        markerPos = tuple(subSlider.pos)
+        def drawMarker():
+            marker.setPos(markerPos)
+            marker.draw()
+        layers.append(('slider marker',drawMarker))
+    layers.append(('bead reminders',lambda: drawSeenBeads(trialNum,beadRem,prevBeads,beadPoses)))
+    return(compositor.compose(key,drawBackground,layers))
 
 #Function to launch the prediction screen
-def predict(win,predText,cross,items,itemNames,positions,respPos,subSlider,prevBeads,trial,beadPoses,mouse,bounds):
+@frameProfiler.section('predict')
+# In scanner mode (scan = onsets of the block) the screen comes on at the scheduled bead onset and the response window is capped at respWindow
+def predict(win,predText,cross,items,itemNames,positions,respPos,subSlider,prevBeads,trial,beadPoses,mouse,bounds,scan = None):
     #Short blank screen
     win.flip()
-    core.wait(.25)
+    if scan is None:
+        core.wait(.25)
 
     #Draw stimuli and text to indicate whether they are responding to coins or people
     cTexts = ["Very confident\n%s"%itemNames[0],"Not Sure","Very confident\n%s"%itemNames[1]]
     if trial == 1:
         getResp_screen = drawConfLines(confLines,confText,cTexts,items,cross,positions,prevBeads,trial,beadPoses,predText = predText)
     else:
-        subSlider.setColor('blue')
-        getResp_screen = drawConfLines(confLines,confText,cTexts,items,cross,positions,prevBeads,trial,beadPoses,predText = predText,subSlider = subSlider)
-        subSlider.setColor('red')
+        getResp_screen = drawConfLines(confLines,confText,cTexts,items,cross,positions,prevBeads,trial,beadPoses,predText = predText,subSlider = subSlider,sliderColor = 'blue')
     getResp_screen.draw()
-    win.flip()
+    subSlider.setPos((0,cfY))
+    if scan is None:
+        onset = win.flip()
+    else:
+        onset = scanTimer.flipAt('bead',scan['beads'][trial-1],scan['block'],trial)
+    mouse.clickReset()
+    if eyeRec is not None:
+        eyeRec.message('RESPONSE_ONSET',t = onset)
     
-    #Get confidence judgement
+    #Get confidence judgement - one mouse sample per frame, timed on the monotonic clock
     mouse.setVisible(True)
-    subSlider.setPos((0,cfY))
+    rlog = ResponseLog(onset)
     conf = None
     while True:
         keys = event.getKeys(keyList = ['q','escape'])
         if len(keys):
             datafile.close()
+            trajfile.close()
+            if eyeRec is not None:
+                eyeRec.close()
             core.quit()
+        if scan is not None and core.getTime()-onset > scan['respWindow']:
+            timeout = onset+scan['respWindow'] #when the response window closed
+            side = None #no click in the response window counts as "Not Sure"
+            resp = None
+            conf = 0
+            break
         x,y = mouse.getPos()
-        pressed = mouse.getPressed()
+        pressed,pressTimes = mouse.getPressed(getTime = True)
+        rlog.add(core.getTime(),x,y,subSlider.pos[0],pressed[0])
         if pressed[0] == 1:
+            rlog.click = onset+pressTimes[0]
             if (x > -20) and (x < 20):
                side = None
                resp = None
@@ -313,18 +438,24 @@ def predict(win,predText,cross,items,itemNames,positions,respPos,subSlider,prevB
         getResp_screen.draw()
         subSlider.draw()
         win.flip()
-        time.sleep(1/60)
     
     
     getResp_screen = drawConfLines(confLines,confText,cTexts,items,cross,positions,prevBeads,trial,beadPoses,subSlider = subSlider)
     if side != None:
         resp = respPos[side]
+    if eyeRec is not None:
+        if np.isnan(rlog.click):
+            eyeRec.message('RESPONSE_TIMEOUT',t = timeout)
+        else:
+            eyeRec.message('RESPONSE %s %.2f'%(resp,conf),t = rlog.click)
     mouse.setVisible(False)
-    return([resp,round(conf,2),side,getResp_screen])
+    return([resp,round(conf,2),side,getResp_screen,rlog])
 
 
 #Function to display coin
-def urnDraw(bead,cross,win,blkType):
+# In scanner mode (scan = onsets of the block) the text comes on drawLead seconds before the scheduled onset of bead number trial
+@frameProfiler.section('urnDraw')
+def urnDraw(bead,cross,win,blkType,scan = None,trial = None):
     # Test to tell the person that coin is being flipped
     if blkType == 'urn':
         txt = 'Drawing bead...'
@@ -333,12 +464,18 @@ def urnDraw(bead,cross,win,blkType):
 
     #Short blank screen
     win.flip()
-    core.wait(.25)
+    if scan is None:
+        core.wait(.25)
     
     # Show text for half a second
-    cFlipText = visual.TextStim(win,text = txt,height = 40)
+    cFlipText = stimCache.text(txt,height = 40)
     cFlipText.draw()
-    win.flip()
+    if scan is None:
+        drawOnset = win.flip()
+    else:
+        drawOnset = scanTimer.flipAt('draw',scan['beads'][trial-1]-drawLead,scan['block'],trial)
+    if eyeRec is not None:
+        eyeRec.message('DRAW_ONSET %s'%bead,t = drawOnset)
     core.wait(.75)
     
 #    #Coin on for a second
@@ -350,64 +487,12 @@ def urnDraw(bead,cross,win,blkType):
 #    win.flip()
 #    core.wait(1)
 
-def genTrials(blkType, freqUrn,rareUrn, ntrials,person = False):
-    if blkType == 'urn':
-        trials = np.random.uniform(0,1,ntrials)<.8
-        urns = [freqUrn]*ntrials
-        beadDraws = []
-        for i in np.arange(ntrials):
-            if trials[i] == True:
-                beadDraws.append(freqUrn)
-            else:
-                beadDraws.append(rareUrn)
-
-    elif blkType == 'hazard':
-        if person == 'low':
-            h = .2
-        elif person == 'high':
-            h = .8
-        currUrn = random.choice([freqUrn,rareUrn])
-        urns = []
-        beadDraws = []
-        for i in np.arange(ntrials):
-            urns.append(currUrn)
-            beadDraws.append(currUrn)
-            if np.random.uniform(0,1,1) < h:
-                if currUrn == freqUrn:
-                    currUrn = rareUrn
-                elif currUrn == rareUrn:
-                    currUrn = freqUrn
-    return urns, beadDraws
-
-#Convert confidence value into adjusted points value
-#def adjustConf(conf):
-#    intercept = -log(.05)+1
-#    normFact = intercept+log(.95)
-#    if conf <= .05:
-#        payoff = conf/.05
-#    elif conf < .95:
-#        payoff = intercept + log(conf)
-#    elif conf >= .95:
-#        payoff = intercept + log(.95)+(conf-.95)/.95
-#    return(payoff/normFact)
-
-def adjustConf(conf,slp,loBound=-.5,hiBound=.5):
-    lowestVal = 1/(1+np.exp(-loBound/slp))
-    highestVal = 1/(1+np.exp(-hiBound/slp))
-    normFact = highestVal-lowestVal 
-    if conf <= loBound:
-        rew = 0
-    elif conf >= hiBound:
-        rew = 1
-    else:
-        rew = ((1/(1+np.exp(-conf/slp)))-lowestVal)/normFact
-    pay = (rew*2)-1 #adjust to put on a -1,1 scale
-    return(pay)
-
 # Feedback screen
-def feedback(response,correct,rside,conf,imBuffer,totPoints,fbPositions = [leftPos,rightPos]):
+@frameProfiler.section('feedback')
+def feedback(response,correct,rside,conf,imBuffer,totPoints,cfg,fbPositions = [leftPos,rightPos],scan = None):
     win.flip()
-    core.wait(.5)
+    if scan is None:
+        core.wait(.5)
     #Figure out how many points the person can get/lose
     if rside != None:
         fbPos = fbPositions[rside]
@@ -417,33 +502,40 @@ def feedback(response,correct,rside,conf,imBuffer,totPoints,fbPositions = [leftP
         points = 0
         imBuffer.draw()
     elif response == correct:
-        points = 10*adjustConf(conf/2,.08) #adjusted reward - logit with slope = to .08
+        points = 10*adjustConf(conf/2,cfg.slope) #adjusted reward - logit with slope = cfg.slope (.08 by default)
         pcol = 'green'
         imBuffer.draw()
-        fb = visual.Rect(win,height=sy*.12,width=sy*.12,fillColor=(0,1,0),lineWidth=0,opacity = .5)
+        fb = stimCache.rect(width=sy*.12,height=sy*.12,fillColor=(0,1,0),lineWidth=0,opacity = .5)
         fb.setPos(fbPos)
         fb.draw()
     elif response != correct:
         points = -10*conf #linear punishment
         pcol = 'red'
-        fb = visual.TextStim(win,text = 'X', height = 100,color = 'red')
+        fb = stimCache.text('X', height = 100,color = 'red')
         imBuffer.draw()
         fb.setPos(fbPos)
         fb.draw()
     points = round(points)
-    pointsText = visual.TextStim(win,text = '%d points'%points,height = 30,color=pcol,pos=(0,sy*.25))
+    pointsText = stimCache.text('%d points'%points,height = 30,color=pcol,pos=(0,sy*.25))
     pointsText.draw()
 
-    win.flip()
-    core.wait(1)
+    if scan is None:
+        fbOnset = win.flip()
+    else:
+        fbOnset = scanTimer.flipAt('feedback',scan['feedback'],scan['block'])
+    if eyeRec is not None:
+        eyeRec.message('FEEDBACK %d %d'%(response == correct,points),t = fbOnset)
+    core.wait(1 if scan is None else scan['fbDur'])
     return response == correct,points
 
 #Function to run blocks of trials
-def trialBlockRun(ntrials,subInfo,blkType,tblock,items,itemNames,positions,respPos,predText,beads,trialID,totScore,dfile=datafile,instruct = False):
+# beadSeq replaces the generated bead draws, and the beads and reports of the block are appended to blockLog if given
+# scan (scanner mode) holds the scheduled onsets of the block (blockOnsets in UrnScanner.py)
+def trialBlockRun(ntrials,subInfo,blkType,tblock,items,itemNames,positions,respPos,predText,beads,trialID,totScore,cfg,dfile=datafile,instruct = False,beadSeq = None,blockLog = None,scan = None):
 
     #Show person that new trial block is starting
     if blkType == 'urn':
-        trialBlockType('Current Score: %d\n\n\nPress space to start draws from a new container'%totScore,win)
+        trialBlockType('Current Score: %d\n\n\nPress space to start draws from a new container'%totScore if scan is None else 'Current Score: %d\n\n\nNew container'%totScore,win,scan)
         person = False
         if trialID == 1:
             rareID = 0
@@ -452,26 +544,44 @@ def trialBlockRun(ntrials,subInfo,blkType,tblock,items,itemNames,positions,respP
         freqUrn = itemNames[trialID]
         rareUrn = itemNames[rareID]
     else:
-        trialBlockType('Current Score: %d\n\n\nPress space to start draws from a new person'%totScore,win)
+        trialBlockType('Current Score: %d\n\n\nPress space to start draws from a new person'%totScore if scan is None else 'Current Score: %d\n\n\nNew person'%totScore,win,scan)
         person = itemNames[trialID]
         freqUrn = 'orange'
         rareUrn = 'blue'
 
-    urns,trials = genTrials(blkType,freqUrn,rareUrn,ntrials,person=person)
+    urns,trials = genTrials(blkType,freqUrn,rareUrn,ntrials,person=person,cfg=cfg)
+    if beadSeq is not None:
+        trials = beadSeq
     print('Generating Urn:'+itemNames[trialID])
+    phase = 'practice' if instruct else 'main'
+    if eyeRec is not None:
+        eyeRec.message('BLOCK_START %s %d %s %s'%(blkType,tblock,itemNames[trialID],phase))
     mouse.setPos((0,0))
+    canon = ['orange','blue'] if blkType == 'urn' else ['low','high']
+    reports = []
     for i in np.arange(len(trials)):
-        urnDraw(trials[i],cross,win,blkType)
-        start = time.time()
-        response,confidence,side,respScreen = predict(win,predText,cross,items,itemNames,positions,respPos,subLine,trials,i+1,posSet,mouse,lbounds)
+        if eyeRec is not None:
+            eyeRec.message('TRIALID %s %d %d %s'%(blkType,tblock,i+1,phase))
+        urnDraw(trials[i],cross,win,blkType,scan,i+1)
+        response,confidence,side,respScreen,rlog = predict(win,predText,cross,items,itemNames,positions,respPos,subLine,trials,i+1,posSet,mouse,lbounds,scan = scan)
         print('Response:'+str(response))
         print('Confidence:'+str(confidence))
+        reports.append(confidence if response == canon[1] else (-confidence if response == canon[0] else 0))
+        if eyeRec is not None:
+            eyeRec.message('TRIAL_RESULT 0')
         if instruct == False:
-            recDat(dfile,[subInfo[0],subInfo[1],subInfo[2],subInfo[3],blkType,tblock,i+1,itemNames[trialID],trials[i],itemNames[0],itemNames[1],side,response,confidence,'NA','NA',str(time.time()-start)])
-    correct,tScore = feedback(response,itemNames[trialID],side,confidence,respScreen,totScore)
+            recDat(dfile,[subInfo[0],subInfo[1],subInfo[2],subInfo[3],blkType,tblock,i+1,itemNames[trialID],trials[i],itemNames[0],itemNames[1],side,response,confidence,'NA','NA','NA' if np.isnan(rlog.click) else str(rlog.rt())])
+            trajfile.write(tblock,i+1,blkType,rlog)
+    correct,tScore = feedback(response,itemNames[trialID],side,confidence,respScreen,totScore,cfg,scan = scan)
+    if eyeRec is not None:
+        eyeRec.message('BLOCK_END %s %d'%(blkType,tblock))
     print([totScore,tScore])
     if instruct == False:
         recDat(dfile,[subInfo[0],subInfo[1],subInfo[2],subInfo[3],blkType,tblock,i+1,itemNames[trialID],'NA',itemNames[0],itemNames[1],side,response,confidence,int(correct),tScore,'NA'])
+        dfile.flush(wait = False) #write out the block at the block boundary
+        trajfile.flush()
+    if blockLog is not None:
+        blockLog.append(([['orange','blue'].index(b) for b in trials],reports))
     return(tScore)
 
 
@@ -479,10 +589,12 @@ def trialBlockRun(ntrials,subInfo,blkType,tblock,items,itemNames,positions,respP
 ## INSTRUCTIONS ##
 ##################
 
-def urnInstructions(blueUrn,orangeUrn,beads,leftPos,rightPos):
+@frameProfiler.section('urnInstructions')
+def urnInstructions(blueUrn,orangeUrn,beads,leftPos,rightPos,cfg):
     # Display instruction text for urn condition
     txt1 = 'In this part of the task, you will see blue and orange beads and be asked to guess from which container the beads are being drawn.'
-    txt2 = 'One of the containers has 80% orange beads and 20% blue beads.\n\nThe other container has 80% blue beads and 20% orange beads'
+    freq,rare = round(100*cfg.urnBias),round(100*(1-cfg.urnBias))
+    txt2 = 'One of the containers has %d%% orange beads and %d%% blue beads.\n\nThe other container has %d%% blue beads and %d%% orange beads'%(freq,rare,freq,rare)
     txt3 = 'In this part of the task you will see between 1 and 5 beads drawn from one of the two containers.\n\nAfter every bead is drawn you will be asked to rate how confident you are that the beads are being drawn from the orange or blue container.'
     txt4 = 'When the beads are done being drawn from the container, you will get points for your predictions.\n\nIf you guess correctly, you will get between 0 and 10 points, depending on how confident you were in your answer.\n\nIf you guess incorrectly, you will lose between 0 and 10 points.\n\nAnswering "not sure" will not result in gaining or losing any points.'
     txt5 = 'To get the most points by the end of the task, the best strategy is to report your confidence as accurately as possible.'
@@ -490,7 +602,7 @@ def urnInstructions(blueUrn,orangeUrn,beads,leftPos,rightPos):
     txtList = [txt1,txt2,txt3,txt4,txt5,txt6]
     for i in np.arange(len(txtList)):
         t = txtList[i]+'\n\nPress any key to continue'
-        txtStim = visual.TextStim(win,t,height = 40,wrapWidth = sx*.8)
+        txtStim = stimCache.text(t,height = 40,wrapWidth = sx*.8)
         txtStim.draw()
         win.flip()
         getKeypress()
@@ -498,7 +610,7 @@ def urnInstructions(blueUrn,orangeUrn,beads,leftPos,rightPos):
     blueUrn.setPos((0,0))
     
     #Examples of beads drawn from orange container
-    orangeTxt = visual.TextStim(win,text = 'Press any key to see examples of beads drawn from the orange container',height = 40,wrapWidth = sx*.8)
+    orangeTxt = stimCache.text('Press any key to see examples of beads drawn from the orange container',height = 40,wrapWidth = sx*.8)
     orangeTxt.draw()
     win.flip()
     getKeypress()
@@ -515,7 +627,7 @@ def urnInstructions(blueUrn,orangeUrn,beads,leftPos,rightPos):
         core.wait(.75)
     
     #Examples of beads drawn from blue container
-    blueTxt = visual.TextStim(win,text = 'Press any key to see examples of beads drawn from the blue container',height = 40,wrapWidth = sx*.8)
+    blueTxt = stimCache.text('Press any key to see examples of beads drawn from the blue container',height = 40,wrapWidth = sx*.8)
     blueTxt.draw()
     win.flip()
     getKeypress()
@@ -530,16 +642,17 @@ def urnInstructions(blueUrn,orangeUrn,beads,leftPos,rightPos):
         t.draw()
         win.flip()
         core.wait(.75)
-    exTrialText = visual.TextStim(win,text = 'Press any key to run through example trials',height = 40,wrapWidth = sx*.8)
+    exTrialText = stimCache.text('Press any key to run through example trials',height = 40,wrapWidth = sx*.8)
     exTrialText.draw()
     win.flip()
     getKeypress()
 
 #Instructions for hazard rate block
-def hazardInstructions(blueFullUrn,orangeFullUrn,loPerson,hiPerson,beads,leftPos,rightPos):
+@frameProfiler.section('hazardInstructions')
+def hazardInstructions(blueFullUrn,orangeFullUrn,loPerson,hiPerson,beads,leftPos,rightPos,cfg):
     # Display instruction text for hazard condition
     txt1 = 'In this part of the task, two people will be drawing beads from containers containing only orange or only blue beads.'
-    txt2 = 'Each person switches between the containers at different rates.\n\nOne person (low switcher) switches between containers 20% of the time.\n\nThe other person (high switcher) switches between containers 80% of the time.'
+    txt2 = 'Each person switches between the containers at different rates.\n\nOne person (low switcher) switches between containers %d%% of the time.\n\nThe other person (high switcher) switches between containers %d%% of the time.'%(round(100*cfg.hazards[0]),round(100*cfg.hazards[1]))
     txt3 = 'In this part of the task you will see between 1 and 5 beads drawn from one of the two people.\n\nAfter every bead is drawn you will be asked to rate how confident you are that the beads are being drawn by the low switcher or the high switcher.'
     txt4 = 'After the person is done drawing beads, you will get points for your predictions.\n\nIf you guess correctly, you will get between 0 and 10 points, depending on how confident you were in your answer.\n\nIf you guess incorrectly, you will lose between 0 and 10 points.\n\nAnswering "not sure" will not result in gaining or losing any points.'
     txt5 = 'To get the most points by the end of the task, the best strategy is to report your confidence as accurately as possible.'
@@ -547,7 +660,7 @@ def hazardInstructions(blueFullUrn,orangeFullUrn,loPerson,hiPerson,beads,leftPos
     txtList = [txt1,txt2,txt3,txt4,txt5,txt6]
     for i in np.arange(len(txtList)):
         t = txtList[i]+'\n\n\nPress any key to continue'
-        txtStim = visual.TextStim(win,t,height = 40,wrapWidth = sx*.8)
+        txtStim = stimCache.text(t,height = 40,wrapWidth = sx*.8)
         txtStim.draw()
         win.flip()
         getKeypress()
@@ -558,7 +671,7 @@ def hazardInstructions(blueFullUrn,orangeFullUrn,loPerson,hiPerson,beads,leftPos
     hiPerson.setPos((0,sy*.25))
     
     #Examples of beads drawn from low switcher
-    lowTxt = visual.TextStim(win,text = 'Press any key to see examples of beads drawn from the person who switches infrequently',height = 40,wrapWidth = sx*.8)
+    lowTxt = stimCache.text('Press any key to see examples of beads drawn from the person who switches infrequently',height = 40,wrapWidth = sx*.8)
     lowTxt.draw()
     win.flip()
     getKeypress()
@@ -578,7 +691,7 @@ def hazardInstructions(blueFullUrn,orangeFullUrn,loPerson,hiPerson,beads,leftPos
         core.wait(.75)
     
     #Examples of beads drawn from high switcher
-    hiTxt = visual.TextStim(win,text = 'Press any key to see examples of beads drawn from the person who switches frequently',height = 40,wrapWidth = sx*.8)
+    hiTxt = stimCache.text('Press any key to see examples of beads drawn from the person who switches frequently',height = 40,wrapWidth = sx*.8)
     hiTxt.draw()
     win.flip()
     getKeypress()
@@ -596,7 +709,7 @@ def hazardInstructions(blueFullUrn,orangeFullUrn,loPerson,hiPerson,beads,leftPos
         trials[i].draw()
         win.flip()
         core.wait(.75)
-    exTrialText = visual.TextStim(win,text = 'Press any key to run through example trials',height = 40,wrapWidth = sx*.8)
+    exTrialText = stimCache.text('Press any key to run through example trials',height = 40,wrapWidth = sx*.8)
     exTrialText.draw()
     win.flip()
     getKeypress()
@@ -604,56 +717,43 @@ def hazardInstructions(blueFullUrn,orangeFullUrn,loPerson,hiPerson,beads,leftPos
 ##################
 ## TRIAL HANDLER ##
 ##################
-subInfo = [subID,age,sex,cond]
-# Based on the conditon set which type of trils goes first
-if cond == 1:
-    blkTypes = ['urn','hazard']
-    scoreInd = [0,1]
-else:
-    blkTypes = ['hazard','urn']
-    scoreInd = [1,0]
-
-#Iterate through different block types
-
-
-totalScore = [0,0]
-startText = visual.TextStim(win,text='Press any key to start the first part of the experiment.',height = 40,wrapWidth = sx*.8)
-startText.draw()
-win.flip()
-getKeypress()
-for cnt in np.arange(len(blkTypes)):
-    if blkTypes[cnt] == 'urn':
-        itemNames = ['orange','blue']
-        items = [orangeUrn,blueUrn]
-        predText = urnPredText
-    elif blkTypes[cnt] == 'hazard':
-        itemNames = ['low','high']
-        items = [low,high]
-        predText = hazardPredText
-    positions = [leftPos,rightPos]
-    tScore = 100
-    instrBlocks = [4]
-    intrIDs = [1]
-    if blkTypes[cnt] == 'urn' and test == False:
-        urnInstructions(blueUrn,orangeUrn,beads,leftPos,rightPos)
-        for i in np.arange(len(instrBlocks)):
-            positions = [leftPos,rightPos]
-            respPos = itemNames
-            extscore = trialBlockRun(instrBlocks[i],subInfo,blkTypes[cnt],i+1,items,itemNames,positions,respPos,predText,beads,intrIDs[i],tScore,instruct =True)
-    elif blkTypes[cnt] == 'hazard' and test == False:
-        hazardInstructions(blueFullUrn,orangeFullUrn,low,high,beads,leftPos,rightPos)
-        for i in np.arange(len(instrBlocks)):
-            positions = [leftPos,rightPos]
-            respPos = itemNames
-            extscore = trialBlockRun(instrBlocks[i],subInfo,blkTypes[cnt],i+1,items,itemNames,positions,respPos,predText,beads,intrIDs[i],tScore,instruct =True)
-    win.flip()
-    core.wait(.75)
-    text = visual.TextStim(win,'\n\nEnd of instructions.\n\nPress any key to start the real trials.',height = 40,wrapWidth = sx*.8)
-    text.draw()
+#Function to run the whole session (instructions, both block types and the end screen)
+# cfg and schedule (trialBlocks, trialIDs) default to the ones made when the task was loaded
+def runSession(cfg = None,schedule = None):
+    if cfg is None:
+        cfg = sessionConfig
+        if schedule is None:
+            schedule = (trialBlocks,trialIDs)
+    elif schedule is None:
+        schedule = makeSchedule(cfg)
+    blocks,blockIDs = schedule
+    # Scanner mode: the blocks of each run come from the onset schedule
+    if scanTimer is not None:
+        if adaptive:
+            raise ValueError('adaptive block sequencing cannot be used with a fixed scanner onset schedule')
+        scanSched = scanSchedule if scanSchedule is not None else makeScanSchedule(blocks,blockIDs)
+        blocks,blockIDs = scanSched.trialBlocks,scanSched.trialIDs
+    subInfo = [subID,age,sex,cond]
+    # Based on the conditon set which type of trils goes first
+    if cond == 1:
+        blkTypes = ['urn','hazard']
+        scoreInd = [0,1]
+    else:
+        blkTypes = ['hazard','urn']
+        scoreInd = [1,0]
+
+    #Iterate through different block types
+
+
+    totalScore = [0,0]
+    designs = []
+    if eyeRec is not None:
+        eyeRec.start()
+    startText = stimCache.text('Press any key to start the first part of the experiment.',height = 40,wrapWidth = sx*.8)
+    startText.draw()
     win.flip()
     getKeypress()
-    #Run through Trials
-    for i in np.arange(len(trialBlocks)):
+    for cnt in np.arange(len(blkTypes)):
         if blkTypes[cnt] == 'urn':
             itemNames = ['orange','blue']
             items = [orangeUrn,blueUrn]
@@ -663,29 +763,118 @@ for cnt in np.arange(len(blkTypes)):
             items = [low,high]
             predText = hazardPredText
         positions = [leftPos,rightPos]
-        if np.random.uniform(0,1,1) < .5:
-            positions = [rightPos,leftPos]
-            itemNames = [itemNames[1],itemNames[0]]
-        respPos = itemNames
-        tscore = trialBlockRun(trialBlocks[i],subInfo,blkTypes[cnt],i+1,items,itemNames,positions,respPos,predText,beads,trialIDs[i],tScore)
-        tScore += round(tscore)
-        totalScore[scoreInd[cnt]] = tScore
-    if cnt == 0:
-        endText = visual.TextStim(win,text='End of first part.\n\nPress any key to start the instructions for the second part of the experiment.',height = 40,wrapWidth = sx*.8)
-        endText.draw()
+        tScore = cfg.startScore
+        instrBlocks = cfg.instrBlocks
+        intrIDs = cfg.instrIDs
+        blockLog = []
+        beadSeqs = [None]*len(instrBlocks)
+        if adaptive:
+            design = AdaptiveDesign(blkTypes[cnt],cfg,schedule)
+            designs.append(design)
+        if blkTypes[cnt] == 'urn' and test == False:
+            urnInstructions(blueUrn,orangeUrn,beads,leftPos,rightPos,cfg)
+            for i in np.arange(len(instrBlocks)):
+                positions = [leftPos,rightPos]
+                respPos = itemNames
+                if adaptive:
+                    beadSeqs[i] = [['orange','blue'][b] for b in design.calibration(instrBlocks[i],intrIDs[i])]
+                extscore = trialBlockRun(instrBlocks[i],subInfo,blkTypes[cnt],i+1,items,itemNames,positions,respPos,predText,beads,intrIDs[i],tScore,cfg,instruct =True,beadSeq = beadSeqs[i],blockLog = blockLog)
+                if adaptive:
+                    design.update(*blockLog[-1])
+        elif blkTypes[cnt] == 'hazard' and test == False:
+            hazardInstructions(blueFullUrn,orangeFullUrn,low,high,beads,leftPos,rightPos,cfg)
+            for i in np.arange(len(instrBlocks)):
+                positions = [leftPos,rightPos]
+                respPos = itemNames
+                if adaptive:
+                    beadSeqs[i] = [['orange','blue'][b] for b in design.calibration(instrBlocks[i],intrIDs[i])]
+                extscore = trialBlockRun(instrBlocks[i],subInfo,blkTypes[cnt],i+1,items,itemNames,positions,respPos,predText,beads,intrIDs[i],tScore,cfg,instruct =True,beadSeq = beadSeqs[i],blockLog = blockLog)
+                if adaptive:
+                    design.update(*blockLog[-1])
+        win.flip()
+        core.wait(.75)
+        text = stimCache.text('\n\nEnd of instructions.\n\nPress any key to start the real trials.',height = 40,wrapWidth = sx*.8)
+        text.draw()
         win.flip()
         getKeypress()
+        # Scanner mode: each part is one run, starting with the first trigger pulse
+        if scanTimer is not None:
+            waitText = stimCache.text('Waiting for the scanner...',height = 40,wrapWidth = sx*.8)
+            waitText.draw()
+            win.flip()
+            scanTimer.startRun(blkTypes[cnt],scanSched.tr)
+        #Run through Trials
+        for i in np.arange(len(blocks)):
+            if blkTypes[cnt] == 'urn':
+                itemNames = ['orange','blue']
+                items = [orangeUrn,blueUrn]
+                predText = urnPredText
+            elif blkTypes[cnt] == 'hazard':
+                itemNames = ['low','high']
+                items = [low,high]
+                predText = hazardPredText
+            canonNames = itemNames
+            positions = [leftPos,rightPos]
+            if np.random.uniform(0,1,1) < .5:
+                positions = [rightPos,leftPos]
+                itemNames = [itemNames[1],itemNames[0]]
+            respPos = itemNames
+            ntrials,trialID = blocks[i],blockIDs[i]
+            if scanTimer is not None:
+                # Scanner schedules give canonical items (0 = orange/low, 1 = blue/high, as optimised in UrnSchedule.py)
+                trialID = itemNames.index(canonNames[blockIDs[i]])
+            if adaptive:
+                ntrials,gen = design.next()
+                trialID = itemNames.index(canonNames[gen])
+            scan = blockOnsets(scanSched,i) if scanTimer is not None else None
+            tscore = trialBlockRun(ntrials,subInfo,blkTypes[cnt],i+1,items,itemNames,positions,respPos,predText,beads,trialID,tScore,cfg,blockLog = blockLog,scan = scan)
+            if adaptive:
+                design.update(*blockLog[-1])
+            tScore += round(tscore)
+            totalScore[scoreInd[cnt]] = tScore
+        if scanTimer is not None:
+            scanTimer.endRun(scanSched.runDur)
+        if cnt == 0:
+            endText = stimCache.text('End of first part.\n\nPress any key to start the instructions for the second part of the experiment.',height = 40,wrapWidth = sx*.8)
+            endText.draw()
+            win.flip()
+            getKeypress()
+
+    datafile.close()
+    trajfile.close()
+    if eyeRec is not None:
+        eyeRec.close()
+    if scanTimer is not None:
+        scanTimer.close()
+    if saveColumnar:
+        convertCsv(datafile.fname)
+    win.flip()
+    core.wait(.5)
 
-win.flip()
-core.wait(.5)
-
-ub = 660
-endow = 200
-cashBonus = round(((sum(totalScore)-endow)/ub)*10)
-if cashBonus > 10:
-    cashBonus = 10
-endScreen = visual.TextStim(win,text = 'Experiment done! Thank you for your participation!\n\nFinal container score: %s\n\nFinal person score: %s\n\nTotal Score: %s\n\nCash Bonus: $%s'%(str(int(round(totalScore[0]))),str(int(round(totalScore[1]))),str(int(round(sum(totalScore)))),str(int(round(cashBonus)))),height = 40,wrapWidth = sx*.8)
-endScreen.draw()
-win.flip()
-getKeypress()
+    ub = cfg.ub
+    endow = cfg.endow
+    cashBonus = round(((sum(totalScore)-endow)/ub)*10)
+    if cashBonus > 10:
+        cashBonus = 10
+    endScreen = stimCache.text('Experiment done! Thank you for your participation!\n\nFinal container score: %s\n\nFinal person score: %s\n\nTotal Score: %s\n\nCash Bonus: $%s'%(str(int(round(totalScore[0]))),str(int(round(totalScore[1]))),str(int(round(sum(totalScore)))),str(int(round(cashBonus)))),height = 40,wrapWidth = sx*.8)
+    endScreen.draw()
+    win.flip()
+    print(stimCache.report())
+    print(compositor.report())
+    print(frameProfiler.report())
+    if eyeRec is not None:
+        print(eyeRec.report())
+    if scanTimer is not None:
+        print(scanTimer.report())
+    for design in designs:
+        print(design.report())
+    # The startup and scanner onset reports are kept with the session in <data file>.timing.txt
+    extra = [startupLog.report()]
+    if scanTimer is not None:
+        extra.append(scanTimer.report())
+    frameProfiler.save(datafile.fname,extra = '\n'.join(extra))
+    getKeypress()
+    return(totalScore)
 
+if __name__ == '__main__':
+    runSession()
@@ -0,0 +1,151 @@
+import numpy as np
+import functools, sys, time
+
+'''
+Frame timing instrumentation for the Urn Hazard prediction task
+
+FrameProfiler replaces win.flip with a timed version. It records, for each section of the task (predict, feedback, urnDraw, instructions...):
+    - the interval between the return of the previous flip and this one
+    - how long the flip call itself blocked
+It also keeps draw and I/O durations for named groups (response screen layers from the Compositor, recDat). Flips are timed on the clock passed in (core.getTime in the task), groups always on time.perf_counter.
+
+Intervals longer than holdFrames frames are the task deliberately holding a screen (core.wait, key waits). They are counted as holds and left out of the frame statistics. A frame interval over 1.5 refresh periods (and not a hold) is a dropped frame.
+
+At the end of a session UrnTask.py prints the report and saves it as <data file>.timing.txt, with the raw intervals in <data file>.timing.npz. Print the report of a saved session again with:
+    python UrnTiming.py data/SUBJ_CoinTask_<date>.csv.timing.npz
+'''
+
+holdFrames = 10 #intervals longer than this many frames are screen holds, not frames
+
+#Timing of flips and draw groups for one window
+class FrameProfiler:
+    def __init__(self,frameDur = 1/60.,clock = time.perf_counter):
+        self.frameDur = frameDur
+        self.clock = clock
+        self.current = 'other'
+        self.lastFlip = None
+        self.intervals = {} #section -> list of flip-to-flip intervals (s)
+        self.flipDurs = {} #section -> list of flip call durations (s)
+        self.groups = {} #group -> list of durations (s)
+
+    #Replace win.flip with the timed version
+    def attach(self,win):
+        self.frameDur = getattr(win,'monitorFramePeriod',None) or self.frameDur
+        flip = win.flip
+        def timedFlip(*args,**kwargs):
+            start = self.clock()
+            res = flip(*args,**kwargs)
+            end = self.clock()
+            self.flipDurs.setdefault(self.current,[]).append(end-start)
+            if self.lastFlip is not None:
+                self.intervals.setdefault(self.current,[]).append(end-self.lastFlip)
+            self.lastFlip = end
+            return res
+        win.flip = timedFlip
+        return win
+
+    #Decorator: flips inside the function are counted under section name
+    def section(self,name):
+        def decorate(fn):
+            @functools.wraps(fn)
+            def wrapped(*args,**kwargs):
+                prev,self.current = self.current,name
+                try:
+                    return fn(*args,**kwargs)
+                finally:
+                    self.current = prev
+            return wrapped
+        return decorate
+
+    #Add one duration (s) for a draw or I/O group
+    def record(self,group,dur):
+        self.groups.setdefault(group,[]).append(dur)
+
+    #Context manager timing a block of code under a group name
+    def timer(self,group):
+        return GroupTimer(self,group)
+
+    def report(self):
+        return timingReport(self.frameDur,self.intervals,self.flipDurs,self.groups)
+
+    #Save the report (<base>.timing.txt, with any extra text appended) and the raw timings (<base>.timing.npz)
+    def save(self,base,extra = None):
+        with open(base+'.timing.txt','w') as f:
+            f.write(self.report()+'\n')
+            if extra:
+                f.write(extra+'\n')
+        arrays = {'frameDur':np.array(self.frameDur)}
+        for prefix,store in [('interval',self.intervals),('flip',self.flipDurs),('group',self.groups)]:
+            for name,vals in store.items():
+                arrays['%s:%s'%(prefix,name)] = np.array(vals)
+        np.savez(base+'.timing.npz',**arrays)
+
+#Times one block of code for FrameProfiler.timer
+class GroupTimer:
+    def __init__(self,profiler,group):
+        self.profiler = profiler
+        self.group = group
+    def __enter__(self):
+        self.start = time.perf_counter()
+        return self
+    def __exit__(self,*exc):
+        self.profiler.record(self.group,time.perf_counter()-self.start)
+        return False
+
+#Text histogram of frame intervals in ms
+def intervalHistogram(intervals,frameDur,width = 40):
+    if len(intervals) == 0:
+        return ['  (no frames)']
+    ms = 1000*np.asarray(intervals)
+    edges = np.arange(0,1000*frameDur*holdFrames+2,2.)
+    counts,edges = np.histogram(np.minimum(ms,edges[-1]-1e-9),bins = edges)
+    lines = []
+    scale = width/float(counts.max())
+    for c,lo,hi in zip(counts,edges[:-1],edges[1:]):
+        if c:
+            lines.append('  %5.1f-%5.1f ms %7d %s'%(lo,hi,c,'#'*max(1,int(round(c*scale)))))
+    return lines
+
+#Per-section timing report
+def timingReport(frameDur,intervals,flipDurs,groups):
+    lines = ['Frame timing (refresh %.2f ms)'%(1000*frameDur)]
+    allFrames = []
+    totalDropped = 0
+    for name in sorted(set(intervals) | set(flipDurs)):
+        iv = np.asarray(intervals.get(name,[]))
+        frames = iv[iv <= holdFrames*frameDur]
+        dropped = int(np.sum(frames > 1.5*frameDur))
+        totalDropped += dropped
+        allFrames.append(frames)
+        fd = np.asarray(flipDurs.get(name,[]))
+        line = '  %s: %d flips, %d holds'%(name,len(fd),len(iv)-len(frames))
+        if len(frames):
+            line += ', frame interval mean %.2f ms, max %.2f ms, %d dropped'%(1000*frames.mean(),1000*frames.max(),dropped)
+        if len(fd):
+            line += ', flip call max %.2f ms'%(1000*fd.max())
+        lines.append(line)
+    for name in sorted(groups):
+        d = np.asarray(groups[name])
+        lines.append('  %s: %d calls, mean %.3f ms, max %.3f ms'%(name,len(d),1000*d.mean(),1000*d.max()))
+    allFrames = np.concatenate(allFrames) if allFrames else np.zeros(0)
+    lines.append('Frame intervals:')
+    lines += intervalHistogram(allFrames,frameDur)
+    lines.append('%d dropped frames out of %d'%(totalDropped,len(allFrames)))
+    return '\n'.join(lines)
+
+#Report from a saved .timing.npz file
+def loadReport(fname):
+    stores = {'interval':{},'flip':{},'group':{}}
+    with np.load(fname) as f:
+        frameDur = float(f['frameDur'])
+        for k in f.files:
+            if ':' in k:
+                prefix,name = k.split(':',1)
+                stores[prefix][name] = f[k]
+    return timingReport(frameDur,stores['interval'],stores['flip'],stores['group'])
+
+if __name__ == '__main__':
+    if len(sys.argv) != 2:
+        print('usage: python UrnTiming.py <file.timing.npz>')
+        sys.exit(1)
+    print(loadReport(sys.argv[1]))
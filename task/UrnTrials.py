@@ -0,0 +1,131 @@
+import numpy as np
+import random, time
+
+from UrnConfig import hazardRate
+
+'''
+Trial generation for the Urn Hazard prediction task
+
+genTrials is the per-draw generator used by UrnTask.py to build one block of bead draws at a time.
+genTrialsBatch builds many blocks at once as NumPy arrays, for pre-generating and auditing large numbers of sequences (counterbalancing, power analyses). Both draw from the same distribution.
+
+urnBias and hazardRates are the default generative parameters of the task. genTrials uses the values of a session config instead when given one (see UrnConfig.py), as does the lookup table in UrnObserver.py.
+
+Array coding used by the batch generator:
+    - urns/beads: 0 = orange, 1 = blue, -1 = past the end of the block
+    - gens: 0 = orange/low, 1 = blue/high (same coding as trialIDs in UrnTask.py)
+
+Run this file directly to benchmark the batch generator against the per-draw path:
+    python UrnTrials.py --nblocks 20000
+'''
+
+# Generative parameters
+urnBias = .8 #probability of drawing the frequent bead from an urn
+hazardRates = {'low':.2,'high':.8} #switch probability of each person
+
+#Function to generate one block of urns and bead draws (one draw at a time)
+def genTrials(blkType, freqUrn,rareUrn, ntrials,person = False,cfg = None):
+    if blkType == 'urn':
+        p = urnBias if cfg is None else cfg.urnBias
+        trials = np.random.uniform(0,1,ntrials)<p
+        urns = [freqUrn]*ntrials
+        beadDraws = []
+        for i in np.arange(ntrials):
+            if trials[i] == True:
+                beadDraws.append(freqUrn)
+            else:
+                beadDraws.append(rareUrn)
+
+    elif blkType == 'hazard':
+        h = hazardRates[person] if cfg is None else hazardRate(cfg,person)
+        currUrn = random.choice([freqUrn,rareUrn])
+        urns = []
+        beadDraws = []
+        for i in np.arange(ntrials):
+            urns.append(currUrn)
+            beadDraws.append(currUrn)
+            if np.random.uniform(0,1,1) < h:
+                if currUrn == freqUrn:
+                    currUrn = rareUrn
+                elif currUrn == rareUrn:
+                    currUrn = freqUrn
+    return urns, beadDraws
+
+#Function to generate a whole batch of blocks at once
+def genTrialsBatch(blkType,gens,ntrials,rng,p = None,hazards = None,maxLen = None):
+    # Arguments:
+    #     - blkType: 'urn' or 'hazard'
+    #     - gens: generating item for each block (0 = orange/low, 1 = blue/high)
+    #     - ntrials: number of draws in each block (scalar or one value per block)
+    #     - rng: seeded np.random.Generator
+    #     - p: probability of drawing the frequent bead from an urn (urn blocks, defaults to urnBias)
+    #     - hazards: switch probabilities of the low and high person (hazard blocks, defaults to hazardRates)
+    #     - maxLen: number of columns of the output (defaults to the longest block)
+    # Output:
+    #     - urns, beads: int8 arrays of shape (n_blocks, maxLen), padded with -1 past the end of each block
+    if p is None:
+        p = urnBias
+    if hazards is None:
+        hazards = (hazardRates['low'],hazardRates['high'])
+    gens = np.asarray(gens,dtype = np.int8)
+    nblocks = len(gens)
+    ntrials = np.broadcast_to(np.asarray(ntrials),(nblocks,))
+    if maxLen is None:
+        maxLen = int(ntrials.max()) if nblocks else 0
+    valid = np.arange(maxLen)[None,:] < ntrials[:,None]
+
+    if blkType == 'urn':
+        urns = np.repeat(gens[:,None],maxLen,axis = 1)
+        rare = rng.random((nblocks,maxLen)) >= p
+        beads = urns ^ rare.astype(np.int8)
+    elif blkType == 'hazard':
+        h = np.asarray(hazards)[gens]
+        switches = rng.random((nblocks,max(maxLen-1,0))) < h[:,None]
+        first = rng.integers(0,2,nblocks,dtype = np.int8)
+        flips = np.zeros((nblocks,maxLen),dtype = np.int8)
+        flips[:,1:] = np.cumsum(switches,axis = 1) & 1
+        urns = first[:,None] ^ flips
+        beads = urns.copy()
+    else:
+        raise ValueError("blkType must be 'urn' or 'hazard', got %r"%(blkType,))
+
+    urns = np.where(valid,urns,-1).astype(np.int8)
+    beads = np.where(valid,beads,-1).astype(np.int8)
+    return urns, beads
+
+###############
+## BENCHMARK ##
+###############
+
+#Time the per-draw generator against the batch generator on the same block structure
+def benchGenTrials(nblocks = 20000,seed = 0):
+    rng = np.random.default_rng(seed)
+    lengths = rng.integers(1,6,nblocks)
+    gens = rng.integers(0,2,nblocks)
+    itemNames = {'urn':['orange','blue'],'hazard':['low','high']}
+    results = {}
+    for blkType in ['urn','hazard']:
+        start = time.perf_counter()
+        for i in np.arange(nblocks):
+            if blkType == 'urn':
+                freqUrn = itemNames['urn'][gens[i]]
+                rareUrn = itemNames['urn'][1-gens[i]]
+                genTrials(blkType,freqUrn,rareUrn,lengths[i])
+            else:
+                genTrials(blkType,'orange','blue',lengths[i],person = itemNames['hazard'][gens[i]])
+        loopTime = time.perf_counter()-start
+
+        start = time.perf_counter()
+        genTrialsBatch(blkType,gens,lengths,rng)
+        batchTime = time.perf_counter()-start
+        results[blkType] = (loopTime,batchTime)
+    return results
+
+if __name__ == '__main__':
+    import argparse
+    parser = argparse.ArgumentParser(description = 'Benchmark per-draw vs batch trial generation')
+    parser.add_argument('--nblocks',type = int,default = 20000)
+    parser.add_argument('--seed',type = int,default = 0)
+    args = parser.parse_args()
+    for blkType,(loopTime,batchTime) in benchGenTrials(args.nblocks,args.seed).items():
+        print('%s: per-draw %.3fs, batch %.4fs (%.0fx faster)'%(blkType,loopTime,batchTime,loopTime/batchTime))